@@ -6,15 +6,35 @@ Sử dụng Streamlit + Google Gemini LLM
 import os
 import glob
 import pandas as pd
-import google.generativeai as genai
 import streamlit as st
 import json
 import re
+import time
+import uuid
+import contextlib
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from io import BytesIO
-import plotly.express as px
-import plotly.graph_objects as go
 from dotenv import load_dotenv
+# Plotly và openpyxl không import ở đây: nạp lần đầu khi vẽ biểu đồ / khi người dùng tải Excel
+from llm_client import call_llm, count_tokens as llm_count_tokens
+from prompt_layout import analysis_prompt
+from context_cache import get_context_cache
+from metrics import get_metrics, track_mode, metrics_context, start_metrics_server, METRICS_ADMIN
+from profiling import start_profile, profile_section
+from llm_backend import LLM_BACKEND, get_llm_backend
+from csv_ingest import read_uploaded_csv, load_csv_files, csv_row_count
+from csv_summary import summarize_csv_files, summarize_dataframe
+from json_stream import IncrementalJSONParser, assign_path
+from excel_export import excel_download_data, result_id
+from result_history import ResultHistory, ANALYZED_AT_FORMAT
+from jobs import get_job_manager, JOB_POLL_SECONDS, QUEUED, DONE, ERROR
+from shop_names import use_shop_name, shop_name_suggestion, key_name_scope, fold_name, SHOP, LOCATION
+from followup_chat import FollowupChat
+from incremental import plan_incremental, INCREMENTAL_DEFAULT, UNCHANGED, UPDATE
+from swot_schema import (
+    JSON_MODE_DEFAULT, json_generation_config, parse_json_response, parse_json_block, render_analysis_markdown
+)
 
 # Load environment variables từ file .env (cho local development)
 load_dotenv()
@@ -28,11 +48,27 @@ try:
 except:
     GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
-if not GOOGLE_API_KEY:
+# Chỉ backend Gemini cần API key (SWOT_LLM_BACKEND=openai|fake thì không)
+if LLM_BACKEND == "gemini" and not GOOGLE_API_KEY:
     st.error("⚠️ Vui lòng cấu hình GOOGLE_API_KEY trong file .env hoặc Streamlit Secrets")
     st.stop()
-genai.configure(api_key=GOOGLE_API_KEY)
-model = genai.GenerativeModel('models/gemini-flash-latest')
+backend = get_llm_backend(api_key=GOOGLE_API_KEY)
+
+# Số liệu từng lời gọi LLM qua HTTP /metrics (SWOT_METRICS_PORT), chỉ khởi động một lần mỗi process
+try:
+    start_metrics_server()
+except OSError as e:
+    st.warning(f"⚠️ Không mở được cổng metrics: {e}")
+
+# Profile cả lượt chạy lại khi đặt SWOT_PROFILE_DIR (không làm gì nếu không đặt), dừng ở cuối file.
+# Stack theo session: lượt bị ngắt giữa chừng được dừng ở lượt sau dù chạy trên thread khác
+rerun_profile = start_profile("rerun", scope=st.session_state.setdefault("_profile_scope", uuid.uuid4().hex))
+
+# Số lời gọi Gemini chạy song song tối đa ở chế độ phân tích từng quán
+FANOUT_MAX_WORKERS = int(os.getenv("SWOT_FANOUT_MAX_WORKERS", 4))
+
+# Tùy chọn cache cho lời gọi chạy ngoài luồng script (job nền không đọc được st.session_state)
+use_cache_override = contextvars.ContextVar("swot_use_cache", default=None)
 
 # ============================================
 # PAGE CONFIG
@@ -87,72 +123,151 @@ def load_all_csv(data_folder="data"):
     
     all_data = []
     file_info = []
-    for file_path in csv_files:
-        try:
-            df = pd.read_csv(file_path)
-            all_data.append(df)
-            file_info.append({
-                "file": os.path.basename(file_path),
-                "rows": len(df),
-                "columns": list(df.columns)
-            })
-        except Exception as e:
-            st.error(f"Lỗi đọc {file_path}: {e}")
+    for file_path, df, error in load_csv_files(csv_files):
+        if error is not None:
+            st.error(f"Lỗi đọc {file_path}: {error}")
+            continue
+        all_data.append(df)
+        file_info.append({
+            "file": os.path.basename(file_path),
+            "rows": csv_row_count(df),
+            "columns": list(df.columns)
+        })
     return all_data, file_info
 
 
 def summarize_csv_data(dataframes, file_info):
     if not dataframes:
         return ""
-    summary = "📊 DỮ LIỆU TỪ CSV:\n"
-    for i, (df, info) in enumerate(zip(dataframes, file_info)):
-        summary += f"\n--- File: {info['file']} ---\n"
-        summary += f"Số dòng: {info['rows']}\n"
-        summary += f"Các cột: {', '.join(info['columns'])}\n"
-        for col in df.columns:
-            if df[col].dtype in ['int64', 'float64']:
-                summary += f"- {col}: min={df[col].min()}, max={df[col].max()}, avg={df[col].mean():.0f}\n"
-        summary += f"Mẫu dữ liệu:\n{df.head(5).to_string()}\n"
-    return summary
-
-
-def call_gemini(prompt):
-    response = model.generate_content(prompt)
-    return response.text
-
-
-def analyze_swot_with_scores(shop_name, csv_summary=""):
-    """Phân tích SWOT và trả về điểm số cho biểu đồ"""
-    context = f"\n{csv_summary}" if csv_summary else ""
-    
-    prompt = f"""
-Bạn là chuyên gia phân tích kinh doanh và là một Data Analyst trong lĩnh vực F&B tại Việt Nam.
-
-🏪 QUÁN CẦN PHÂN TÍCH: {shop_name}
-{context}
-
-YÊU CẦU:
-1. Phân tích SWOT chi tiết
-2. Cho điểm từ 1-10 cho mỗi yếu tố SWOT (dựa trên độ mạnh/yếu)
-3. Trả về kết quả theo format sau:
-
-QUAN_TRONG: Trả về một block JSON ở cuối với format:
+    named_frames = [(info['file'], df) for df, info in zip(dataframes, file_info)]
+    parts = ["📊 DỮ LIỆU TỪ CSV:\n"]
+    for file_name, file_summary in summarize_csv_files(named_frames, count_tokens=count_tokens):
+        parts.append(f"\n--- File: {file_name} ---\n{file_summary}")
+    return "".join(parts)
+
+
+def count_tokens(text):
+    """Đếm token bằng backend đã chọn (xem llm_client.count_tokens)"""
+    return llm_count_tokens(backend, text)
+
+
+def call_gemini(prompt, use_cache=None, generation_config=None, stream=False):
+    """Gọi LLM qua backend đã chọn (mặc định Gemini), có cache trên đĩa dùng chung với main.py (xem llm_client)
+    
+    stream=True: trả về iterator các đoạn văn bản (dùng với st.write_stream)
+    """
+    # Mặc định theo tùy chọn "Bỏ qua cache" ở sidebar (job nền: theo giá trị lúc submit)
+    if use_cache is None:
+        use_cache = use_cache_override.get()
+    if use_cache is None:
+        use_cache = not st.session_state.get("bypass_cache", False)
+    return call_llm(backend, prompt, use_cache, generation_config, stream)
+
+
+def render_streaming_result(chunks):
+    """Hiển thị phản hồi đang được sinh, trả về toàn bộ văn bản khi xong"""
+    placeholder = st.empty()
+    with placeholder.container():
+        st.caption("✍️ AI đang viết...")
+        result = st.write_stream(chunks)
+    # Xóa bản nháp, phần chi tiết sẽ được hiển thị lại sau khi đã làm sạch
+    placeholder.empty()
+    return result
+
+
+def display_partial_result(analysis_type, partial, preview_id):
+    """Bản xem trước từ phần payload JSON đã nhận: điểm số và ma trận SWOT đã hoàn chỉnh"""
+    import plotly.express as px
+
+    if analysis_type in ("swot", "branch"):
+        if partial.get("scores"):
+            st.subheader("📊 Biểu đồ phân tích SWOT")
+            display_swot_score_chart(partial["scores"], chart_key=f"preview_scores_{preview_id}")
+        if partial.get("summary"):
+            st.subheader("🎯 Ma trận SWOT")
+            display_swot_matrix(partial["summary"])
+        return
+    
+    # So sánh: vẽ điểm của các quán đã có điểm hoàn chỉnh
+    shops = [partial.get("my_shop"), partial.get("competitor")] + list(partial.get("competitors") or [])
+    shops = [shop for shop in shops if isinstance(shop, dict) and shop.get("scores")]
+    if shops:
+        st.subheader("📊 Điểm SWOT các quán (đang cập nhật)")
+        preview_df = pd.DataFrame([
+            {"Quán": shop.get("name", "..."), "Yếu tố": key.capitalize(), "Điểm": shop["scores"].get(key, 0)}
+            for shop in shops for key in ["strengths", "weaknesses", "opportunities", "threats"]
+        ])
+        fig = px.bar(preview_df, x="Quán", y="Điểm", color="Yếu tố", barmode="group")
+        fig.update_layout(yaxis_range=[0, 10], xaxis_title="")
+        st.plotly_chart(fig, use_container_width=True, key=f"preview_shops_{preview_id}")
+
+
+def render_streaming_json(chunks, analysis_type):
+    """Nhận payload JSON theo stream, vẽ trước biểu đồ ngay khi từng phần hoàn chỉnh
+    
+    Biểu đồ điểm hiện khi object "scores" đóng, ma trận SWOT cập nhật khi từng danh sách đóng.
+    Trả về toàn bộ văn bản JSON khi xong (bản xem trước được xóa để vẽ bản đầy đủ).
+    """
+    parser = IncrementalJSONParser()
+    partial = {}
+    placeholder = st.empty()
+    with placeholder.container():
+        st.caption("✍️ AI đang phân tích...")
+    for preview_id, chunk in enumerate(chunks):
+        events = parser.feed(chunk)
+        if not events:
+            continue
+        for path, value in events:
+            partial = assign_path(partial, path, value)
+        with placeholder.container():
+            st.caption("✍️ AI đang phân tích...")
+            display_partial_result(analysis_type, partial, preview_id)
+    placeholder.empty()
+    return parser.text
+
+
+def run_analysis(analyze_func, args, analysis_type, extract_func):
+    """Chạy một phân tích theo chế độ đang chọn ở sidebar
+    
+    - Chế độ JSON: Gemini stream JSON theo schema, biểu đồ được vẽ trước ngay khi từng phần
+      hoàn chỉnh; phần chi tiết được dựng lại từ dữ liệu
+    - Chế độ thường: stream bài viết, rồi trích block JSON cho biểu đồ
+    Trả về (dữ liệu cho biểu đồ, văn bản phân tích chi tiết)
+    """
+    if st.session_state.get("json_mode", JSON_MODE_DEFAULT):
+        result = render_streaming_json(analyze_func(*args, stream=True, json_mode=True), analysis_type)
+        data = parse_json_response(result)
+        return data, render_analysis_markdown(analysis_type, data)
+    result = render_streaming_result(analyze_func(*args, stream=True))
+    return extract_func(result), clean_result_text(result)
+
+
+def run_analysis_sync(analyze_func, args, analysis_type, extract_func, json_mode=False):
+    """Như run_analysis nhưng không stream và không vẽ gì: dùng trong job nền"""
+    if json_mode:
+        data = parse_json_response(analyze_func(*args, json_mode=True))
+        return data, render_analysis_markdown(analysis_type, data)
+    result = analyze_func(*args)
+    return extract_func(result), clean_result_text(result)
+
+
+SWOT_RESPONSE_FORMAT = """QUAN_TRONG: Trả về một block JSON ở cuối với format:
 ```json
-{{
-    "shop_name": "{shop_name}",
-    "scores": {{
+{
+    "shop_name": "<tên quán cần phân tích>",
+    "scores": {
         "strengths": <điểm 1-10>,
         "weaknesses": <điểm 1-10>,
         "opportunities": <điểm 1-10>,
         "threats": <điểm 1-10>
-    }},
-    "summary": {{
+    },
+    "summary": {
         "strengths": ["điểm mạnh 1", "điểm mạnh 2", "điểm mạnh 3"],
         "weaknesses": ["điểm yếu 1", "điểm yếu 2", "điểm yếu 3"],
         "opportunities": ["cơ hội 1", "cơ hội 2", "cơ hội 3"],
         "threats": ["thách thức 1", "thách thức 2", "thách thức 3"]
-    }}
-}}
+    }
+}
 ```
 
 Bây giờ hãy phân tích chi tiết:
@@ -174,10 +289,79 @@ Bây giờ hãy phân tích chi tiết:
 
 Cuối cùng, đưa ra block JSON như yêu cầu.
 """
-    return call_gemini(prompt)
 
 
-def analyze_competitor_comparison(my_shop, competitor_shop, csv_my_shop="", csv_competitor=""):
+@track_mode("swot")
+def analyze_swot_with_scores(shop_name, csv_summary="", stream=False, json_mode=False):
+    """Phân tích SWOT và trả về điểm số cho biểu đồ"""
+    instructions = """
+YÊU CẦU:
+1. Phân tích SWOT chi tiết cho quán được nêu ở cuối (QUÁN CẦN PHÂN TÍCH), kết hợp dữ liệu CSV nếu có
+2. Cho điểm từ 1-10 cho mỗi yếu tố SWOT (dựa trên độ mạnh/yếu)
+3. Trả về kết quả theo format sau:
+"""
+    prompt = analysis_prompt(instructions, SWOT_RESPONSE_FORMAT, json_mode, context=csv_summary,
+                             query=f"🏪 QUÁN CẦN PHÂN TÍCH: {shop_name}")
+    if json_mode:
+        return call_gemini(prompt, generation_config=json_generation_config("swot"), stream=stream)
+    return call_gemini(prompt, stream=stream)
+
+
+@track_mode("swot_update")
+def analyze_swot_update(shop_name, plan, stream=False, json_mode=False):
+    """Cập nhật SWOT lần trước theo phần CSV thay đổi (plan: IncrementalPlan chế độ UPDATE)"""
+    prompt = plan.update_prompt(SWOT_RESPONSE_FORMAT, query=f"🏪 QUÁN CẦN PHÂN TÍCH: {shop_name}", json_mode=json_mode)
+    if json_mode:
+        return call_gemini(prompt, generation_config=json_generation_config("swot"), stream=stream)
+    return call_gemini(prompt, stream=stream)
+
+
+def run_csv_swot(shop_name, named_frames, summary, incremental=False):
+    """SWOT trên dữ liệu CSV (tab CSV, tab kết hợp); summary() tạo tóm tắt CSV cho phân tích đầy đủ
+
+    incremental: so với snapshot lần trước của cùng quán + tập file (xem incremental);
+    không đổi thì dùng lại kết quả cũ, đổi ít thì chỉ gửi kết quả cũ + phần thay đổi.
+    """
+    plan = plan_incremental("swot", shop_name, named_frames) if incremental else None
+    if plan is not None and plan.mode == UNCHANGED:
+        st.info("♻️ Dữ liệu CSV không đổi so với lần phân tích trước: dùng lại kết quả cũ, không gọi AI")
+        return plan.previous["data"], plan.previous["text"]
+
+    json_mode = st.session_state.get("json_mode", JSON_MODE_DEFAULT)
+    parsed = []
+
+    def extract(response_text):
+        # Như extract_json_from_response (biểu đồ vẫn có điểm mẫu), nhưng ghi nhận block JSON có hợp lệ không
+        try:
+            data = parse_json_block(response_text)
+        except ValueError:
+            return extract_json_from_response(response_text)
+        parsed.append(True)
+        return data
+
+    if plan is not None and plan.mode == UPDATE:
+        st.caption(f"♻️ Cập nhật từ lần phân tích trước: {plan.describe()} · 🔄 ~{plan.delta_tokens} token thay đổi")
+        swot_data, clean_text = run_analysis(analyze_swot_update, (shop_name, plan), "swot", extract)
+        # Chế độ văn bản: AI chỉ viết lại các mục bị ảnh hưởng, ghép với bài cũ
+        clean_text = plan.merge(SWOT_RESPONSE_FORMAT, clean_text, json_mode)
+    else:
+        if plan is not None:
+            st.caption(f"♻️ Phân tích đầy đủ: {plan.reason}")
+        swot_data, clean_text = run_analysis(
+            analyze_swot_with_scores, (shop_name, summary()), "swot", extract
+        )
+    if plan is not None:
+        # Chế độ JSON: payload hỏng đã ném lỗi ở run_analysis. Điểm mẫu không được lưu làm mốc:
+        # lần sau so với mốc cũ (nếu có) hoặc phân tích đầy đủ
+        if json_mode or parsed:
+            plan.commit(swot_data, clean_text)
+        else:
+            st.warning("⚠️ Phản hồi không có block JSON hợp lệ: kết quả này không được lưu làm mốc cho lần phân tích tăng dần sau")
+    return swot_data, clean_text
+
+
+@track_mode("comparison")
+def analyze_competitor_comparison(my_shop, competitor_shop, csv_my_shop="", csv_competitor="", stream=False, json_mode=False):
     """So sánh SWOT giữa 2 quán"""
     
     # Build context từ CSV data
@@ -187,13 +371,8 @@ def analyze_competitor_comparison(my_shop, competitor_shop, csv_my_shop="", csv_
     if csv_competitor:
         csv_context += f"\n\n📊 DỮ LIỆU CSV ĐỐI THỦ ({competitor_shop}):\n{csv_competitor}"
     
-    prompt = f"""
-Bạn là chuyên gia phân tích kinh doanh và là một Data Analyst trong lĩnh vực F&B tại Việt Nam.
-
-⚔️ SO SÁNH ĐỐI THỦ CẠNH TRANH:
-- 🏪 QUÁN CỦA BẠN: {my_shop}
-- 🎯 ĐỐI THỦ: {competitor_shop}
-{csv_context}
+    instructions = """
+⚔️ SO SÁNH ĐỐI THỦ CẠNH TRANH giữa QUÁN CỦA BẠN và ĐỐI THỦ (nêu ở cuối)
 
 YÊU CẦU:
 1. Phân tích SWOT cho CẢ HAI quán
@@ -202,12 +381,12 @@ YÊU CẦU:
 4. So sánh GIÁ NIÊM YẾT cho các sản phẩm tương tự (VD: Cà phê đen, Cà phê sữa, Trà sữa...)
 5. So sánh ƯU ĐÃI và KHUYẾN MÃI của mỗi quán
 6. Phân tích CHÊNH LỆCH GIẢM GIÁ tại từng địa điểm/chi nhánh
-
-QUAN_TRONG: Trả về một block JSON ở cuối với format:
+"""
+    response_format = f"""QUAN_TRONG: Trả về một block JSON ở cuối với format:
 ```json
 {{
     "my_shop": {{
-        "name": "{my_shop}",
+        "name": "<tên quán của bạn>",
         "scores": {{
             "strengths": <điểm 1-10>,
             "weaknesses": <điểm 1-10>,
@@ -223,7 +402,7 @@ QUAN_TRONG: Trả về một block JSON ở cuối với format:
         "promotions": ["ưu đãi 1", "ưu đãi 2", "ưu đãi 3"]
     }},
     "competitor": {{
-        "name": "{competitor_shop}",
+        "name": "<tên đối thủ>",
         "scores": {{
             "strengths": <điểm 1-10>,
             "weaknesses": <điểm 1-10>,
@@ -256,14 +435,14 @@ QUAN_TRONG: Trả về một block JSON ở cuối với format:
 
 Bây giờ hãy phân tích chi tiết:
 
-## 🏪 PHÂN TÍCH {my_shop}:
+## 🏪 PHÂN TÍCH <QUÁN CỦA BẠN>:
 📗 STRENGTHS: ...
 📕 WEAKNESSES: ...
 📘 OPPORTUNITIES: ...
 📙 THREATS: ...
 💰 ƯU ĐÃI HIỆN TẠI: ...
 
-## 🎯 PHÂN TÍCH {competitor_shop}:
+## 🎯 PHÂN TÍCH <ĐỐI THỦ>:
 📗 STRENGTHS: ...
 📕 WEAKNESSES: ...
 📘 OPPORTUNITIES: ...
@@ -271,7 +450,7 @@ Bây giờ hãy phân tích chi tiết:
 💰 ƯU ĐÃI HIỆN TẠI: ...
 
 ## 💵 SO SÁNH GIÁ SẢN PHẨM:
-| Sản phẩm | Giá {my_shop} | Giá {competitor_shop} | Chênh lệch |
+| Sản phẩm | Giá quán của bạn | Giá đối thủ | Chênh lệch |
 |----------|---------------|----------------------|------------|
 | ...      | ...           | ...                  | ...        |
 
@@ -287,18 +466,17 @@ Bây giờ hãy phân tích chi tiết:
 
 Cuối cùng, đưa ra block JSON như yêu cầu.
 """
-    return call_gemini(prompt)
+    prompt = analysis_prompt(instructions, response_format, json_mode, context=csv_context,
+                             query=f"- 🏪 QUÁN CỦA BẠN: {my_shop}\n- 🎯 ĐỐI THỦ: {competitor_shop}")
+    if json_mode:
+        return call_gemini(prompt, generation_config=json_generation_config("comparison"), stream=stream)
+    return call_gemini(prompt, stream=stream)
 
 
-def analyze_competitor_auto_detect(all_csv_data):
+@track_mode("comparison_auto_detect")
+def analyze_competitor_auto_detect(all_csv_data, stream=False, json_mode=False):
     """So sánh SWOT từ nhiều file CSV - AI tự động xác định các quán và phân tích"""
-    
-    prompt = f"""
-Bạn là chuyên gia phân tích kinh doanh và là một Data Analyst trong lĩnh vực F&B tại Việt Nam.
-
-📊 DỮ LIỆU TỪ NHIỀU FILE CSV:
-{all_csv_data}
-
+    instructions = """
 ⚔️ NHIỆM VỤ:
 1. TỰ ĐỘNG XÁC ĐỊNH các quán/thương hiệu khác nhau từ dữ liệu CSV (dựa trên tên file, cột dữ liệu, hoặc nội dung)
 2. Phân tích SWOT cho TẤT CẢ các quán được phát hiện
@@ -308,8 +486,8 @@ Bạn là chuyên gia phân tích kinh doanh và là một Data Analyst trong l
 6. Đề xuất chiến lược cạnh tranh
 
 LƯU Ý: Bạn phải TỰ ĐỘNG nhận diện tên các quán từ dữ liệu. Quán đầu tiên được phát hiện sẽ được coi là "quán chính" (my_shop), các quán còn lại là đối thủ.
-
-QUAN_TRONG: Trả về một block JSON ở cuối với format:
+"""
+    response_format = f"""QUAN_TRONG: Trả về một block JSON ở cuối với format:
 ```json
 {{
     "detected_shops": ["tên quán 1", "tên quán 2", "tên quán 3"],
@@ -390,34 +568,31 @@ Bây giờ hãy phân tích chi tiết:
 
 Cuối cùng, đưa ra block JSON như yêu cầu.
 """
-    return call_gemini(prompt)
+    prompt = analysis_prompt(instructions, response_format, json_mode,
+                             context=f"📊 DỮ LIỆU TỪ NHIỀU FILE CSV:\n{all_csv_data}")
+    if json_mode:
+        return call_gemini(prompt, generation_config=json_generation_config("comparison"), stream=stream)
+    return call_gemini(prompt, stream=stream)
 
 
-def analyze_competitor_with_my_shop(my_shop_name, all_csv_data):
+@track_mode("comparison_my_shop")
+def analyze_competitor_with_my_shop(my_shop_name, all_csv_data, stream=False, json_mode=False):
     """So sánh SWOT với quán của mình được chỉ định từ nhiều file CSV"""
-    
-    prompt = f"""
-Bạn là chuyên gia phân tích kinh doanh và là một Data Analyst trong lĩnh vực F&B tại Việt Nam.
-
-🏪 QUÁN CỦA TÔI: {my_shop_name}
-
-📊 DỮ LIỆU TỪ NHIỀU FILE CSV:
-{all_csv_data}
-
+    instructions = """
 ⚔️ NHIỆM VỤ:
-1. Xác định dữ liệu nào thuộc về "{my_shop_name}" (quán của tôi) và dữ liệu nào thuộc về các đối thủ
+1. Xác định dữ liệu nào thuộc về QUÁN CỦA TÔI (tên nêu ở cuối) và dữ liệu nào thuộc về các đối thủ
 2. Phân tích SWOT cho quán của tôi và các đối thủ
 3. So sánh và đối chiếu điểm mạnh/yếu
 4. So sánh GIÁ NIÊM YẾT cho các sản phẩm tương tự
 5. So sánh ƯU ĐÃI và KHUYẾN MÃI
-6. Đề xuất chiến lược cạnh tranh cho "{my_shop_name}"
-
-QUAN_TRONG: Trả về một block JSON ở cuối với format:
+6. Đề xuất chiến lược cạnh tranh cho quán của tôi
+"""
+    response_format = f"""QUAN_TRONG: Trả về một block JSON ở cuối với format:
 ```json
 {{
     "detected_shops": ["tên quán 1", "tên quán 2"],
     "my_shop": {{
-        "name": "{my_shop_name}",
+        "name": "<tên quán của tôi>",
         "scores": {{
             "strengths": <điểm 1-10>,
             "weaknesses": <điểm 1-10>,
@@ -464,7 +639,7 @@ QUAN_TRONG: Trả về một block JSON ở cuối với format:
 
 Bây giờ hãy phân tích chi tiết:
 
-## 🏪 PHÂN TÍCH {my_shop_name} (Quán của tôi):
+## 🏪 PHÂN TÍCH <QUÁN CỦA TÔI> (Quán của tôi):
 📗 STRENGTHS: ...
 📕 WEAKNESSES: ...
 📘 OPPORTUNITIES: ...
@@ -475,7 +650,7 @@ Bây giờ hãy phân tích chi tiết:
 (Phân tích từng đối thủ được phát hiện)
 
 ## 💵 SO SÁNH GIÁ SẢN PHẨM:
-| Sản phẩm | {my_shop_name} | Đối thủ | Chênh lệch |
+| Sản phẩm | Quán của tôi | Đối thủ | Chênh lệch |
 |----------|----------------|---------|------------|
 | ...      | ...            | ...     | ...        |
 
@@ -491,33 +666,31 @@ Bây giờ hãy phân tích chi tiết:
 
 Cuối cùng, đưa ra block JSON như yêu cầu.
 """
-    return call_gemini(prompt)
+    prompt = analysis_prompt(instructions, response_format, json_mode,
+                             context=f"📊 DỮ LIỆU TỪ NHIỀU FILE CSV:\n{all_csv_data}",
+                             query=f"🏪 QUÁN CỦA TÔI: {my_shop_name}")
+    if json_mode:
+        return call_gemini(prompt, generation_config=json_generation_config("comparison"), stream=stream)
+    return call_gemini(prompt, stream=stream)
 
 
-def analyze_multi_competitor_with_my_shop(my_shop_name, all_csv_data):
+@track_mode("multi_my_shop")
+def analyze_multi_competitor_with_my_shop(my_shop_name, all_csv_data, stream=False, json_mode=False):
     """So sánh SWOT nhiều quán với quán của mình được chỉ định - bao gồm xếp hạng"""
-    
-    prompt = f"""
-Bạn là chuyên gia phân tích kinh doanh và là một Data Analyst trong lĩnh vực F&B tại Việt Nam.
-
-🏪 QUÁN CỦA TÔI: {my_shop_name}
-
-📊 DỮ LIỆU TỪ NHIỀU FILE CSV:
-{all_csv_data}
-
+    instructions = """
 ⚔️ NHIỆM VỤ:
-1. Xác định dữ liệu nào thuộc về "{my_shop_name}" (quán của tôi) và dữ liệu nào thuộc về các đối thủ
+1. Xác định dữ liệu nào thuộc về QUÁN CỦA TÔI (tên nêu ở cuối) và dữ liệu nào thuộc về các đối thủ
 2. Phân tích SWOT cho TẤT CẢ các quán
 3. So sánh và đối chiếu điểm mạnh/yếu giữa tất cả
 4. XẾP HẠNG các quán theo tiềm năng cạnh tranh
-5. Đề xuất chiến lược cạnh tranh cho "{my_shop_name}"
-
-QUAN_TRONG: Trả về một block JSON ở cuối với format:
+5. Đề xuất chiến lược cạnh tranh cho quán của tôi
+"""
+    response_format = f"""QUAN_TRONG: Trả về một block JSON ở cuối với format:
 ```json
 {{
     "detected_shops": ["tên quán 1", "tên quán 2", "tên quán 3"],
     "my_shop": {{
-        "name": "{my_shop_name}",
+        "name": "<tên quán của tôi>",
         "is_my_shop": true,
         "scores": {{
             "strengths": <điểm 1-10>,
@@ -562,7 +735,7 @@ QUAN_TRONG: Trả về một block JSON ở cuối với format:
 
 Bây giờ hãy phân tích chi tiết:
 
-## 🏪 PHÂN TÍCH {my_shop_name} (Quán của tôi):
+## 🏪 PHÂN TÍCH <QUÁN CỦA TÔI> (Quán của tôi):
 📗 STRENGTHS: ...
 📕 WEAKNESSES: ...
 📘 OPPORTUNITIES: ...
@@ -577,24 +750,24 @@ Bây giờ hãy phân tích chi tiết:
 | ...  | ...  | ...       | ...     |
 
 ## ⚔️ SO SÁNH & KẾT LUẬN:
-- Lợi thế cạnh tranh của {my_shop_name}
+- Lợi thế cạnh tranh của quán của tôi
 - Điểm cần cải thiện
 - Đề xuất chiến lược
 
 Cuối cùng, đưa ra block JSON như yêu cầu.
 """
-    return call_gemini(prompt)
+    prompt = analysis_prompt(instructions, response_format, json_mode,
+                             context=f"📊 DỮ LIỆU TỪ NHIỀU FILE CSV:\n{all_csv_data}",
+                             query=f"🏪 QUÁN CỦA TÔI: {my_shop_name}")
+    if json_mode:
+        return call_gemini(prompt, generation_config=json_generation_config("multi_comparison"), stream=stream)
+    return call_gemini(prompt, stream=stream)
 
 
-def analyze_multi_competitor_auto_detect(all_csv_data):
+@track_mode("multi_auto_detect")
+def analyze_multi_competitor_auto_detect(all_csv_data, stream=False, json_mode=False):
     """So sánh SWOT nhiều quán từ nhiều file CSV - AI tự động xác định các quán và xếp hạng"""
-    
-    prompt = f"""
-Bạn là chuyên gia phân tích kinh doanh và là một Data Analyst trong lĩnh vực F&B tại Việt Nam.
-
-📊 DỮ LIỆU TỪ NHIỀU FILE CSV:
-{all_csv_data}
-
+    instructions = """
 ⚔️ NHIỆM VỤ:
 1. TỰ ĐỘNG XÁC ĐỊNH tất cả các quán/thương hiệu khác nhau từ dữ liệu CSV (dựa trên tên file, cột dữ liệu, hoặc nội dung)
 2. Phân tích SWOT cho TẤT CẢ các quán được phát hiện
@@ -603,8 +776,8 @@ Bạn là chuyên gia phân tích kinh doanh và là một Data Analyst trong l
 5. Đề xuất chiến lược cạnh tranh
 
 LƯU Ý: Bạn phải TỰ ĐỘNG nhận diện tên các quán từ dữ liệu. Quán đầu tiên được phát hiện sẽ được coi là "quán chính" (my_shop), các quán còn lại là đối thủ.
-
-QUAN_TRONG: Trả về một block JSON ở cuối với format:
+"""
+    response_format = f"""QUAN_TRONG: Trả về một block JSON ở cuối với format:
 ```json
 {{
     "detected_shops": ["tên quán 1", "tên quán 2", "tên quán 3"],
@@ -678,10 +851,15 @@ Bây giờ hãy phân tích chi tiết:
 
 Cuối cùng, đưa ra block JSON như yêu cầu.
 """
-    return call_gemini(prompt)
+    prompt = analysis_prompt(instructions, response_format, json_mode,
+                             context=f"📊 DỮ LIỆU TỪ NHIỀU FILE CSV:\n{all_csv_data}")
+    if json_mode:
+        return call_gemini(prompt, generation_config=json_generation_config("multi_comparison"), stream=stream)
+    return call_gemini(prompt, stream=stream)
 
 
-def analyze_multi_competitor_comparison(my_shop, competitors, csv_data=None):
+@track_mode("multi_comparison")
+def analyze_multi_competitor_comparison(my_shop, competitors, csv_data=None, stream=False, json_mode=False):
     """So sánh SWOT giữa quán của bạn và nhiều đối thủ"""
     
     # Build danh sách đối thủ
@@ -696,26 +874,20 @@ def analyze_multi_competitor_comparison(my_shop, competitors, csv_data=None):
             if csv_data.get(f"competitor_{i}"):
                 csv_context += f"\n\n📊 DỮ LIỆU CSV ĐỐI THỦ ({comp}):\n{csv_data[f'competitor_{i}']}"
     
-    prompt = f"""
-Bạn là chuyên gia phân tích kinh doanh và là một Data Analyst trong lĩnh vực F&B tại Việt Nam.
-
-⚔️ SO SÁNH NHIỀU ĐỐI THỦ CẠNH TRANH:
-- 🏪 QUÁN CỦA BẠN: {my_shop}
-- 🎯 CÁC ĐỐI THỦ:
-{competitors_list}
-{csv_context}
+    instructions = """
+⚔️ SO SÁNH NHIỀU ĐỐI THỦ CẠNH TRANH: QUÁN CỦA BẠN và CÁC ĐỐI THỦ (nêu ở cuối)
 
 YÊU CẦU:
 1. Phân tích SWOT cho TẤT CẢ các quán (quán của bạn + các đối thủ)
 2. So sánh và đối chiếu điểm mạnh/yếu giữa tất cả
 3. Xếp hạng các quán theo tiềm năng cạnh tranh
 4. Đề xuất chiến lược cạnh tranh cho quán của bạn
-
-QUAN_TRONG: Trả về một block JSON ở cuối với format:
+"""
+    response_format = f"""QUAN_TRONG: Trả về một block JSON ở cuối với format:
 ```json
 {{
     "my_shop": {{
-        "name": "{my_shop}",
+        "name": "<tên quán của bạn>",
         "is_my_shop": true,
         "scores": {{
             "strengths": <điểm 1-10>,
@@ -760,7 +932,7 @@ QUAN_TRONG: Trả về một block JSON ở cuối với format:
 
 Bây giờ hãy phân tích chi tiết:
 
-## 🏪 PHÂN TÍCH {my_shop} (QUÁN CỦA BẠN):
+## 🏪 PHÂN TÍCH <QUÁN CỦA BẠN> (QUÁN CỦA BẠN):
 📗 STRENGTHS: ...
 📕 WEAKNESSES: ...
 📘 OPPORTUNITIES: ...
@@ -781,7 +953,11 @@ Bây giờ hãy phân tích chi tiết:
 
 Cuối cùng, đưa ra block JSON như yêu cầu.
 """
-    return call_gemini(prompt)
+    prompt = analysis_prompt(instructions, response_format, json_mode, context=csv_context,
+                             query=f"- 🏪 QUÁN CỦA BẠN: {my_shop}\n- 🎯 CÁC ĐỐI THỦ:\n{competitors_list}")
+    if json_mode:
+        return call_gemini(prompt, generation_config=json_generation_config("multi_comparison"), stream=stream)
+    return call_gemini(prompt, stream=stream)
 
 
 def extract_multi_comparison_json(response_text):
@@ -814,8 +990,440 @@ def extract_multi_comparison_json(response_text):
     }
 
 
-def display_multi_comparison_charts(comparison_data, my_shop_name):
-    """Hiển thị biểu đồ so sánh nhiều quán"""
+@track_mode("fanout_shop")
+def analyze_single_shop_swot(file_name, csv_summary, use_cache=True, json_mode=False):
+    """Phân tích SWOT cho một quán (một file CSV) - dùng cho chế độ song song"""
+    instructions = """
+NHIỆM VỤ:
+1. Xác định tên quán/thương hiệu (dựa trên tên file hoặc nội dung dữ liệu)
+2. Phân tích SWOT cho quán này
+3. Cho điểm từ 1-10 cho mỗi yếu tố SWOT
+"""
+    response_format = f"""CHỈ trả về một block JSON với format:
+```json
+{{
+    "name": "<tên quán>",
+    "scores": {{
+        "strengths": <điểm 1-10>,
+        "weaknesses": <điểm 1-10>,
+        "opportunities": <điểm 1-10>,
+        "threats": <điểm 1-10>
+    }},
+    "summary": {{
+        "strengths": ["điểm mạnh 1", "điểm mạnh 2", "điểm mạnh 3"],
+        "weaknesses": ["điểm yếu 1", "điểm yếu 2", "điểm yếu 3"],
+        "opportunities": ["cơ hội 1", "cơ hội 2", "cơ hội 3"],
+        "threats": ["thách thức 1", "thách thức 2", "thách thức 3"]
+    }}
+}}
+```
+"""
+    prompt = analysis_prompt(instructions, response_format, json_mode,
+                             context=f"📊 DỮ LIỆU CSV CỦA MỘT QUÁN (file: {file_name}):\n{csv_summary}")
+    if json_mode:
+        return call_gemini(prompt, use_cache=use_cache, generation_config=json_generation_config("single_shop"))
+    return call_gemini(prompt, use_cache=use_cache)
+
+
+@track_mode("fanout_merge")
+def merge_multi_shop_results(my_shop_name, shop_results, use_cache=True, json_mode=False):
+    """Gộp kết quả SWOT từng quán: xác định quán của tôi, xếp hạng và đề xuất chiến lược"""
+    
+    shops_json = json.dumps(
+        [{"index": i, "name": shop.get("name"), "scores": shop.get("scores"), "summary": shop.get("summary")}
+         for i, shop in enumerate(shop_results)],
+        ensure_ascii=False,
+        indent=2
+    )
+    if my_shop_name:
+        my_shop_line = f"🏪 QUÁN CỦA TÔI: {my_shop_name}"
+    else:
+        my_shop_line = "LƯU Ý: Quán đầu tiên trong danh sách được coi là \"quán chính\" (my_shop_index = 0)."
+    
+    instructions = """
+⚔️ NHIỆM VỤ (dựa trên KẾT QUẢ SWOT CỦA TỪNG QUÁN ở dưới):
+1. Xác định quán nào trong danh sách là quán của tôi (my_shop_index)
+2. XẾP HẠNG các quán theo tiềm năng cạnh tranh
+3. Đưa ra lợi thế cạnh tranh, điểm cần cải thiện và chiến lược cho quán của tôi
+"""
+    response_format = f"""Viết NGẮN GỌN:
+
+## 🏆 BẢNG XẾP HẠNG:
+| Hạng | Quán | Điểm tổng | Ghi chú |
+|------|------|-----------|---------|
+
+## ⚔️ SO SÁNH & KẾT LUẬN:
+- Lợi thế cạnh tranh
+- Điểm cần cải thiện
+- Đề xuất chiến lược
+
+QUAN_TRONG: Trả về một block JSON ở cuối với format:
+```json
+{{
+    "my_shop_index": <số index của quán của tôi>,
+    "ranking": [
+        {{"rank": 1, "name": "<tên quán>", "total_score": <điểm tổng>, "note": "lý do xếp hạng"}}
+    ],
+    "competitive_advantages": ["lợi thế 1", "lợi thế 2", "lợi thế 3"],
+    "areas_to_improve": ["cần cải thiện 1", "cần cải thiện 2", "cần cải thiện 3"],
+    "strategies": ["chiến lược 1", "chiến lược 2", "chiến lược 3"]
+}}
+```
+"""
+    prompt = analysis_prompt(instructions, response_format, json_mode,
+                             context=f"📋 KẾT QUẢ SWOT CỦA TỪNG QUÁN (JSON):\n{shops_json}", query=my_shop_line)
+    if json_mode:
+        return call_gemini(prompt, use_cache=use_cache, generation_config=json_generation_config("merge"))
+    return call_gemini(prompt, use_cache=use_cache)
+
+
+def rank_shops_by_score(shops):
+    """Xếp hạng cục bộ theo điểm tổng (dùng khi AI không trả về bảng xếp hạng)"""
+    def total_score(shop):
+        scores = shop.get("scores", {})
+        return (scores.get('strengths', 5) + scores.get('opportunities', 5)
+                - scores.get('weaknesses', 5) - scores.get('threats', 5) + 20) / 4
+    
+    ranked = sorted(shops, key=total_score, reverse=True)
+    return [
+        {"rank": rank, "name": shop.get("name", "Unknown"), "total_score": round(total_score(shop), 1), "note": "Xếp theo điểm SWOT"}
+        for rank, shop in enumerate(ranked, 1)
+    ]
+
+
+def analyze_multi_competitor_fanout(my_shop_name, shop_summaries, max_workers=FANOUT_MAX_WORKERS,
+                                    use_cache=True, on_progress=None, json_mode=False):
+    """So sánh nhiều quán theo kiểu song song: mỗi quán một lời gọi, sau đó một lời gọi gộp nhỏ
+    
+    shop_summaries: dict {tên file: tóm tắt CSV của file đó}
+    my_shop_name: để trống nếu muốn AI tự coi quán đầu tiên là quán chính
+    on_progress(done, total, file_name): callback cập nhật tiến độ (gọi trên thread hiện tại)
+    json_mode: dùng chế độ JSON có cấu trúc cho cả lời gọi từng quán và lời gọi gộp
+    Trả về (result_text, comparison_data, errors)
+    """
+    file_names = list(shop_summaries.keys())
+    shop_results = {}
+    errors = {}
+    
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {
+            # Bản sao context cho mỗi tác vụ: giữ nhãn metrics (tab) trong thread con
+            executor.submit(
+                contextvars.copy_context().run, analyze_single_shop_swot,
+                file_name, shop_summaries[file_name], use_cache, json_mode
+            ): file_name
+            for file_name in file_names
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            file_name = futures[future]
+            try:
+                # Parse chặt: quán không có JSON hợp lệ được báo lỗi và bỏ qua, không dùng điểm mẫu
+                if json_mode:
+                    shop = parse_json_response(future.result())
+                else:
+                    shop = parse_json_block(future.result())
+                if shop.get("name") in (None, "", "Unknown"):
+                    shop["name"] = os.path.splitext(file_name)[0]
+                shop_results[file_name] = shop
+            except Exception as e:
+                # Một quán lỗi không làm hỏng cả lượt so sánh
+                errors[file_name] = str(e)
+            if on_progress:
+                on_progress(done, len(file_names), file_name)
+    
+    # Giữ đúng thứ tự file đã upload
+    shops = [shop_results[name] for name in file_names if name in shop_results]
+    if not shops:
+        raise RuntimeError("Không phân tích được quán nào: " + "; ".join(f"{k}: {v}" for k, v in errors.items()))
+    
+    merge_text = merge_multi_shop_results(my_shop_name, shops, use_cache, json_mode)
+    merge_data = {}
+    if json_mode:
+        merge_data = parse_json_response(merge_text)
+    else:
+        try:
+            json_match = re.search(r'```json\s*(.*?)\s*```', merge_text, re.DOTALL)
+            if json_match:
+                merge_data = json.loads(json_match.group(1))
+        except:
+            pass
+    
+    my_index = merge_data.get("my_shop_index", 0)
+    if not isinstance(my_index, int) or not 0 <= my_index < len(shops):
+        my_index = 0
+    
+    my_shop = dict(shops[my_index], is_my_shop=True)
+    if my_shop_name:
+        my_shop["name"] = my_shop_name
+    competitors = [dict(shop, is_my_shop=False) for i, shop in enumerate(shops) if i != my_index]
+    
+    comparison_data = {
+        "detected_shops": [my_shop["name"]] + [shop.get("name", "Unknown") for shop in competitors],
+        "my_shop": my_shop,
+        "competitors": competitors,
+        "ranking": merge_data.get("ranking") or rank_shops_by_score([my_shop] + competitors),
+        "competitive_advantages": merge_data.get("competitive_advantages", []),
+        "areas_to_improve": merge_data.get("areas_to_improve", []),
+        "strategies": merge_data.get("strategies", [])
+    }
+    if json_mode:
+        merge_text = render_analysis_markdown("multi_comparison", comparison_data)
+    return merge_text, comparison_data, errors
+
+
+def analyzed_datetime(analyzed_at):
+    """Thời điểm phân tích đã đóng dấu khi lưu kết quả (chuỗi ANALYZED_AT_FORMAT, xem result_history);
+    chưa có thì là lúc này"""
+    return datetime.strptime(analyzed_at, ANALYZED_AT_FORMAT) if analyzed_at else datetime.now()
+
+
+def comparison_excel_sheets(comparison_data, my_shop_name, competitor_name, analyzed_at=None):
+    """Các sheet Excel (tên sheet, DataFrame) của kết quả so sánh quán của bạn với một đối thủ"""
+    analyzed_at = analyzed_at or datetime.now()
+    my_scores = comparison_data.get("my_shop", {}).get("scores", {})
+    comp_scores = comparison_data.get("competitor", {}).get("scores", {})
+    
+    # Sheet 1: Điểm so sánh
+    scores_compare_df = pd.DataFrame({
+        "Shop": [my_shop_name, competitor_name],
+        "Type": ["Quán của bạn", "Đối thủ"],
+        "Strengths": [my_scores.get("strengths", 7), comp_scores.get("strengths", 6)],
+        "Weaknesses": [my_scores.get("weaknesses", 5), comp_scores.get("weaknesses", 6)],
+        "Opportunities": [my_scores.get("opportunities", 6), comp_scores.get("opportunities", 5)],
+        "Threats": [my_scores.get("threats", 4), comp_scores.get("threats", 5)],
+        "Analyzed_Date": [analyzed_at.strftime("%Y-%m-%d")] * 2
+    })
+
+    # Sheet 2: Chi tiết quán của bạn
+    my_summary = comparison_data.get("my_shop", {}).get("summary", {})
+    my_details = []
+    for cat, items in my_summary.items():
+        for idx, item in enumerate(items[:3], 1):
+            my_details.append({
+                "Shop": my_shop_name,
+                "Category": cat.capitalize(),
+                "Order": idx,
+                "Detail": item
+            })
+    my_details_df = pd.DataFrame(my_details)
+
+    # Sheet 3: Chi tiết đối thủ
+    comp_summary = comparison_data.get("competitor", {}).get("summary", {})
+    comp_details = []
+    for cat, items in comp_summary.items():
+        for idx, item in enumerate(items[:3], 1):
+            comp_details.append({
+                "Shop": competitor_name,
+                "Category": cat.capitalize(),
+                "Order": idx,
+                "Detail": item
+            })
+    comp_details_df = pd.DataFrame(comp_details)
+
+    # Sheet 4: Chiến lược
+    strategy_df = pd.DataFrame({
+        "Type": ["Lợi thế"] * len(comparison_data.get("competitive_advantages", [])) + 
+                ["Cần cải thiện"] * len(comparison_data.get("areas_to_improve", [])) +
+                ["Chiến lược"] * len(comparison_data.get("strategies", [])),
+        "Content": comparison_data.get("competitive_advantages", []) + 
+                   comparison_data.get("areas_to_improve", []) +
+                   comparison_data.get("strategies", [])
+    })
+
+    excel_sheets = [
+        ("Comparison_Scores", scores_compare_df),
+        ("My_Shop_Details", my_details_df),
+        ("Competitor_Details", comp_details_df),
+        ("Strategies", strategy_df)
+    ]
+    return excel_sheets
+
+
+def display_comparison_result(comparison_data, my_shop_name, analyzed_at=None):
+    """Hiển thị kết quả so sánh quán của bạn với một đối thủ (biểu đồ, điểm, chiến lược, xuất Excel)"""
+    import plotly.express as px
+    
+    analyzed_time = analyzed_datetime(analyzed_at)
+    
+    # Tên đối thủ lấy từ AI response
+    competitor_name = comparison_data.get("competitor", {}).get("name", "Đối thủ")
+    
+    # Hiển thị các quán được phát hiện
+    detected_shops = comparison_data.get("detected_shops", [])
+    if detected_shops:
+        st.success(f"🔍 AI đã nhận diện: {', '.join(detected_shops)}")
+    
+    # ===== BIỂU ĐỒ SO SÁNH =====
+    st.markdown("---")
+    st.subheader("📊 Biểu đồ so sánh SWOT")
+    
+    my_scores = comparison_data.get("my_shop", {}).get("scores", {})
+    comp_scores = comparison_data.get("competitor", {}).get("scores", {})
+    
+    # Bar chart so sánh
+    comparison_df = pd.DataFrame({
+        "Yếu tố": ["Strengths", "Weaknesses", "Opportunities", "Threats"],
+        my_shop_name: [
+            my_scores.get("strengths", 7),
+            my_scores.get("weaknesses", 5),
+            my_scores.get("opportunities", 6),
+            my_scores.get("threats", 4)
+        ],
+        competitor_name: [
+            comp_scores.get("strengths", 6),
+            comp_scores.get("weaknesses", 6),
+            comp_scores.get("opportunities", 5),
+            comp_scores.get("threats", 5)
+        ]
+    })
+    
+    # Biểu đồ cột đứng với Plotly
+    fig = px.bar(
+        comparison_df, 
+        x="Yếu tố", 
+        y=[my_shop_name, competitor_name],
+        barmode="group",
+        title="So sánh SWOT",
+        labels={"value": "Điểm số", "variable": "Quán"},
+        color_discrete_sequence=["#667eea", "#f59e0b"]
+    )
+    fig.update_layout(
+        xaxis_title="Yếu tố SWOT",
+        yaxis_title="Điểm số (1-10)",
+        yaxis_range=[0, 10],
+        legend_title="Quán"
+    )
+    st.plotly_chart(fig, use_container_width=True)
+    
+    # Metrics so sánh
+    st.subheader("📈 Điểm số chi tiết")
+    met1, met2 = st.columns(2)
+    with met1:
+        st.markdown(f"### 🏪 {my_shop_name}")
+        m1, m2 = st.columns(2)
+        with m1:
+            st.metric("💪 Strengths", f"{my_scores.get('strengths', 7)}/10")
+            st.metric("🚀 Opportunities", f"{my_scores.get('opportunities', 6)}/10")
+        with m2:
+            st.metric("⚠️ Weaknesses", f"{my_scores.get('weaknesses', 5)}/10")
+            st.metric("⚡ Threats", f"{my_scores.get('threats', 4)}/10")
+    
+    with met2:
+        st.markdown(f"### 🎯 {competitor_name}")
+        m3, m4 = st.columns(2)
+        with m3:
+            st.metric("💪 Strengths", f"{comp_scores.get('strengths', 6)}/10")
+            st.metric("🚀 Opportunities", f"{comp_scores.get('opportunities', 5)}/10")
+        with m4:
+            st.metric("⚠️ Weaknesses", f"{comp_scores.get('weaknesses', 6)}/10")
+            st.metric("⚡ Threats", f"{comp_scores.get('threats', 5)}/10")
+    
+    # Lợi thế & Chiến lược
+    st.markdown("---")
+    st.subheader("🎯 Kết luận và Chiến lược")
+    
+    adv_col, imp_col = st.columns(2)
+    with adv_col:
+        st.markdown("#### ✅ Lợi thế của bạn")
+        for adv in comparison_data.get("competitive_advantages", []):
+            st.markdown(f"- {adv}")
+    
+    with imp_col:
+        st.markdown("#### ⚠️ Cần cải thiện")
+        for imp in comparison_data.get("areas_to_improve", []):
+            st.markdown(f"- {imp}")
+    
+    st.markdown("#### 💡 Đề xuất chiến lược")
+    for idx, strat in enumerate(comparison_data.get("strategies", []), 1):
+        st.markdown(f"{idx}. {strat}")
+    
+    # ===== EXPORT EXCEL =====
+    st.markdown("---")
+    st.subheader("📥 Xuất kết quả so sánh")
+    
+    st.download_button(
+        label="📊 Tải Excel So Sánh (Power BI)",
+        data=excel_download_data(
+            result_id("comparison", comparison_data, my_shop_name, competitor_name, analyzed_time),
+            lambda: comparison_excel_sheets(comparison_data, my_shop_name, competitor_name, analyzed_time)
+        ),
+        file_name=f"swot_comparison_{my_shop_name}_vs_{competitor_name}_{analyzed_time.strftime('%Y%m%d_%H%M%S')}.xlsx",
+        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        on_click="ignore"
+    )
+
+
+def multi_comparison_excel_sheets(comparison_data, analyzed_at=None):
+    """Các sheet Excel (tên sheet, DataFrame) của kết quả so sánh nhiều quán"""
+    analyzed_at = analyzed_at or datetime.now()
+    all_shops = [comparison_data.get("my_shop", {})] + comparison_data.get("competitors", [])
+    ranking = comparison_data.get("ranking", [])
+    
+    # Sheet 1: Điểm so sánh tổng hợp
+    scores_list = []
+    for shop in all_shops:
+        scores = shop.get("scores", {})
+        total = (scores.get('strengths', 5) + scores.get('opportunities', 5) 
+                - scores.get('weaknesses', 5) - scores.get('threats', 5) + 20) / 4
+        scores_list.append({
+            "Shop": shop.get("name", "Unknown"),
+            "Type": "Quán của bạn" if shop.get("is_my_shop") else "Đối thủ",
+            "Strengths": scores.get("strengths", 5),
+            "Weaknesses": scores.get("weaknesses", 5),
+            "Opportunities": scores.get("opportunities", 5),
+            "Threats": scores.get("threats", 5),
+            "Total_Score": round(total, 1),
+            "Analyzed_Date": analyzed_at.strftime("%Y-%m-%d")
+        })
+    scores_df = pd.DataFrame(scores_list)
+    
+    # Sheet 2: Chi tiết SWOT
+    details_list = []
+    for shop in all_shops:
+        summary = shop.get("summary", {})
+        for cat, items in summary.items():
+            category_vn = {
+                'strengths': 'Điểm mạnh',
+                'weaknesses': 'Điểm yếu', 
+                'opportunities': 'Cơ hội',
+                'threats': 'Thách thức'
+            }.get(cat, cat)
+            for idx, item in enumerate(items[:5], 1):
+                details_list.append({
+                    "Shop": shop.get("name", "Unknown"),
+                    "Type": "Quán của bạn" if shop.get("is_my_shop") else "Đối thủ",
+                    "Category": cat.capitalize(),
+                    "Category_VN": category_vn,
+                    "Order": idx,
+                    "Detail": item
+                })
+    details_df = pd.DataFrame(details_list)
+    
+    # Sheet 3: Bảng xếp hạng
+    ranking_export_df = pd.DataFrame(ranking) if ranking else pd.DataFrame()
+    
+    # Sheet 4: Chiến lược
+    strategy_df = pd.DataFrame({
+        "Type": ["Lợi thế"] * len(comparison_data.get("competitive_advantages", [])) + 
+                ["Cần cải thiện"] * len(comparison_data.get("areas_to_improve", [])) +
+                ["Chiến lược"] * len(comparison_data.get("strategies", [])),
+        "Content": comparison_data.get("competitive_advantages", []) + 
+                   comparison_data.get("areas_to_improve", []) +
+                   comparison_data.get("strategies", [])
+    })
+    
+    excel_sheets = [("All_Scores", scores_df), ("SWOT_Details", details_df)]
+    if not ranking_export_df.empty:
+        excel_sheets.append(("Ranking", ranking_export_df))
+    excel_sheets.append(("Strategies", strategy_df))
+    return excel_sheets
+
+
+def display_multi_comparison_charts(comparison_data, my_shop_name, analyzed_at=None):
+    """Hiển thị biểu đồ so sánh nhiều quán (analyzed_at: xem analyzed_datetime)"""
+    import plotly.express as px
+    
+    analyzed_time = analyzed_datetime(analyzed_at)
     
     my_shop = comparison_data.get("my_shop", {})
     competitors = comparison_data.get("competitors", [])
@@ -996,77 +1604,18 @@ def display_multi_comparison_charts(comparison_data, my_shop_name):
     st.markdown("---")
     st.subheader("📥 Xuất kết quả so sánh")
     
-    excel_buffer = BytesIO()
-    
-    # Sheet 1: Điểm so sánh tổng hợp
-    scores_list = []
-    for shop in all_shops:
-        scores = shop.get("scores", {})
-        total = (scores.get('strengths', 5) + scores.get('opportunities', 5) 
-                - scores.get('weaknesses', 5) - scores.get('threats', 5) + 20) / 4
-        scores_list.append({
-            "Shop": shop.get("name", "Unknown"),
-            "Type": "Quán của bạn" if shop.get("is_my_shop") else "Đối thủ",
-            "Strengths": scores.get("strengths", 5),
-            "Weaknesses": scores.get("weaknesses", 5),
-            "Opportunities": scores.get("opportunities", 5),
-            "Threats": scores.get("threats", 5),
-            "Total_Score": round(total, 1),
-            "Analyzed_Date": datetime.now().strftime("%Y-%m-%d")
-        })
-    scores_df = pd.DataFrame(scores_list)
-    
-    # Sheet 2: Chi tiết SWOT
-    details_list = []
-    for shop in all_shops:
-        summary = shop.get("summary", {})
-        for cat, items in summary.items():
-            category_vn = {
-                'strengths': 'Điểm mạnh',
-                'weaknesses': 'Điểm yếu', 
-                'opportunities': 'Cơ hội',
-                'threats': 'Thách thức'
-            }.get(cat, cat)
-            for idx, item in enumerate(items[:5], 1):
-                details_list.append({
-                    "Shop": shop.get("name", "Unknown"),
-                    "Type": "Quán của bạn" if shop.get("is_my_shop") else "Đối thủ",
-                    "Category": cat.capitalize(),
-                    "Category_VN": category_vn,
-                    "Order": idx,
-                    "Detail": item
-                })
-    details_df = pd.DataFrame(details_list)
-    
-    # Sheet 3: Bảng xếp hạng
-    ranking_export_df = pd.DataFrame(ranking) if ranking else pd.DataFrame()
-    
-    # Sheet 4: Chiến lược
-    strategy_df = pd.DataFrame({
-        "Type": ["Lợi thế"] * len(comparison_data.get("competitive_advantages", [])) + 
-                ["Cần cải thiện"] * len(comparison_data.get("areas_to_improve", [])) +
-                ["Chiến lược"] * len(comparison_data.get("strategies", [])),
-        "Content": comparison_data.get("competitive_advantages", []) + 
-                   comparison_data.get("areas_to_improve", []) +
-                   comparison_data.get("strategies", [])
-    })
-    
-    with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
-        scores_df.to_excel(writer, sheet_name='All_Scores', index=False)
-        details_df.to_excel(writer, sheet_name='SWOT_Details', index=False)
-        if not ranking_export_df.empty:
-            ranking_export_df.to_excel(writer, sheet_name='Ranking', index=False)
-        strategy_df.to_excel(writer, sheet_name='Strategies', index=False)
-    
-    excel_buffer.seek(0)
     
     exp_col1, exp_col2 = st.columns(2)
     with exp_col1:
         st.download_button(
             label="📊 Tải Excel So Sánh (Power BI)",
-            data=excel_buffer,
-            file_name=f"swot_multi_comparison_{my_shop_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            data=excel_download_data(
+                result_id("multi_comparison", comparison_data, analyzed_time),
+                lambda: multi_comparison_excel_sheets(comparison_data, analyzed_time)
+            ),
+            file_name=f"swot_multi_comparison_{my_shop_name}_{analyzed_time.strftime('%Y%m%d_%H%M%S')}.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            on_click="ignore"
         )
     
     with exp_col2:
@@ -1074,26 +1623,20 @@ def display_multi_comparison_charts(comparison_data, my_shop_name):
         st.download_button(
             label="📋 Tải JSON",
             data=json_str,
-            file_name=f"swot_multi_comparison_{my_shop_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+            file_name=f"swot_multi_comparison_{my_shop_name}_{analyzed_time.strftime('%Y%m%d_%H%M%S')}.json",
             mime="application/json"
         )
 
 
-def analyze_specific_branch(brand_name, branch_location, csv_summary=""):
+@track_mode("branch")
+def analyze_specific_branch(brand_name, branch_location, csv_summary="", stream=False, json_mode=False):
     """Phân tích SWOT cho một chi nhánh cụ thể (không phải toàn chuỗi)"""
-    context = f"\n{csv_summary}" if csv_summary else ""
-    
-    prompt = f"""
-Bạn là chuyên gia phân tích kinh doanh và là một Data Analyst trong lĩnh vực F&B tại Việt Nam.
-
-🔍 TÌM KIẾM CHUYÊN SÂU - PHÂN TÍCH CHI NHÁNH CỤ THỂ:
-- 🏪 THƯƠNG HIỆU: {brand_name}
-- 📍 CHI NHÁNH: {branch_location}
-{context}
+    instructions = """
+🔍 TÌM KIẾM CHUYÊN SÂU - PHÂN TÍCH CHI NHÁNH CỤ THỂ (thương hiệu và chi nhánh nêu ở cuối)
 
 ⚠️ LƯU Ý QUAN TRỌNG:
 - Đây là phân tích cho MỘT CHI NHÁNH CỤ THỂ, KHÔNG PHẢI cả chuỗi
-- Tập trung vào đặc điểm riêng của chi nhánh này tại vị trí "{branch_location}"
+- Tập trung vào đặc điểm riêng của chi nhánh này tại vị trí của nó
 - Phân tích dựa trên:
   + Vị trí địa lý cụ thể (khu vực, đặc điểm dân cư, giao thông)
   + Đối thủ cạnh tranh tại khu vực đó
@@ -1104,12 +1647,12 @@ YÊU CẦU:
 1. Phân tích SWOT chi tiết CHO CHI NHÁNH NÀY (không phải toàn chuỗi)
 2. Cho điểm từ 1-10 cho mỗi yếu tố SWOT
 3. Đề xuất chiến lược phù hợp với vị trí cụ thể
-
-QUAN_TRONG: Trả về một block JSON ở cuối với format:
+"""
+    response_format = f"""QUAN_TRONG: Trả về một block JSON ở cuối với format:
 ```json
 {{
-    "brand_name": "{brand_name}",
-    "branch_location": "{branch_location}",
+    "brand_name": "<tên thương hiệu>",
+    "branch_location": "<địa chỉ chi nhánh>",
     "analysis_type": "specific_branch",
     "scores": {{
         "strengths": <điểm 1-10>,
@@ -1133,7 +1676,7 @@ QUAN_TRONG: Trả về một block JSON ở cuối với format:
 }}
 ```
 
-Bây giờ hãy phân tích chi tiết CHI NHÁNH "{brand_name} - {branch_location}":
+Bây giờ hãy phân tích chi tiết CHI NHÁNH:
 
 📍 PHÂN TÍCH VỊ TRÍ:
 - Đặc điểm khu vực...
@@ -1157,7 +1700,11 @@ Bây giờ hãy phân tích chi tiết CHI NHÁNH "{brand_name} - {branch_locati
 
 Cuối cùng, đưa ra block JSON như yêu cầu.
 """
-    return call_gemini(prompt)
+    prompt = analysis_prompt(instructions, response_format, json_mode, context=csv_summary,
+                             query=f"- 🏪 THƯƠNG HIỆU: {brand_name}\n- 📍 CHI NHÁNH: {branch_location}")
+    if json_mode:
+        return call_gemini(prompt, generation_config=json_generation_config("branch"), stream=stream)
+    return call_gemini(prompt, stream=stream)
 
 
 def extract_branch_json(response_text):
@@ -1190,8 +1737,96 @@ def extract_branch_json(response_text):
     }
 
 
-def display_branch_charts(branch_data, brand_name, branch_location):
-    """Hiển thị biểu đồ cho phân tích chi nhánh"""
+def branch_excel_sheets(branch_data, brand_name, branch_location, analyzed_at=None):
+    """Các sheet Excel (tên sheet, DataFrame) của kết quả phân tích chi nhánh"""
+    analyzed_at = analyzed_at or datetime.now()
+    scores = branch_data.get("scores", {})
+    summary = branch_data.get("summary", {})
+    location_analysis = branch_data.get("location_analysis", {})
+    local_strategies = branch_data.get('local_strategies', [])
+    
+    # Sheet 1: Điểm số
+    scores_df = pd.DataFrame({
+        "Brand": [brand_name] * 4,
+        "Branch_Location": [branch_location] * 4,
+        "Category": ["Strengths", "Weaknesses", "Opportunities", "Threats"],
+        "Category_VN": ["Điểm mạnh", "Điểm yếu", "Cơ hội", "Thách thức"],
+        "Score": [
+            scores.get('strengths', 7),
+            scores.get('weaknesses', 5),
+            scores.get('opportunities', 6),
+            scores.get('threats', 4)
+        ],
+        "Type": ["Internal", "Internal", "External", "External"],
+        "Analysis_Type": ["Specific_Branch"] * 4,
+        "Analyzed_Date": [analyzed_at.strftime("%Y-%m-%d")] * 4
+    })
+    
+    # Sheet 2: Phân tích vị trí
+    location_df = pd.DataFrame({
+        "Field": ["Brand", "Branch_Location", "Area_Characteristics", "Target_Customers", "Traffic_Level", "Analyzed_Date"],
+        "Value": [
+            brand_name,
+            branch_location,
+            location_analysis.get('area_characteristics', ''),
+            location_analysis.get('target_customers', ''),
+            location_analysis.get('traffic_level', ''),
+            analyzed_at.strftime("%Y-%m-%d")
+        ]
+    })
+    
+    # Sheet 3: Chi tiết SWOT
+    details_list = []
+    for category, items in summary.items():
+        category_vn = {
+            'strengths': 'Điểm mạnh',
+            'weaknesses': 'Điểm yếu', 
+            'opportunities': 'Cơ hội',
+            'threats': 'Thách thức'
+        }.get(category, category)
+        
+        for idx, item in enumerate(items[:5], 1):
+            details_list.append({
+                "Brand": brand_name,
+                "Branch_Location": branch_location,
+                "Category": category.capitalize(),
+                "Category_VN": category_vn,
+                "Order": idx,
+                "Detail": item
+            })
+    details_df = pd.DataFrame(details_list)
+    
+    # Sheet 4: Đối thủ gần đây
+    competitors = location_analysis.get('nearby_competitors', [])
+    competitors_df = pd.DataFrame({
+        "Brand": [brand_name] * len(competitors),
+        "Branch_Location": [branch_location] * len(competitors),
+        "Nearby_Competitor": competitors,
+        "Order": list(range(1, len(competitors) + 1))
+    }) if competitors else pd.DataFrame()
+    
+    # Sheet 5: Chiến lược địa phương
+    strategies_df = pd.DataFrame({
+        "Brand": [brand_name] * len(local_strategies),
+        "Branch_Location": [branch_location] * len(local_strategies),
+        "Strategy": local_strategies,
+        "Order": list(range(1, len(local_strategies) + 1))
+    }) if local_strategies else pd.DataFrame()
+    
+    excel_sheets = [("SWOT_Scores", scores_df), ("Location_Analysis", location_df), ("SWOT_Details", details_df)]
+    if not competitors_df.empty:
+        excel_sheets.append(("Nearby_Competitors", competitors_df))
+    if not strategies_df.empty:
+        excel_sheets.append(("Local_Strategies", strategies_df))
+    return excel_sheets
+
+
+def display_branch_charts(branch_data, brand_name, branch_location, analyzed_at=None):
+    """Hiển thị biểu đồ cho phân tích chi nhánh (analyzed_at: xem analyzed_datetime)"""
+    import plotly.express as px
+    
+    analyzed_time = analyzed_datetime(analyzed_at)
+
     scores = branch_data.get("scores", {})
     summary = branch_data.get("summary", {})
     location_analysis = branch_data.get("location_analysis", {})
@@ -1300,94 +1935,18 @@ def display_branch_charts(branch_data, brand_name, branch_location):
     st.markdown("---")
     st.subheader("📥 Xuất kết quả")
     
-    excel_buffer = BytesIO()
-    
-    # Sheet 1: Điểm số
-    scores_df = pd.DataFrame({
-        "Brand": [brand_name] * 4,
-        "Branch_Location": [branch_location] * 4,
-        "Category": ["Strengths", "Weaknesses", "Opportunities", "Threats"],
-        "Category_VN": ["Điểm mạnh", "Điểm yếu", "Cơ hội", "Thách thức"],
-        "Score": [
-            scores.get('strengths', 7),
-            scores.get('weaknesses', 5),
-            scores.get('opportunities', 6),
-            scores.get('threats', 4)
-        ],
-        "Type": ["Internal", "Internal", "External", "External"],
-        "Analysis_Type": ["Specific_Branch"] * 4,
-        "Analyzed_Date": [datetime.now().strftime("%Y-%m-%d")] * 4
-    })
-    
-    # Sheet 2: Phân tích vị trí
-    location_df = pd.DataFrame({
-        "Field": ["Brand", "Branch_Location", "Area_Characteristics", "Target_Customers", "Traffic_Level", "Analyzed_Date"],
-        "Value": [
-            brand_name,
-            branch_location,
-            location_analysis.get('area_characteristics', ''),
-            location_analysis.get('target_customers', ''),
-            location_analysis.get('traffic_level', ''),
-            datetime.now().strftime("%Y-%m-%d")
-        ]
-    })
-    
-    # Sheet 3: Chi tiết SWOT
-    details_list = []
-    for category, items in summary.items():
-        category_vn = {
-            'strengths': 'Điểm mạnh',
-            'weaknesses': 'Điểm yếu', 
-            'opportunities': 'Cơ hội',
-            'threats': 'Thách thức'
-        }.get(category, category)
-        
-        for idx, item in enumerate(items[:5], 1):
-            details_list.append({
-                "Brand": brand_name,
-                "Branch_Location": branch_location,
-                "Category": category.capitalize(),
-                "Category_VN": category_vn,
-                "Order": idx,
-                "Detail": item
-            })
-    details_df = pd.DataFrame(details_list)
-    
-    # Sheet 4: Đối thủ gần đây
-    competitors = location_analysis.get('nearby_competitors', [])
-    competitors_df = pd.DataFrame({
-        "Brand": [brand_name] * len(competitors),
-        "Branch_Location": [branch_location] * len(competitors),
-        "Nearby_Competitor": competitors,
-        "Order": list(range(1, len(competitors) + 1))
-    }) if competitors else pd.DataFrame()
-    
-    # Sheet 5: Chiến lược địa phương
-    strategies_df = pd.DataFrame({
-        "Brand": [brand_name] * len(local_strategies),
-        "Branch_Location": [branch_location] * len(local_strategies),
-        "Strategy": local_strategies,
-        "Order": list(range(1, len(local_strategies) + 1))
-    }) if local_strategies else pd.DataFrame()
-    
-    with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
-        scores_df.to_excel(writer, sheet_name='SWOT_Scores', index=False)
-        location_df.to_excel(writer, sheet_name='Location_Analysis', index=False)
-        details_df.to_excel(writer, sheet_name='SWOT_Details', index=False)
-        if not competitors_df.empty:
-            competitors_df.to_excel(writer, sheet_name='Nearby_Competitors', index=False)
-        if not strategies_df.empty:
-            strategies_df.to_excel(writer, sheet_name='Local_Strategies', index=False)
-    
-    excel_buffer.seek(0)
     
     exp_col1, exp_col2 = st.columns(2)
     with exp_col1:
         st.download_button(
             label="📊 Tải Excel (Power BI)",
-            data=excel_buffer,
-            file_name=f"swot_branch_{brand_name}_{branch_location.replace(' ', '_')}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            data=excel_download_data(
+                result_id("branch", branch_data, brand_name, branch_location, analyzed_time),
+                lambda: branch_excel_sheets(branch_data, brand_name, branch_location, analyzed_time)
+            ),
+            file_name=f"swot_branch_{brand_name}_{branch_location.replace(' ', '_')}_{analyzed_time.strftime('%Y%m%d_%H%M%S')}.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            on_click="ignore"
         )
     
     with exp_col2:
@@ -1395,7 +1954,7 @@ def display_branch_charts(branch_data, brand_name, branch_location):
         st.download_button(
             label="📋 Tải JSON",
             data=json_str,
-            file_name=f"swot_branch_{brand_name}_{branch_location.replace(' ', '_')}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+            file_name=f"swot_branch_{brand_name}_{branch_location.replace(' ', '_')}_{analyzed_time.strftime('%Y%m%d_%H%M%S')}.json",
             mime="application/json"
         )
 
@@ -1473,14 +2032,10 @@ def clean_result_text(result_text):
     return cleaned.strip()
 
 
-def display_swot_charts(swot_data, shop_name):
-    """Hiển thị biểu đồ SWOT"""
-    scores = swot_data.get("scores", {})
-    summary = swot_data.get("summary", {})
-    
-    # Row 1: Biểu đồ điểm số
-    st.subheader("📊 Biểu đồ phân tích SWOT")
-    
+def display_swot_score_chart(scores, chart_key=None):
+    """Biểu đồ cột và metric điểm SWOT của một quán"""
+    import plotly.express as px
+
     col1, col2 = st.columns(2)
     
     with col1:
@@ -1506,7 +2061,7 @@ def display_swot_charts(swot_data, shop_name):
             }
         )
         fig.update_layout(yaxis_range=[0, 10], showlegend=False)
-        st.plotly_chart(fig, use_container_width=True)
+        st.plotly_chart(fig, use_container_width=True, key=chart_key)
     
     with col2:
         m1, m2 = st.columns(2)
@@ -1516,10 +2071,10 @@ def display_swot_charts(swot_data, shop_name):
         with m2:
             st.metric("⚠️ Weaknesses", f"{scores.get('weaknesses', 5)}/10", "Điểm yếu")
             st.metric("⚡ Threats", f"{scores.get('threats', 4)}/10", "Thách thức")
-    
-    # Row 2: SWOT Grid
-    st.subheader("🎯 Ma trận SWOT")
-    
+
+
+def display_swot_matrix(summary):
+    """Ma trận SWOT 2x2 (tối đa 3 ý mỗi ô)"""
     c1, c2 = st.columns(2)
     
     with c1:
@@ -1555,90 +2110,113 @@ def display_swot_charts(swot_data, shop_name):
         """, unsafe_allow_html=True)
         for item in summary.get('threats', [])[:3]:
             st.markdown(f"🔥 {item}")
+
+
+def swot_excel_sheets(swot_data, shop_name, analyzed_at=None):
+    """Các sheet Excel (tên sheet, DataFrame) của kết quả SWOT một quán (analyzed_at: thời điểm phân tích)"""
+    analyzed_at = analyzed_at or datetime.now()
+    scores = swot_data.get("scores", {})
+    summary = swot_data.get("summary", {})
+    
+    # Sheet 1: Điểm số SWOT (dạng bảng cho biểu đồ)
+    scores_df = pd.DataFrame({
+        "Shop_Name": [shop_name] * 4,
+        "Category": ["Strengths", "Weaknesses", "Opportunities", "Threats"],
+        "Category_VN": ["Điểm mạnh", "Điểm yếu", "Cơ hội", "Thách thức"],
+        "Score": [
+            scores.get('strengths', 7),
+            scores.get('weaknesses', 5),
+            scores.get('opportunities', 6),
+            scores.get('threats', 4)
+        ],
+        "Type": ["Internal", "Internal", "External", "External"],
+        "Impact": ["Positive", "Negative", "Positive", "Negative"],
+        "Analyzed_Date": [analyzed_at.strftime("%Y-%m-%d")] * 4,
+        "Analyzed_Time": [analyzed_at.strftime("%H:%M:%S")] * 4
+    })
+
+    # Sheet 2: Chi tiết SWOT (dạng danh sách cho filter)
+    details_list = []
+    for category, items in summary.items():
+        category_vn = {
+            'strengths': 'Điểm mạnh',
+            'weaknesses': 'Điểm yếu', 
+            'opportunities': 'Cơ hội',
+            'threats': 'Thách thức'
+        }.get(category, category)
+
+        for idx, item in enumerate(items[:5], 1):  # Lấy tối đa 5 items
+            details_list.append({
+                "Shop_Name": shop_name,
+                "Category": category.capitalize(),
+                "Category_VN": category_vn,
+                "Order": idx,
+                "Detail": item,
+                "Score": scores.get(category, 5),
+                "Analyzed_Date": analyzed_at.strftime("%Y-%m-%d")
+            })
+
+    details_df = pd.DataFrame(details_list)
+
+    # Sheet 3: Metadata
+    metadata_df = pd.DataFrame({
+        "Field": ["Shop Name", "Analysis Date", "Analysis Time", "Strengths Score", "Weaknesses Score", "Opportunities Score", "Threats Score", "Overall Score", "Data Source"],
+        "Value": [
+            shop_name,
+            analyzed_at.strftime("%Y-%m-%d"),
+            analyzed_at.strftime("%H:%M:%S"),
+            scores.get('strengths', 7),
+            scores.get('weaknesses', 5),
+            scores.get('opportunities', 6),
+            scores.get('threats', 4),
+            round((scores.get('strengths', 7) + scores.get('opportunities', 6) - scores.get('weaknesses', 5) - scores.get('threats', 4) + 20) / 4, 1),
+            "AI Analysis"
+        ]
+    })
+
+    excel_sheets = [("SWOT_Scores", scores_df), ("SWOT_Details", details_df), ("Metadata", metadata_df)]
+    return excel_sheets
+
+
+def display_swot_charts(swot_data, shop_name, key="swot", analyzed_at=None):
+    """Hiển thị biểu đồ SWOT (key: tiền tố key của biểu đồ/nút tải, để nhiều tab cùng hiển thị được)
+
+    analyzed_at: thời điểm phân tích ("%Y-%m-%d %H:%M:%S", đóng dấu khi lưu kết quả, xem result_history);
+    swot_data có thể là dữ liệu đã lưu trong lịch sử nên không bị sửa ở đây.
+    """
+    analyzed_time = analyzed_datetime(analyzed_at)
+    scores = swot_data.get("scores", {})
+    summary = swot_data.get("summary", {})
+    
+    # Row 1: Biểu đồ điểm số
+    st.subheader("📊 Biểu đồ phân tích SWOT")
+    display_swot_score_chart(scores, chart_key=f"{key}_scores")
+    
+    # Row 2: SWOT Grid
+    st.subheader("🎯 Ma trận SWOT")
+    display_swot_matrix(summary)
     
     # Row 3: Export buttons
     st.markdown("---")
     st.subheader("📥 Xuất kết quả")
     
-    # Prepare export data
-    swot_data["analyzed_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    swot_data["shop_name"] = shop_name
+    # Dữ liệu xuất: bản sao kèm thời điểm phân tích và tên quán
+    export_data = dict(swot_data, analyzed_at=analyzed_time.strftime(ANALYZED_AT_FORMAT), shop_name=shop_name)
     
     export_col1, export_col2, export_col3 = st.columns(3)
     
     with export_col1:
         # ===== EXCEL EXPORT (Best for Power BI) =====
-        excel_buffer = BytesIO()
-        
-        # Sheet 1: Điểm số SWOT (dạng bảng cho biểu đồ)
-        scores_df = pd.DataFrame({
-            "Shop_Name": [shop_name] * 4,
-            "Category": ["Strengths", "Weaknesses", "Opportunities", "Threats"],
-            "Category_VN": ["Điểm mạnh", "Điểm yếu", "Cơ hội", "Thách thức"],
-            "Score": [
-                scores.get('strengths', 7),
-                scores.get('weaknesses', 5),
-                scores.get('opportunities', 6),
-                scores.get('threats', 4)
-            ],
-            "Type": ["Internal", "Internal", "External", "External"],
-            "Impact": ["Positive", "Negative", "Positive", "Negative"],
-            "Analyzed_Date": [datetime.now().strftime("%Y-%m-%d")] * 4,
-            "Analyzed_Time": [datetime.now().strftime("%H:%M:%S")] * 4
-        })
-        
-        # Sheet 2: Chi tiết SWOT (dạng danh sách cho filter)
-        details_list = []
-        for category, items in summary.items():
-            category_vn = {
-                'strengths': 'Điểm mạnh',
-                'weaknesses': 'Điểm yếu', 
-                'opportunities': 'Cơ hội',
-                'threats': 'Thách thức'
-            }.get(category, category)
-            
-            for idx, item in enumerate(items[:5], 1):  # Lấy tối đa 5 items
-                details_list.append({
-                    "Shop_Name": shop_name,
-                    "Category": category.capitalize(),
-                    "Category_VN": category_vn,
-                    "Order": idx,
-                    "Detail": item,
-                    "Score": scores.get(category, 5),
-                    "Analyzed_Date": datetime.now().strftime("%Y-%m-%d")
-                })
-        
-        details_df = pd.DataFrame(details_list)
-        
-        # Sheet 3: Metadata
-        metadata_df = pd.DataFrame({
-            "Field": ["Shop Name", "Analysis Date", "Analysis Time", "Strengths Score", "Weaknesses Score", "Opportunities Score", "Threats Score", "Overall Score", "Data Source"],
-            "Value": [
-                shop_name,
-                datetime.now().strftime("%Y-%m-%d"),
-                datetime.now().strftime("%H:%M:%S"),
-                scores.get('strengths', 7),
-                scores.get('weaknesses', 5),
-                scores.get('opportunities', 6),
-                scores.get('threats', 4),
-                round((scores.get('strengths', 7) + scores.get('opportunities', 6) - scores.get('weaknesses', 5) - scores.get('threats', 4) + 20) / 4, 1),
-                "AI Analysis"
-            ]
-        })
-        
-        # Write to Excel with multiple sheets
-        with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
-            scores_df.to_excel(writer, sheet_name='SWOT_Scores', index=False)
-            details_df.to_excel(writer, sheet_name='SWOT_Details', index=False)
-            metadata_df.to_excel(writer, sheet_name='Metadata', index=False)
-        
-        excel_buffer.seek(0)
-        
         st.download_button(
             label="� Tải Excel (Power BI)",
-            data=excel_buffer,
-            file_name=f"swot_{shop_name.replace(' ', '_')}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            data=excel_download_data(
+                result_id("swot", shop_name, scores, summary, analyzed_time),
+                lambda: swot_excel_sheets(export_data, shop_name, analyzed_time)
+            ),
+            file_name=f"swot_{shop_name.replace(' ', '_')}_{analyzed_time.strftime('%Y%m%d_%H%M%S')}.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            on_click="ignore",
+            key=f"{key}_excel"
         )
     
     with export_col2:
@@ -1673,22 +2251,304 @@ def display_swot_charts(swot_data, shop_name):
             ],
             "Type": ["Internal", "Internal", "External", "External"],
             "Impact": ["Positive", "Negative", "Positive", "Negative"],
-            "Analyzed_Date": [datetime.now().strftime("%Y-%m-%d")] * 4
+            "Analyzed_Date": [analyzed_time.strftime("%Y-%m-%d")] * 4
         })
         st.download_button(
             label="� Tải CSV",
             data=csv_data.to_csv(index=False).encode('utf-8-sig'),  # UTF-8 BOM for Excel compatibility
-            file_name=f"swot_{shop_name.replace(' ', '_')}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-            mime="text/csv"
+            file_name=f"swot_{shop_name.replace(' ', '_')}_{analyzed_time.strftime('%Y%m%d_%H%M%S')}.csv",
+            mime="text/csv",
+            key=f"{key}_csv"
         )
     
     with export_col3:
-        json_str = json.dumps(swot_data, ensure_ascii=False, indent=2)
+        json_str = json.dumps(export_data, ensure_ascii=False, indent=2)
         st.download_button(
             label="📋 Tải JSON",
             data=json_str,
-            file_name=f"swot_{shop_name.replace(' ', '_')}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
-            mime="application/json"
+            file_name=f"swot_{shop_name.replace(' ', '_')}_{analyzed_time.strftime('%Y%m%d_%H%M%S')}.json",
+            mime="application/json",
+            key=f"{key}_json"
+        )
+
+
+def clicked_button():
+    """Key của nút vừa bấm trong lượt chạy này (mọi nút đều có key "btn..."), None nếu không có"""
+    return next((key for key, value in st.session_state.items()
+                 if isinstance(key, str) and key.startswith("btn") and value is True), None)
+
+
+def confirm_name_match(name, key, kind=SHOP):
+    """Tên gõ gần giống một tên đã phân tích (xem shop_names): hỏi người dùng có phải cùng quán không.
+    Đặt ngay dưới ô nhập tên (ngoài nhánh nút bấm, để giữ được lựa chọn qua các lượt chạy)"""
+    suggestion = shop_name_suggestion(name, kind) if name and name.strip() else None
+    if not suggestion:
+        return False
+    return st.checkbox(
+        f"🔤 '{name.strip()}' là '{suggestion}'? (dùng chung kết quả đã phân tích)",
+        key=f"{key}_{fold_name(name)}"
+    )
+
+
+def normalize_name_input(name, kind=SHOP, accept_suggestion=False):
+    """Tên người dùng gõ (giữ nguyên, chỉ gộp khoảng trắng) để đưa vào prompt; tên chuẩn tương ứng
+    chỉ dùng cho key cache, để các cách gõ khác nhau của cùng một quán dùng chung kết quả"""
+    return use_shop_name(name, kind, accept_suggestion)
+
+
+@contextlib.contextmanager
+def tab_scope(tab):
+    """Phần code của một tab: gắn nhãn metrics và profile riêng (theo tab + nút bấm), tên chuẩn cho key cache"""
+    with metrics_context(tab=tab), profile_section("tab", tab=tab, button=clicked_button()), key_name_scope():
+        yield
+
+
+def comparison_job(job, my_shop_name, all_csv_summary, use_cache=True, json_mode=False):
+    """Job nền của tab so sánh đối thủ; trả về kết quả dạng mục lịch sử"""
+    use_cache_override.set(use_cache)
+    job.set_progress(0.1, "AI đang so sánh...")
+    comparison_data, clean_text = run_analysis_sync(
+        analyze_competitor_with_my_shop, (my_shop_name, all_csv_summary), "comparison", extract_comparison_json, json_mode
+    )
+    competitor_name = comparison_data.get("competitor", {}).get("name", "Đối thủ")
+    return {
+        "kind": "comparison",
+        "title": f"{my_shop_name} vs {competitor_name}",
+        "data": comparison_data,
+        "text": clean_text,
+        "params": {"my_shop_name": my_shop_name}
+    }
+
+
+def multi_comparison_job(job, my_shop_name, shop_summaries, all_csv_summary, use_fanout=False,
+                         max_workers=FANOUT_MAX_WORKERS, use_cache=True, json_mode=False):
+    """Job nền của tab so sánh nhiều quán; trả về kết quả dạng mục lịch sử"""
+    use_cache_override.set(use_cache)
+    errors = {}
+    if use_fanout:
+        def update_progress(done, total, file_name):
+            # Phần gộp kết quả chiếm 10% cuối
+            job.set_progress(0.9 * done / total, f"✓ {file_name} ({done}/{total})")
+        
+        job.set_progress(0.0, "Đang phân tích từng quán...")
+        result, comparison_data, errors = analyze_multi_competitor_fanout(
+            my_shop_name, shop_summaries, max_workers=max_workers, use_cache=use_cache,
+            on_progress=update_progress, json_mode=json_mode
+        )
+        clean_text = clean_result_text(result)
+    else:
+        job.set_progress(0.1, "AI đang so sánh tất cả các quán...")
+        comparison_data, clean_text = run_analysis_sync(
+            analyze_multi_competitor_with_my_shop, (my_shop_name, all_csv_summary),
+            "multi_comparison", extract_multi_comparison_json, json_mode
+        )
+    return {
+        "kind": "multi_comparison",
+        "title": f"{my_shop_name} + {len(shop_summaries) - 1} quán",
+        "data": comparison_data,
+        "text": clean_text,
+        "params": {"my_shop_name": my_shop_name, "errors": errors}
+    }
+
+
+def tracked_job_ids():
+    """ID các job nền của người dùng, lưu trong URL (?job=...) để còn sau khi tải lại trang"""
+    return st.query_params.get_all("job")
+
+
+def track_job(job):
+    st.query_params["job"] = tracked_job_ids() + [job.id]
+
+
+def untrack_job(job_id):
+    remaining = [other for other in tracked_job_ids() if other != job_id]
+    if remaining:
+        st.query_params["job"] = remaining
+    else:
+        del st.query_params["job"]
+
+
+def collect_finished_jobs(tab):
+    """Đưa job đã xong của tab vào lịch sử kết quả, báo lỗi job hỏng; trả về các job chưa xong"""
+    manager = get_job_manager()
+    pending = []
+    for job_id in tracked_job_ids():
+        job = manager.get(job_id)
+        if job is None:
+            untrack_job(job_id)
+            continue
+        if job.tab != tab:
+            continue
+        if not job.finished:
+            pending.append(job)
+            continue
+        if job.status == DONE:
+            result = job.result
+            ResultHistory(st.session_state).add(tab, result["kind"], result["title"], result["data"], result["text"], **result["params"])
+            st.success(f"✅ Job nền xong sau {job.elapsed:.0f}s: {job.title}")
+        elif job.status == ERROR:
+            st.error(f"❌ Job nền lỗi ({job.title}): {job.error}")
+        untrack_job(job_id)
+    return pending
+
+
+def jobs_panel(tab):
+    """Tiến độ các job nền đang chạy của tab; tự cập nhật, khi có job xong thì chạy lại cả trang để hiển thị kết quả"""
+    manager = get_job_manager()
+    jobs = [job for job in (manager.get(job_id) for job_id in tracked_job_ids()) if job is not None and job.tab == tab]
+    if any(job.finished for job in jobs):
+        st.rerun()
+    for job in jobs:
+        if job.status == QUEUED:
+            job_col1, job_col2 = st.columns([4, 1])
+            with job_col1:
+                st.progress(0.0, text=f"🕒 {job.title}: đang chờ worker trống")
+            with job_col2:
+                if st.button("✖️ Hủy", key=f"btn_cancel_job_{job.id}"):
+                    manager.cancel(job.id)
+                    st.rerun()
+        else:
+            st.progress(job.progress, text=f"⏳ {job.title}: {job.message or 'đang chạy'} · {job.elapsed:.0f}s")
+
+
+def display_jobs(tab):
+    """Job nền của tab: thu kết quả job đã xong, hiện tiến độ job đang chạy (cập nhật mỗi SWOT_JOB_POLL_SECONDS giây)"""
+    if collect_finished_jobs(tab):
+        st.fragment(jobs_panel, run_every=JOB_POLL_SECONDS)(tab)
+
+
+def display_result(entry):
+    """Hiển thị một kết quả đã lưu: chỉ vẽ lại từ dữ liệu, không gọi model"""
+    data, params = entry["data"], entry["params"]
+    if entry["kind"] == "swot":
+        display_swot_charts(data, params["shop_name"], key=entry["tab"], analyzed_at=entry.get("analyzed_at"))
+    elif entry["kind"] == "comparison":
+        display_comparison_result(data, params["my_shop_name"], entry.get("analyzed_at"))
+    elif entry["kind"] == "multi_comparison":
+        for file_name, error in params.get("errors", {}).items():
+            st.warning(f"⚠️ Không phân tích được {file_name}: {error}")
+        
+        # Hiển thị các quán được phát hiện
+        detected_shops = data.get("detected_shops", [])
+        if detected_shops:
+            st.success(f"🔍 AI đã nhận diện {len(detected_shops)} quán: {', '.join(detected_shops)}")
+        
+        st.markdown("---")
+        display_multi_comparison_charts(data, params["my_shop_name"], entry.get("analyzed_at"))
+    elif entry["kind"] == "branch":
+        display_branch_charts(data, params["brand_name"], params["branch_location"], entry.get("analyzed_at"))
+    
+    # Phân tích chi tiết
+    st.markdown("---")
+    st.subheader("📋 Phân tích chi tiết")
+    st.markdown(entry["text"])
+    
+    if entry["kind"] in ("comparison", "multi_comparison"):
+        display_followup_chat(entry)
+
+
+@track_mode("followup")
+def ask_followup(prompt):
+    """Câu hỏi tiếp về một kết quả (prompt từ FollowupChat.prompt), trả về stream câu trả lời"""
+    return call_gemini(prompt, stream=True)
+
+
+def followup_stats(turn):
+    return (f"📏 Prompt: {turn['sent_tokens']:,} token gửi đi / {turn['prompt_tokens']:,} token ngữ cảnh"
+            f" · ⏱️ {turn['latency']:.1f}s")
+
+
+def display_followup_chat(entry):
+    """Hỏi tiếp về kết quả đang hiển thị: phiên hỏi đáp riêng của kết quả, không gửi lại dữ liệu CSV"""
+    chat = FollowupChat(entry)
+    st.markdown("---")
+    st.subheader("💬 Hỏi thêm về kết quả này")
+    st.caption("AI trả lời dựa trên kết quả phân tích ở trên và các câu hỏi trước, không gửi lại file CSV.")
+    for turn in chat.turns:
+        with st.chat_message("user"):
+            st.markdown(turn["question"])
+        with st.chat_message("assistant"):
+            st.markdown(turn["answer"])
+            st.caption(followup_stats(turn))
+    
+    with st.form(key=f"followup_{entry['tab']}_{entry['id']}", clear_on_submit=True):
+        question = st.text_input("❓ Câu hỏi:", placeholder="VD: Vì sao giá trà sữa của mình cao hơn đối thủ?")
+        submitted = st.form_submit_button("💬 Hỏi")
+    if not (submitted and question.strip()):
+        return
+    
+    with st.chat_message("user"):
+        st.markdown(question)
+    with st.chat_message("assistant"):
+        prompt = chat.prompt(question)
+        started = time.perf_counter()
+        try:
+            answer = st.write_stream(ask_followup(prompt))
+        except Exception as e:
+            st.error(f"❌ Lỗi: {e}")
+            return
+        # Phần thực gửi: không tính ngữ cảnh đã nằm trong cached content
+        sent = get_context_cache().prepare(backend, prompt, register=False).sent_text()
+        turn = chat.record(question, answer, sent, prompt.text(), time.perf_counter() - started)
+        st.caption(followup_stats(turn))
+
+
+def display_result_history(tab):
+    """Kết quả đang chọn của tab (mặc định: mới nhất) + chọn lại kết quả cũ trong phiên, không gọi lại AI"""
+    history = ResultHistory(st.session_state)
+    entries = history.entries(tab)
+    if not entries:
+        return
+    
+    st.markdown("---")
+    if len(entries) > 1:
+        titles = {
+            entry["id"]: f"{datetime.fromtimestamp(entry['created_at']).strftime('%H:%M:%S')} · {entry['title']}"
+            for entry in entries
+        }
+        ids = list(titles)
+        hist_col1, hist_col2 = st.columns([4, 1])
+        with hist_col1:
+            selected_id = st.selectbox(
+                "🕘 Kết quả trong phiên (hiển thị lại không gọi AI):",
+                ids,
+                index=ids.index(history.selected(tab)["id"]),
+                format_func=titles.get
+            )
+        history.select(tab, selected_id)
+        with hist_col2:
+            if st.button("🗑️ Xóa lịch sử", key=f"btn_clear_history_{tab}"):
+                history.clear(tab)
+                st.rerun()
+    
+    try:
+        display_result(history.selected(tab))
+    except Exception as e:
+        st.error(f"❌ Lỗi hiển thị kết quả: {e}")
+
+
+def display_metrics_panel():
+    """Panel quản trị ở sidebar: độ trễ p50/p95/p99, cache hit, token theo tab và chế độ"""
+    registry = get_metrics()
+    with st.expander("📈 Số liệu LLM (quản trị)"):
+        for group_by, title in ((("tab",), "Theo tab"), (("tab", "mode"), "Theo tab & chế độ")):
+            rows = registry.summary_table(group_by)
+            if not rows:
+                # Vẫn giữ nút tải số liệu bên dưới (file Prometheus rỗng vẫn có HELP/TYPE)
+                st.caption("Chưa có lời gọi nào.")
+                break
+            table = pd.DataFrame(rows)
+            for col in ["ttft_p50", "latency_p50", "latency_p95", "latency_p99"]:
+                table[col] = (table[col] * 1000).round(0)
+            table["cache_hit_rate"] = (table["cache_hit_rate"] * 100).round(1)
+            table["avg_prompt_tokens"] = table["avg_prompt_tokens"].round(0)
+            st.markdown(f"**{title}** (thời gian: ms, cache hit: %)")
+            st.dataframe(table, hide_index=True)
+        st.download_button(
+            label="📥 Tải số liệu (Prometheus)",
+            data=registry.render_prometheus(),
+            file_name="swot_metrics.prom",
+            mime="text/plain"
         )
 
 
@@ -1698,34 +2558,48 @@ def display_swot_charts(swot_data, shop_name):
 st.markdown('<h1 class="main-header">🔎 Đặc Vụ SWOT của Phòng AI 🕵🏻‍♀️ </h1>', unsafe_allow_html=True)
 st.markdown('<p style="text-align: center; color: #888;">Phân Tích Quán </p>', unsafe_allow_html=True)
 
+# Sidebar: tùy chọn cache
+with st.sidebar:
+    st.markdown("### ⚙️ Tùy chọn")
+    st.checkbox(
+        "🔄 Bỏ qua cache (gọi lại Gemini)",
+        key="bypass_cache",
+        help="Mặc định các phân tích trùng lặp sẽ lấy kết quả đã lưu. Chọn mục này để buộc AI phân tích lại."
+    )
+    st.checkbox(
+        "🧩 Chế độ JSON có cấu trúc",
+        value=JSON_MODE_DEFAULT,
+        key="json_mode",
+        help="AI trả về thẳng dữ liệu JSON theo schema thay vì viết bài rồi lặp lại trong block JSON: ít token hơn, nhanh hơn, biểu đồ luôn đúng dữ liệu."
+    )
+    if METRICS_ADMIN:
+        display_metrics_panel()
+
 # Tabs
 tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(["📝 Nhập tên quán", "📁 Phân tích CSV", "🔗 Kết hợp", "⚔️ So sánh đối thủ", "📊 So sánh nhiều quán", "🔍 Tìm kiếm chuyên sâu"])
 
-with tab1:
+with tab1, tab_scope("name"):
     st.subheader("Nhập tên quán")
     shop_name = st.text_input("🏪 Tên quán:", placeholder="Ví dụ: Highlands Coffee, The Coffee House...")
+    same_shop = confirm_name_match(shop_name, "same_shop1")
     
     if st.button("🚀 Phân tích SWOT", key="btn1"):
         if shop_name:
+            shop_name = normalize_name_input(shop_name, accept_suggestion=same_shop)
             with st.spinner("⏳ Đang phân tích..."):
                 try:
-                    result = analyze_swot_with_scores(shop_name)
-                    swot_data = extract_json_from_response(result)
-                    
-                    # Hiển thị biểu đồ
-                    display_swot_charts(swot_data, shop_name)
-                    
-                    # Hiển thị phân tích chi tiết (không có JSON)
-                    st.markdown("---")
-                    st.subheader("📋 Phân tích chi tiết")
-                    clean_text = clean_result_text(result)
-                    st.markdown(clean_text)
+                    swot_data, clean_text = run_analysis(
+                        analyze_swot_with_scores, (shop_name,), "swot", extract_json_from_response
+                    )
+                    ResultHistory(st.session_state).add("name", "swot", shop_name, swot_data, clean_text, shop_name=shop_name)
                 except Exception as e:
                     st.error(f"❌ Lỗi: {e}")
         else:
             st.warning("Vui lòng nhập tên quán!")
+    
+    display_result_history("name")
 
-with tab2:
+with tab2, tab_scope("csv"):
     st.subheader("Phân tích từ file CSV")
     st.info("📁 Đặt file CSV vào thư mục `data/` hoặc upload nhiều file CSV để phân tích")
     
@@ -1740,43 +2614,42 @@ with tab2:
         
         for uploaded_file in uploaded_files:
             try:
-                df = pd.read_csv(uploaded_file)
+                df = read_uploaded_csv(uploaded_file)
                 all_dataframes.append(df)
                 all_file_info.append({
                     "file": uploaded_file.name,
-                    "rows": len(df),
+                    "rows": csv_row_count(df),
                     "columns": list(df.columns)
                 })
-                with st.expander(f"📄 {uploaded_file.name} ({len(df)} dòng)"):
+                with st.expander(f"📄 {uploaded_file.name} ({csv_row_count(df)} dòng)"):
                     st.dataframe(df.head(10))
             except Exception as e:
                 st.error(f"❌ Lỗi đọc file {uploaded_file.name}: {e}")
         
+        incremental_2 = st.checkbox(
+            "♻️ Phân tích tăng dần (chỉ gửi phần thay đổi so với lần phân tích trước trên cùng file)",
+            value=INCREMENTAL_DEFAULT, key="incremental2"
+        )
+        
         if st.button("🚀 Phân tích SWOT từ file", key="btn2"):
             with st.spinner("⏳ Đang phân tích..."):
                 try:
-                    # Gộp summary từ tất cả các file
-                    summary = f"📊 DỮ LIỆU TỪ {len(all_dataframes)} FILE CSV:\n"
-                    for i, (df, info) in enumerate(zip(all_dataframes, all_file_info)):
-                        summary += f"\n--- File {i+1}: {info['file']} ---\n"
-                        summary += f"Số dòng: {info['rows']}\n"
-                        summary += f"Các cột: {', '.join(info['columns'])}\n"
-                        for col in df.columns:
-                            if df[col].dtype in ['int64', 'float64']:
-                                summary += f"- {col}: min={df[col].min()}, max={df[col].max()}, avg={df[col].mean():.0f}\n"
-                        summary += f"Mẫu dữ liệu:\n{df.head(5).to_string()}\n"
-                    
-                    result = analyze_swot_with_scores("Quán từ CSV", summary)
-                    swot_data = extract_json_from_response(result)
-                    
-                    display_swot_charts(swot_data, "CSV_Analysis")
-                    st.markdown("---")
-                    st.subheader("📋 Phân tích chi tiết")
-                    clean_text = clean_result_text(result)
-                    st.markdown(clean_text)
+                    # Gộp summary từ tất cả các file (chỉ tạo khi cần phân tích đầy đủ)
+                    swot_data, clean_text = run_csv_swot(
+                        "Quán từ CSV", [(info["file"], df) for df, info in zip(all_dataframes, all_file_info)],
+                        lambda: summarize_csv_data(all_dataframes, all_file_info), incremental_2
+                    )
+                    ResultHistory(st.session_state).add(
+                        "csv", "swot", ", ".join(info["file"] for info in all_file_info), swot_data, clean_text,
+                        shop_name="CSV_Analysis"
+                    )
                 except Exception as e:
                     st.error(f"❌ Lỗi: {e}")
     else:
+        incremental_folder = st.checkbox(
+            "♻️ Phân tích tăng dần (chỉ gửi phần thay đổi so với lần phân tích trước trên cùng file)",
+            value=INCREMENTAL_DEFAULT, key="incremental_folder"
+        )
         if st.button("🔄 Đọc từ thư mục data/", key="btn_folder"):
             dataframes, file_info = load_all_csv()
             if dataframes:
@@ -1784,55 +2657,60 @@ with tab2:
                     st.success(f"✓ {info['file']} ({info['rows']} dòng)")
                 
                 with st.spinner("⏳ Đang phân tích..."):
-                    csv_summary = summarize_csv_data(dataframes, file_info)
-                    result = analyze_swot_with_scores("Quán từ CSV", csv_summary)
-                    swot_data = extract_json_from_response(result)
-                    
-                    display_swot_charts(swot_data, "CSV_Analysis")
-                    st.markdown("---")
-                    st.subheader("📋 Phân tích chi tiết")
-                    clean_text = clean_result_text(result)
-                    st.markdown(clean_text)
+                    try:
+                        swot_data, clean_text = run_csv_swot(
+                            "Quán từ CSV", [(info["file"], df) for df, info in zip(dataframes, file_info)],
+                            lambda: summarize_csv_data(dataframes, file_info), incremental_folder
+                        )
+                        ResultHistory(st.session_state).add(
+                            "csv", "swot", "Thư mục data/", swot_data, clean_text, shop_name="CSV_Analysis"
+                        )
+                    except Exception as e:
+                        st.error(f"❌ Lỗi: {e}")
             else:
                 st.warning(file_info)
+    
+    display_result_history("csv")
 
-with tab3:
+with tab3, tab_scope("combined"):
     st.subheader("Kết hợp: Tên quán + CSV")
     shop_name_3 = st.text_input("🏪 Tên quán:", key="shop3", placeholder="Ví dụ: Starbucks...")
+    same_shop_3 = confirm_name_match(shop_name_3, "same_shop3")
     uploaded_file_3 = st.file_uploader("📁 Upload CSV:", type=['csv'], key="csv3")
+    incremental_3 = st.checkbox(
+        "♻️ Phân tích tăng dần (chỉ gửi phần thay đổi so với lần phân tích trước của quán trên cùng file)",
+        value=INCREMENTAL_DEFAULT, key="incremental3"
+    )
     
     if st.button("🚀 Phân tích kết hợp", key="btn3"):
         if shop_name_3 and uploaded_file_3:
-            df = pd.read_csv(uploaded_file_3)
+            shop_name_3 = normalize_name_input(shop_name_3, accept_suggestion=same_shop_3)
+            df = read_uploaded_csv(uploaded_file_3)
             with st.spinner("⏳ Đang phân tích kết hợp..."):
                 try:
-                    summary = f"📊 DỮ LIỆU TỪ CSV:\n"
-                    summary += f"Số dòng: {len(df)}\n"
-                    summary += f"Các cột: {', '.join(df.columns)}\n"
-                    for col in df.columns:
-                        if df[col].dtype in ['int64', 'float64']:
-                            summary += f"- {col}: min={df[col].min()}, max={df[col].max()}, avg={df[col].mean():.0f}\n"
-                    summary += f"Mẫu dữ liệu:\n{df.head(5).to_string()}\n"
-                    
-                    result = analyze_swot_with_scores(shop_name_3, summary)
-                    swot_data = extract_json_from_response(result)
-                    
-                    display_swot_charts(swot_data, shop_name_3)
-                    st.markdown("---")
-                    st.subheader("📋 Phân tích chi tiết")
-                    clean_text = clean_result_text(result)
-                    st.markdown(clean_text)
+                    swot_data, clean_text = run_csv_swot(
+                        shop_name_3, [(uploaded_file_3.name, df)],
+                        lambda: "📊 DỮ LIỆU TỪ CSV:\n" + summarize_dataframe(df, count_tokens=count_tokens),
+                        incremental_3
+                    )
+                    ResultHistory(st.session_state).add(
+                        "combined", "swot", f"{shop_name_3} + {uploaded_file_3.name}", swot_data, clean_text,
+                        shop_name=shop_name_3
+                    )
                 except Exception as e:
                     st.error(f"❌ Lỗi: {e}")
         else:
             st.warning("Vui lòng nhập tên quán và upload file CSV!")
+    
+    display_result_history("combined")
 
-with tab4:
+with tab4, tab_scope("competitor"):
     st.subheader("⚔️ So sánh với đối thủ cạnh tranh")
     st.info("Nhập tên quán của bạn, sau đó upload tất cả file CSV (cả quán mình và đối thủ). AI sẽ so sánh SWOT giữa các quán.")
     
     # Input tên quán của mình
     my_shop_name_input = st.text_input("🏪 Tên quán của bạn:", placeholder="Ví dụ: Phúc Long, Highlands Coffee...", key="my_shop_compare")
+    same_shop_compare = confirm_name_match(my_shop_name_input, "same_shop_compare")
     
     # Upload nhiều file CSV chung
     all_csv_files = st.file_uploader(
@@ -1843,7 +2721,7 @@ with tab4:
     )
     
     # Xử lý CSV data nếu có
-    all_csv_summary = ""
+    compare_frames = []
     all_file_names = []
     
     if all_csv_files:
@@ -1851,21 +2729,11 @@ with tab4:
         
         for uploaded_file in all_csv_files:
             try:
-                df = pd.read_csv(uploaded_file)
+                df = read_uploaded_csv(uploaded_file)
                 all_file_names.append(uploaded_file.name)
-                with st.expander(f"📄 {uploaded_file.name} ({len(df)} dòng)"):
+                compare_frames.append((uploaded_file.name, df))
+                with st.expander(f"📄 {uploaded_file.name} ({csv_row_count(df)} dòng)"):
                     st.dataframe(df.head(15))
-                
-                # Tạo summary cho mỗi file - lấy NHIỀU DATA hơn
-                all_csv_summary += f"\n\n========== FILE: {uploaded_file.name} ==========\n"
-                all_csv_summary += f"📁 Tên file: {uploaded_file.name}\n"
-                all_csv_summary += f"Số dòng: {len(df)}\n"
-                all_csv_summary += f"Các cột: {', '.join(df.columns)}\n"
-                for col in df.columns:
-                    if df[col].dtype in ['int64', 'float64']:
-                        all_csv_summary += f"- {col}: min={df[col].min()}, max={df[col].max()}, avg={df[col].mean():.0f}\n"
-                # Lấy TOÀN BỘ dữ liệu từ file
-                all_csv_summary += f"\nDỮ LIỆU CHI TIẾT (TOÀN BỘ {len(df)} DÒNG):\n{df.to_string()}\n"
             except Exception as e:
                 st.error(f"❌ Lỗi đọc file {uploaded_file.name}: {e}")
         
@@ -1873,180 +2741,41 @@ with tab4:
         if all_file_names:
             st.info(f"📋 Các file đã upload: {', '.join(all_file_names)}")
     
+    compare_background = st.checkbox(
+        "🕒 Chạy nền",
+        key="compare_background",
+        help="Phân tích chạy ở nền: trang không bị chặn, tải lại trang vẫn theo dõi được và nhận kết quả khi xong."
+    )
+    
     if st.button("⚔️ Phân tích so sánh", key="btn_compare"):
         if my_shop_name_input and all_csv_files:
+            my_shop_name_input = normalize_name_input(my_shop_name_input, accept_suggestion=same_shop_compare)
             with st.spinner("⏳ Đang phân tích so sánh..."):
                 try:
-                    # Gọi hàm phân tích với tên quán của mình và tất cả data
-                    result = analyze_competitor_with_my_shop(my_shop_name_input, all_csv_summary)
-                    comparison_data = extract_comparison_json(result)
-                    
-                    # Lấy tên quán từ input hoặc AI response
-                    my_shop_name = my_shop_name_input
-                    competitor_name = comparison_data.get("competitor", {}).get("name", "Đối thủ")
-                    
-                    # Hiển thị các quán được phát hiện
-                    detected_shops = comparison_data.get("detected_shops", [])
-                    if detected_shops:
-                        st.success(f"🔍 AI đã nhận diện: {', '.join(detected_shops)}")
-                    
-                    # ===== BIỂU ĐỒ SO SÁNH =====
-                    st.markdown("---")
-                    st.subheader("📊 Biểu đồ so sánh SWOT")
-                    
-                    my_scores = comparison_data.get("my_shop", {}).get("scores", {})
-                    comp_scores = comparison_data.get("competitor", {}).get("scores", {})
-                    
-                    # Bar chart so sánh
-                    comparison_df = pd.DataFrame({
-                        "Yếu tố": ["Strengths", "Weaknesses", "Opportunities", "Threats"],
-                        my_shop_name: [
-                            my_scores.get("strengths", 7),
-                            my_scores.get("weaknesses", 5),
-                            my_scores.get("opportunities", 6),
-                            my_scores.get("threats", 4)
-                        ],
-                        competitor_name: [
-                            comp_scores.get("strengths", 6),
-                            comp_scores.get("weaknesses", 6),
-                            comp_scores.get("opportunities", 5),
-                            comp_scores.get("threats", 5)
-                        ]
-                    })
-                    
-                    # Biểu đồ cột đứng với Plotly
-                    fig = px.bar(
-                        comparison_df, 
-                        x="Yếu tố", 
-                        y=[my_shop_name, competitor_name],
-                        barmode="group",
-                        title="So sánh SWOT",
-                        labels={"value": "Điểm số", "variable": "Quán"},
-                        color_discrete_sequence=["#667eea", "#f59e0b"]
-                    )
-                    fig.update_layout(
-                        xaxis_title="Yếu tố SWOT",
-                        yaxis_title="Điểm số (1-10)",
-                        yaxis_range=[0, 10],
-                        legend_title="Quán"
-                    )
-                    st.plotly_chart(fig, use_container_width=True)
-                    
-                    # Metrics so sánh
-                    st.subheader("📈 Điểm số chi tiết")
-                    met1, met2 = st.columns(2)
-                    with met1:
-                        st.markdown(f"### 🏪 {my_shop_name}")
-                        m1, m2 = st.columns(2)
-                        with m1:
-                            st.metric("💪 Strengths", f"{my_scores.get('strengths', 7)}/10")
-                            st.metric("🚀 Opportunities", f"{my_scores.get('opportunities', 6)}/10")
-                        with m2:
-                            st.metric("⚠️ Weaknesses", f"{my_scores.get('weaknesses', 5)}/10")
-                            st.metric("⚡ Threats", f"{my_scores.get('threats', 4)}/10")
-                    
-                    with met2:
-                        st.markdown(f"### 🎯 {competitor_name}")
-                        m3, m4 = st.columns(2)
-                        with m3:
-                            st.metric("💪 Strengths", f"{comp_scores.get('strengths', 6)}/10")
-                            st.metric("🚀 Opportunities", f"{comp_scores.get('opportunities', 5)}/10")
-                        with m4:
-                            st.metric("⚠️ Weaknesses", f"{comp_scores.get('weaknesses', 6)}/10")
-                            st.metric("⚡ Threats", f"{comp_scores.get('threats', 5)}/10")
-                    
-                    # Lợi thế & Chiến lược
-                    st.markdown("---")
-                    st.subheader("🎯 Kết luận và Chiến lược")
-                    
-                    adv_col, imp_col = st.columns(2)
-                    with adv_col:
-                        st.markdown("#### ✅ Lợi thế của bạn")
-                        for adv in comparison_data.get("competitive_advantages", []):
-                            st.markdown(f"- {adv}")
-                    
-                    with imp_col:
-                        st.markdown("#### ⚠️ Cần cải thiện")
-                        for imp in comparison_data.get("areas_to_improve", []):
-                            st.markdown(f"- {imp}")
-                    
-                    st.markdown("#### 💡 Đề xuất chiến lược")
-                    for idx, strat in enumerate(comparison_data.get("strategies", []), 1):
-                        st.markdown(f"{idx}. {strat}")
-                    
-                    # ===== EXPORT EXCEL =====
-                    st.markdown("---")
-                    st.subheader("📥 Xuất kết quả so sánh")
-                    
-                    excel_buffer = BytesIO()
-                    
-                    # Sheet 1: Điểm so sánh
-                    scores_compare_df = pd.DataFrame({
-                        "Shop": [my_shop_name, competitor_name],
-                        "Type": ["Quán của bạn", "Đối thủ"],
-                        "Strengths": [my_scores.get("strengths", 7), comp_scores.get("strengths", 6)],
-                        "Weaknesses": [my_scores.get("weaknesses", 5), comp_scores.get("weaknesses", 6)],
-                        "Opportunities": [my_scores.get("opportunities", 6), comp_scores.get("opportunities", 5)],
-                        "Threats": [my_scores.get("threats", 4), comp_scores.get("threats", 5)],
-                        "Analyzed_Date": [datetime.now().strftime("%Y-%m-%d")] * 2
-                    })
-                    
-                    # Sheet 2: Chi tiết quán của bạn
-                    my_summary = comparison_data.get("my_shop", {}).get("summary", {})
-                    my_details = []
-                    for cat, items in my_summary.items():
-                        for idx, item in enumerate(items[:3], 1):
-                            my_details.append({
-                                "Shop": my_shop_name,
-                                "Category": cat.capitalize(),
-                                "Order": idx,
-                                "Detail": item
-                            })
-                    my_details_df = pd.DataFrame(my_details)
-                    
-                    # Sheet 3: Chi tiết đối thủ
-                    comp_summary = comparison_data.get("competitor", {}).get("summary", {})
-                    comp_details = []
-                    for cat, items in comp_summary.items():
-                        for idx, item in enumerate(items[:3], 1):
-                            comp_details.append({
-                                "Shop": competitor_name,
-                                "Category": cat.capitalize(),
-                                "Order": idx,
-                                "Detail": item
-                            })
-                    comp_details_df = pd.DataFrame(comp_details)
-                    
-                    # Sheet 4: Chiến lược
-                    strategy_df = pd.DataFrame({
-                        "Type": ["Lợi thế"] * len(comparison_data.get("competitive_advantages", [])) + 
-                                ["Cần cải thiện"] * len(comparison_data.get("areas_to_improve", [])) +
-                                ["Chiến lược"] * len(comparison_data.get("strategies", [])),
-                        "Content": comparison_data.get("competitive_advantages", []) + 
-                                   comparison_data.get("areas_to_improve", []) +
-                                   comparison_data.get("strategies", [])
-                    })
-                    
-                    with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
-                        scores_compare_df.to_excel(writer, sheet_name='Comparison_Scores', index=False)
-                        my_details_df.to_excel(writer, sheet_name='My_Shop_Details', index=False)
-                        comp_details_df.to_excel(writer, sheet_name='Competitor_Details', index=False)
-                        strategy_df.to_excel(writer, sheet_name='Strategies', index=False)
-                    
-                    excel_buffer.seek(0)
-                    
-                    st.download_button(
-                        label="📊 Tải Excel So Sánh (Power BI)",
-                        data=excel_buffer,
-                        file_name=f"swot_comparison_{my_shop_name}_vs_{competitor_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                    # Tóm tắt từng file trong ngân sách token (file nhỏ giữ toàn bộ dữ liệu)
+                    all_csv_summary = "".join(
+                        f"\n\n========== FILE: {file_name} ==========\n📁 Tên file: {file_name}\n{file_summary}"
+                        for file_name, file_summary in summarize_csv_files(compare_frames, count_tokens=count_tokens)
                     )
                     
-                    # Phân tích chi tiết
-                    st.markdown("---")
-                    st.subheader("📋 Phân tích chi tiết")
-                    clean_text = clean_result_text(result)
-                    st.markdown(clean_text)
+                    if compare_background:
+                        job = get_job_manager().submit(
+                            f"So sánh {my_shop_name_input}", comparison_job, my_shop_name_input, all_csv_summary,
+                            use_cache=not st.session_state.get("bypass_cache", False),
+                            json_mode=st.session_state.get("json_mode", JSON_MODE_DEFAULT),
+                            tab="competitor"
+                        )
+                        track_job(job)
+                    else:
+                        # Gọi hàm phân tích với tên quán của mình và tất cả data
+                        comparison_data, clean_text = run_analysis(
+                            analyze_competitor_with_my_shop, (my_shop_name_input, all_csv_summary), "comparison", extract_comparison_json
+                        )
+                        competitor_name = comparison_data.get("competitor", {}).get("name", "Đối thủ")
+                        ResultHistory(st.session_state).add(
+                            "competitor", "comparison", f"{my_shop_name_input} vs {competitor_name}", comparison_data, clean_text,
+                            my_shop_name=my_shop_name_input
+                        )
                     
                 except Exception as e:
                     st.error(f"❌ Lỗi: {e}")
@@ -2055,8 +2784,11 @@ with tab4:
                 st.warning("Vui lòng nhập tên quán của bạn!")
             elif not all_csv_files:
                 st.warning("Vui lòng upload ít nhất 1 file CSV!")
+    
+    display_jobs("competitor")
+    display_result_history("competitor")
 
-with tab5:
+with tab5, tab_scope("multi"):
     st.subheader("📊 So sánh SWOT nhiều quán cùng lúc")
     st.info("""
     Nhập tên quán của bạn, sau đó upload tất cả file CSV (bao gồm cả quán mình và các đối thủ).
@@ -2065,6 +2797,7 @@ with tab5:
     
     # Input tên quán của mình
     my_shop_multi_input = st.text_input("🏪 Tên quán của bạn:", placeholder="Ví dụ: Phúc Long, Highlands Coffee...", key="my_shop_multi")
+    same_shop_multi = confirm_name_match(my_shop_multi_input, "same_shop_multi")
     
     # CHỈ 1 FILE UPLOADER DUY NHẤT
     all_csv_multi = st.file_uploader(
@@ -2074,7 +2807,7 @@ with tab5:
         key="multi_csv_all"
     )
     
-    all_csv_multi_summary = ""
+    multi_frames = []
     all_file_names_multi = []
     
     if all_csv_multi:
@@ -2082,21 +2815,11 @@ with tab5:
         
         for uploaded_file in all_csv_multi:
             try:
-                df = pd.read_csv(uploaded_file)
+                df = read_uploaded_csv(uploaded_file)
                 all_file_names_multi.append(uploaded_file.name)
-                with st.expander(f"📄 {uploaded_file.name} ({len(df)} dòng)"):
+                multi_frames.append((uploaded_file.name, df))
+                with st.expander(f"📄 {uploaded_file.name} ({csv_row_count(df)} dòng)"):
                     st.dataframe(df.head(15))
-                
-                # Tạo summary cho mỗi file - lấy NHIỀU DATA hơn
-                all_csv_multi_summary += f"\n\n========== FILE: {uploaded_file.name} ==========\n"
-                all_csv_multi_summary += f"📁 Tên file: {uploaded_file.name}\n"
-                all_csv_multi_summary += f"Số dòng: {len(df)}\n"
-                all_csv_multi_summary += f"Các cột: {', '.join(df.columns)}\n"
-                for col in df.columns:
-                    if df[col].dtype in ['int64', 'float64']:
-                        all_csv_multi_summary += f"- {col}: min={df[col].min()}, max={df[col].max()}, avg={df[col].mean():.0f}\n"
-                # Lấy TOÀN BỘ dữ liệu từ file
-                all_csv_multi_summary += f"\nDỮ LIỆU CHI TIẾT (TOÀN BỘ {len(df)} DÒNG):\n{df.to_string()}\n"
             except Exception as e:
                 st.error(f"❌ Lỗi đọc file {uploaded_file.name}: {e}")
         
@@ -2104,34 +2827,80 @@ with tab5:
         if all_file_names_multi:
             st.info(f"📋 Các file đã upload: {', '.join(all_file_names_multi)}")
     
+    # Chế độ song song: mỗi quán một lời gọi, thời gian gần như không tăng theo số quán
+    fanout_col1, fanout_col2 = st.columns(2)
+    with fanout_col1:
+        use_fanout = st.checkbox(
+            "⚡ Phân tích song song từng quán",
+            key="multi_fanout",
+            help="Mỗi quán được phân tích riêng và đồng thời, sau đó AI gộp kết quả để xếp hạng. Nhanh và ổn định hơn khi có nhiều file."
+        )
+    with fanout_col2:
+        fanout_workers = st.slider("Số lời gọi song song tối đa:", 1, 16, FANOUT_MAX_WORKERS, key="multi_fanout_workers", disabled=not use_fanout)
+    multi_background = st.checkbox(
+        "🕒 Chạy nền",
+        key="multi_background",
+        help="Phân tích chạy ở nền: trang không bị chặn, tải lại trang vẫn theo dõi được và nhận kết quả khi xong."
+    )
+    
     st.markdown("---")
     
     # Button phân tích
     if st.button("🚀 So sánh tất cả", key="btn_multi_compare", type="primary"):
         if my_shop_multi_input and all_csv_multi and len(all_csv_multi) >= 2:
+            my_shop_multi_input = normalize_name_input(my_shop_multi_input, accept_suggestion=same_shop_multi)
             with st.spinner(f"⏳ Đang phân tích {len(all_csv_multi)} quán..."):
                 try:
-                    # Gọi API phân tích với tên quán của mình
-                    result = analyze_multi_competitor_with_my_shop(my_shop_multi_input, all_csv_multi_summary)
-                    comparison_data = extract_multi_comparison_json(result)
-                    
-                    # Hiển thị các quán được phát hiện
-                    detected_shops = comparison_data.get("detected_shops", [])
-                    if detected_shops:
-                        st.success(f"🔍 AI đã nhận diện {len(detected_shops)} quán: {', '.join(detected_shops)}")
-                    
-                    # Dùng tên quán từ input
-                    my_shop_name = my_shop_multi_input
+                    # Tóm tắt từng file trong ngân sách token (file nhỏ giữ toàn bộ dữ liệu)
+                    shop_summaries_multi = {
+                        file_name: f"📁 Tên file: {file_name}\n{file_summary}"
+                        for file_name, file_summary in summarize_csv_files(multi_frames, count_tokens=count_tokens)
+                    }
+                    all_csv_multi_summary = "".join(
+                        f"\n\n========== FILE: {file_name} ==========\n{file_summary}"
+                        for file_name, file_summary in shop_summaries_multi.items()
+                    )
                     
-                    # Hiển thị kết quả
-                    st.markdown("---")
-                    display_multi_comparison_charts(comparison_data, my_shop_name)
+                    if multi_background:
+                        job = get_job_manager().submit(
+                            f"So sánh {len(all_csv_multi)} quán ({my_shop_multi_input})", multi_comparison_job,
+                            my_shop_multi_input, shop_summaries_multi, all_csv_multi_summary,
+                            use_fanout=use_fanout,
+                            max_workers=fanout_workers,
+                            use_cache=not st.session_state.get("bypass_cache", False),
+                            json_mode=st.session_state.get("json_mode", JSON_MODE_DEFAULT),
+                            tab="multi"
+                        )
+                        track_job(job)
+                    else:
+                        if use_fanout:
+                            progress_bar = st.progress(0.0, text="⏳ Đang phân tích từng quán...")
+                        
+                            def update_progress(done, total, file_name):
+                                progress_bar.progress(done / total, text=f"✓ {file_name} ({done}/{total})")
+                        
+                            result, comparison_data, fanout_errors = analyze_multi_competitor_fanout(
+                                my_shop_multi_input,
+                                shop_summaries_multi,
+                                max_workers=fanout_workers,
+                                use_cache=not st.session_state.get("bypass_cache", False),
+                                on_progress=update_progress,
+                                json_mode=st.session_state.get("json_mode", JSON_MODE_DEFAULT)
+                            )
+                            progress_bar.empty()
+                            clean_text = clean_result_text(result)
+                        else:
+                            fanout_errors = {}
+                            # Gọi API phân tích với tên quán của mình
+                            comparison_data, clean_text = run_analysis(
+                                analyze_multi_competitor_with_my_shop, (my_shop_multi_input, all_csv_multi_summary),
+                                "multi_comparison", extract_multi_comparison_json
+                            )
                     
-                    # Phân tích chi tiết
-                    st.markdown("---")
-                    st.subheader("📋 Phân tích chi tiết")
-                    clean_text = clean_result_text(result)
-                    st.markdown(clean_text)
+                        ResultHistory(st.session_state).add(
+                            "multi", "multi_comparison", f"{my_shop_multi_input} + {len(all_csv_multi) - 1} quán",
+                            comparison_data, clean_text, my_shop_name=my_shop_multi_input, errors=fanout_errors
+                        )
                     
                 except Exception as e:
                     st.error(f"❌ Lỗi: {e}")
@@ -2140,8 +2909,11 @@ with tab5:
                 st.warning("⚠️ Vui lòng nhập tên quán của bạn!")
             elif not all_csv_multi or len(all_csv_multi) < 2:
                 st.warning("⚠️ Vui lòng upload ít nhất 2 file CSV để so sánh!")
+    
+    display_jobs("multi")
+    display_result_history("multi")
 
-with tab6:
+with tab6, tab_scope("branch"):
     st.subheader("🔍 Tìm kiếm chuyên sâu - Phân tích chi nhánh cụ thể")
     st.info("""
     **Khác biệt với phân tích thông thường:**
@@ -2158,6 +2930,7 @@ with tab6:
             placeholder="VD: Phúc Long, Highlands, The Coffee House...",
             key="deep_brand"
         )
+        same_brand = confirm_name_match(brand_name, "same_brand")
     with col_branch:
         branch_location = st.text_input(
             "📍 Địa chỉ chi nhánh:",
@@ -2181,33 +2954,34 @@ with tab6:
     
     if st.button("🔍 Phân tích chi nhánh", key="btn_deep_search"):
         if brand_name and branch_location:
+            brand_name = normalize_name_input(brand_name, accept_suggestion=same_brand)
+            branch_location = normalize_name_input(branch_location, LOCATION)
             with st.spinner(f"⏳ Đang phân tích chi nhánh {brand_name} - {branch_location}..."):
                 try:
                     csv_summary = ""
                     if 'branch_csv' in dir() and branch_csv is not None:
-                        df = pd.read_csv(branch_csv)
-                        csv_summary = f"📊 DỮ LIỆU BỔ SUNG:\n"
-                        csv_summary += f"Số dòng: {len(df)}\n"
-                        csv_summary += f"Các cột: {', '.join(df.columns)}\n"
-                        csv_summary += f"Mẫu dữ liệu:\n{df.head(5).to_string()}\n"
+                        df = read_uploaded_csv(branch_csv)
+                        csv_summary = "📊 DỮ LIỆU BỔ SUNG:\n" + summarize_dataframe(df, count_tokens=count_tokens)
                     
-                    result = analyze_specific_branch(brand_name, branch_location, csv_summary)
-                    branch_data = extract_branch_json(result)
-                    
-                    # Hiển thị biểu đồ và thông tin
-                    display_branch_charts(branch_data, brand_name, branch_location)
-                    
-                    # Phân tích chi tiết
-                    st.markdown("---")
-                    st.subheader("📋 Phân tích chi tiết")
-                    clean_text = clean_result_text(result)
-                    st.markdown(clean_text)
+                    branch_data, clean_text = run_analysis(
+                        analyze_specific_branch, (brand_name, branch_location, csv_summary), "branch", extract_branch_json
+                    )
+                    ResultHistory(st.session_state).add(
+                        "branch", "branch", f"{brand_name} - {branch_location}", branch_data, clean_text,
+                        brand_name=brand_name, branch_location=branch_location
+                    )
                     
                 except Exception as e:
                     st.error(f"❌ Lỗi: {e}")
         else:
             st.warning("Vui lòng nhập cả tên thương hiệu và địa chỉ chi nhánh!")
+    
+    display_result_history("branch")
 
 # Footer
 st.markdown("---")
 st.markdown('<p style="text-align: center; color: #666;">SWOT Agent v1.0 | Made with AI BROTHERHOOD </p>', unsafe_allow_html=True)
+
+# Kết thúc profile của lượt chạy lại (gắn nhãn nút đã bấm)
+rerun_profile.tag(button=clicked_button())
+rerun_profile.stop()
@@ -0,0 +1,87 @@
+"""
+Micro-benchmark: thống kê cột số trên file CSV rộng (200+ cột)
+So sánh vòng lặp cũ (min/max/mean từng cột, nối chuỗi +=) với một lượt tính gộp của csv_summary.
+
+Chạy: python benchmarks/bench_csv_profile.py [số_dòng] [số_cột]
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from csv_summary import numeric_columns, numeric_column_stats, profile_dataframe  # noqa: E402
+
+
+def make_wide_frame(n_rows, n_cols, seed=0):
+    """DataFrame rộng với nhiều kiểu số: int64, float64, float32, Int32 nullable, Arrow"""
+    rng = np.random.default_rng(seed)
+    columns = {}
+    for i in range(n_cols):
+        kind = i % 5
+        if kind == 0:
+            columns[f"gia_{i}"] = rng.integers(10_000, 100_000, n_rows)
+        elif kind == 1:
+            columns[f"so_luong_{i}"] = rng.random(n_rows) * 100
+        elif kind == 2:
+            columns[f"ty_le_{i}"] = rng.random(n_rows).astype("float32")
+        elif kind == 3:
+            columns[f"diem_{i}"] = pd.array(rng.integers(0, 10, n_rows), dtype="Int32")
+        else:
+            try:
+                columns[f"doanh_thu_{i}"] = pd.array(rng.integers(0, 10**6, n_rows), dtype="int64[pyarrow]")
+            except (ImportError, TypeError):
+                columns[f"doanh_thu_{i}"] = rng.integers(0, 10**6, n_rows)
+    return pd.DataFrame(columns)
+
+
+def legacy_numeric_summary(df):
+    """Cách làm cũ trong summarize_csv_data (chỉ nhận int64/float64)"""
+    summary = ""
+    for col in df.columns:
+        if df[col].dtype in ['int64', 'float64']:
+            summary += f"- {col}: min={df[col].min()}, max={df[col].max()}, avg={df[col].mean():.0f}\n"
+    return summary
+
+
+def per_column_stats(df):
+    """Cùng phạm vi và chỉ số như bản mới nhưng gọi từng cột một"""
+    stats = {}
+    for col in numeric_columns(df):
+        series = df[col]
+        stats[col] = {"min": series.min(), "max": series.max(), "mean": series.mean(), "missing": int(series.isna().sum())}
+    return stats
+
+
+def timeit(func, *args, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    n_cols = int(sys.argv[2]) if len(sys.argv) > 2 else 250
+    df = make_wide_frame(n_rows, n_cols)
+
+    legacy_time, legacy_text = timeit(legacy_numeric_summary, df)
+    loop_time, _ = timeit(per_column_stats, df)
+    new_time, stats = timeit(numeric_column_stats, df)
+    profile_time, _ = timeit(profile_dataframe, df)
+
+    print(f"Dữ liệu: {n_rows} dòng x {n_cols} cột")
+    print(f"Cũ (chỉ int64/float64):       {legacy_time * 1000:8.1f} ms, {legacy_text.count(chr(10))} cột được thống kê")
+    print(f"Từng cột (mọi kiểu số):       {loop_time * 1000:8.1f} ms, {len(stats)} cột được thống kê")
+    print(f"Gộp theo khối (csv_summary):  {new_time * 1000:8.1f} ms, {len(stats)} cột được thống kê")
+    print(f"Hồ sơ đầy đủ (csv_summary):   {profile_time * 1000:8.1f} ms")
+    print(f"Nhanh hơn so với từng cột: x{loop_time / new_time:.1f}")
+
+
+if __name__ == "__main__":
+    main()
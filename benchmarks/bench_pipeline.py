@@ -0,0 +1,293 @@
+"""
+Benchmark phần xử lý cục bộ (không gọi LLM) quanh mỗi lời gọi Gemini
+Backend LLM được thay bằng stub trả về phản hồi mẫu, app.py chạy ở chế độ "bare" của Streamlit
+(các lệnh st.* không hiển thị gì) để đo đúng code của ứng dụng.
+
+Các bước được đo trên file CSV F&B tổng hợp (mặc định 100 -> 1.000.000 dòng):
+- load_csv:        load_all_csv (đọc thư mục chứa file CSV)
+- summarize_csv:   summarize_csv_data (tóm tắt theo ngân sách token)
+- analyze_prompt:  dựng prompt + cache + limiter + stub backend (analyze_swot_with_scores)
+Các bước không phụ thuộc số dòng (đo một lần):
+- extract_json:    extract_json_from_response / extract_comparison_json / extract_multi_comparison_json / extract_branch_json
+- clean_text:      clean_result_text
+- swot_charts, multi_charts, branch_charts: display_*_charts (biểu đồ Plotly; file Excel chỉ dựng khi bấm tải)
+
+Mỗi bước ghi thời gian tốt nhất (giây) và bộ nhớ đỉnh (tracemalloc, MB).
+Baseline lưu ở benchmarks/baselines/pipeline.json, chỉ có ý nghĩa trên cùng một máy.
+
+Chạy:
+    python benchmarks/bench_pipeline.py                      # so sánh với baseline
+    python benchmarks/bench_pipeline.py --sizes 100,10000    # chỉ một số kích thước
+    python benchmarks/bench_pipeline.py --save               # ghi lại baseline
+    python benchmarks/bench_pipeline.py --check              # exit 1 nếu chậm/tốn bộ nhớ hơn baseline
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+import warnings
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Đặt trước khi import llm_backend/app: không cần API key, không gọi mạng
+os.environ["SWOT_LLM_BACKEND"] = "fake"
+from llm_backend import LLMBackend  # noqa: E402
+from response_cache import get_response_cache  # noqa: E402
+
+BASELINE_PATH = os.path.join(ROOT, "benchmarks", "baselines", "pipeline.json")
+DEFAULT_SIZES = [100, 1_000, 10_000, 100_000, 1_000_000]
+# Ngưỡng báo chậm/tốn bộ nhớ hơn baseline, và mức chênh tối thiểu (tránh nhiễu ở bước rất nhanh)
+REGRESSION_TOLERANCE = 0.25
+MIN_TIME_DELTA_SECONDS = 0.005
+MIN_MEMORY_DELTA_MB = 1.0
+
+MENU = {
+    "Cà phê": [("Cà phê đen", 25_000), ("Cà phê sữa", 29_000), ("Bạc xỉu", 35_000), ("Cold brew", 45_000)],
+    "Trà": [("Trà đào cam sả", 45_000), ("Trà sen vàng", 49_000), ("Trà vải", 42_000)],
+    "Trà sữa": [("Trà sữa trân châu", 39_000), ("Trà sữa matcha", 45_000)],
+    "Bánh": [("Bánh mì que", 19_000), ("Croissant", 35_000), ("Tiramisu", 39_000)],
+}
+BRANCHES = ["Quận 1", "Quận 3", "Quận 7", "Thủ Đức", "Gò Vấp", "Bình Thạnh"]
+CHANNELS = ["Tại quán", "Mang đi", "GrabFood", "ShopeeFood"]
+
+
+# ============================================
+# DỮ LIỆU TỔNG HỢP
+# ============================================
+def make_fnb_frame(n_rows, seed=0):
+    """Dữ liệu bán hàng F&B giả lập: ngày, chi nhánh, món, nhóm, giá, số lượng, giảm giá, doanh thu, đánh giá"""
+    rng = np.random.default_rng(seed)
+    items = [(group, name, price) for group, entries in MENU.items() for name, price in entries]
+    picks = rng.integers(0, len(items), n_rows)
+    quantity = rng.integers(1, 5, n_rows)
+    price = np.array([items[i][2] for i in range(len(items))])[picks]
+    discount = rng.choice([0, 0, 0, 10, 15, 20], n_rows)
+    rating = rng.normal(4.3, 0.5, n_rows).clip(1, 5).round(1)
+    rating[rng.random(n_rows) < 0.1] = np.nan
+    return pd.DataFrame({
+        "ngay": pd.Timestamp("2025-01-01") + pd.to_timedelta(rng.integers(0, 365, n_rows), unit="D"),
+        "chi_nhanh": rng.choice(BRANCHES, n_rows),
+        "kenh_ban": rng.choice(CHANNELS, n_rows),
+        "nhom_mon": [items[i][0] for i in picks],
+        "ten_mon": [items[i][1] for i in picks],
+        "gia_ban": price,
+        "so_luong": quantity,
+        "giam_gia_pct": discount,
+        "doanh_thu": price * quantity * (100 - discount) // 100,
+        "danh_gia": rating,
+    })
+
+
+def swot_payload(name):
+    return {
+        "shop_name": name,
+        "name": name,
+        "scores": {"strengths": 8, "weaknesses": 4, "opportunities": 7, "threats": 5},
+        "summary": {
+            "strengths": ["Thương hiệu quen thuộc", "Menu đa dạng", "Vị trí trung tâm"],
+            "weaknesses": ["Giá cao hơn mặt bằng", "Chờ lâu giờ cao điểm", "Ít chỗ đậu xe"],
+            "opportunities": ["Giao hàng qua app", "Khách văn phòng", "Combo sáng"],
+            "threats": ["Chuỗi mới mở gần", "Giá nguyên liệu tăng", "Thay đổi thói quen"]
+        }
+    }
+
+
+def make_stub_responses():
+    """Phản hồi mẫu (bài viết + block JSON) cho từng loại phân tích"""
+    narrative = "\n".join(
+        f"📗 STRENGTHS: Ý phân tích số {i} với đủ chi tiết để giống một phản hồi thật của model." for i in range(60)
+    )
+
+    def with_json(payload):
+        return f"{narrative}\n\nQUAN_TRONG: Trả về block JSON\n```json\n{json.dumps(payload, ensure_ascii=False, indent=2)}\n```\n"
+
+    shops = [dict(swot_payload(f"Quán {i}"), is_my_shop=i == 0) for i in range(6)]
+    conclusion = {
+        "competitive_advantages": ["Chất lượng ổn định", "Dịch vụ nhanh"],
+        "areas_to_improve": ["Giá", "Không gian"],
+        "strategies": ["Combo giờ thấp điểm", "Tích điểm thành viên", "Mở rộng giao hàng"]
+    }
+    comparison = dict({"my_shop": shops[0], "competitor": shops[1], "detected_shops": ["Quán 0", "Quán 1"]}, **conclusion)
+    multi = dict({
+        "my_shop": shops[0],
+        "competitors": shops[1:],
+        "detected_shops": [shop["name"] for shop in shops],
+        "ranking": [{"rank": i + 1, "name": shop["name"], "total_score": 8 - i * 0.5, "note": "..."} for i, shop in enumerate(shops)]
+    }, **conclusion)
+    branch = dict(swot_payload("Chi nhánh"), brand_name="Quán 0", branch_location="Quận 1", analysis_type="specific_branch",
+                  location_analysis={"area_characteristics": "Văn phòng", "target_customers": "Nhân viên văn phòng",
+                                     "nearby_competitors": ["A", "B"], "traffic_level": "Cao"},
+                  local_strategies=["Giao nhanh giờ trưa", "Combo văn phòng", "Ưu đãi nhóm"])
+    return {
+        "swot": with_json(swot_payload("Quán 0")),
+        "comparison": with_json(comparison),
+        "multi": with_json(multi),
+        "branch": with_json(branch),
+        "payloads": {"swot": swot_payload("Quán 0"), "multi": multi, "branch": branch}
+    }
+
+
+class StubBackend(LLMBackend):
+    """Backend trả về phản hồi mẫu cố định, không gọi mạng, không có độ trễ"""
+
+    name = "stub"
+    model_name = "stub"
+
+    def __init__(self, text):
+        self._text = text
+
+    def generate(self, prompt, generation_config=None, timeout=None):
+        return self._text
+
+    def stream(self, prompt, generation_config=None, timeout=None):
+        for start in range(0, len(self._text), 200):
+            yield self._text[start:start + 200]
+
+
+# ============================================
+# ĐO
+# ============================================
+def measure(func, repeat):
+    """Thời gian tốt nhất trong `repeat` lần và bộ nhớ đỉnh (một lần chạy riêng có tracemalloc)"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"seconds": round(best, 6), "peak_mb": round(peak / 1024 / 1024, 3)}
+
+
+def import_app(cache_path):
+    """Import app.py ở chế độ bare với backend giả lập (được thay bằng StubBackend sau đó)"""
+    os.environ["SWOT_CACHE_PATH"] = cache_path
+    warnings.filterwarnings("ignore")
+    logging.disable(logging.WARNING)
+    import app
+    return app
+
+
+def run_benchmarks(sizes, work_dir):
+    app = import_app(os.path.join(work_dir, "cache.sqlite3"))
+    responses = make_stub_responses()
+    app.backend = StubBackend(responses["swot"])
+    cache = get_response_cache()
+    results = {}
+
+    for n_rows in sizes:
+        folder = os.path.join(work_dir, f"rows_{n_rows}")
+        os.makedirs(folder, exist_ok=True)
+        make_fnb_frame(n_rows).to_csv(os.path.join(folder, "ban_hang.csv"), index=False)
+        repeat = 5 if n_rows <= 10_000 else 2 if n_rows <= 100_000 else 1
+        key = str(n_rows)
+
+        results.setdefault("load_csv", {})[key] = measure(lambda: app.load_all_csv(folder), repeat)
+        dataframes, file_info = app.load_all_csv(folder)
+        results.setdefault("summarize_csv", {})[key] = measure(lambda: app.summarize_csv_data(dataframes, file_info), repeat)
+        summary = app.summarize_csv_data(dataframes, file_info)
+
+        def analyze():
+            # Xóa cache để luôn đo đường gọi model (stub) + ghi cache
+            cache.clear()
+            app.analyze_swot_with_scores("Quán 0", summary)
+        results.setdefault("analyze_prompt", {})[key] = measure(analyze, repeat)
+        print(f"✓ {n_rows} dòng", flush=True)
+
+    def extract_all():
+        app.extract_json_from_response(responses["swot"])
+        app.extract_comparison_json(responses["comparison"])
+        app.extract_multi_comparison_json(responses["multi"])
+        app.extract_branch_json(responses["branch"])
+
+    payloads = responses["payloads"]
+    fixed_stages = {
+        "extract_json": extract_all,
+        "clean_text": lambda: app.clean_result_text(responses["multi"]),
+        "swot_charts": lambda: app.display_swot_charts(dict(payloads["swot"]), "Quán 0"),
+        "multi_charts": lambda: app.display_multi_comparison_charts(payloads["multi"], "Quán 0"),
+        "branch_charts": lambda: app.display_branch_charts(payloads["branch"], "Quán 0", "Quận 1"),
+    }
+    for stage, func in fixed_stages.items():
+        results[stage] = {"-": measure(func, 15)}
+    return results
+
+
+# ============================================
+# BASELINE
+# ============================================
+def compare_with_baseline(results, baseline):
+    """In bảng kết quả, trả về danh sách các bước chậm/tốn bộ nhớ hơn baseline"""
+    regressions = []
+    print(f"\n{'Bước':<16}{'Dòng':>10}{'Thời gian (ms)':>16}{'Đỉnh (MB)':>12}{'Baseline (ms)':>15}{'Δ thời gian':>13}{'Δ bộ nhớ':>11}")
+    for stage, by_size in results.items():
+        for size, current in by_size.items():
+            base = baseline.get(stage, {}).get(size)
+            line = f"{stage:<16}{size:>10}{current['seconds'] * 1000:>16.2f}{current['peak_mb']:>12.2f}"
+            if base:
+                time_delta = current["seconds"] / base["seconds"] - 1 if base["seconds"] else 0.0
+                memory_delta = current["peak_mb"] / base["peak_mb"] - 1 if base["peak_mb"] else 0.0
+                line += f"{base['seconds'] * 1000:>15.2f}{time_delta:>+12.0%}{memory_delta:>+11.0%}"
+                slower = (time_delta > REGRESSION_TOLERANCE
+                          and current["seconds"] - base["seconds"] > MIN_TIME_DELTA_SECONDS)
+                heavier = (memory_delta > REGRESSION_TOLERANCE
+                           and current["peak_mb"] - base["peak_mb"] > MIN_MEMORY_DELTA_MB)
+                if slower or heavier:
+                    regressions.append((stage, size))
+                    line += "  ⚠️"
+            print(line)
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark phần xử lý cục bộ của SWOT Agent (model stub)")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES),
+                        help="Các kích thước file CSV (số dòng), phân tách bằng dấu phẩy")
+    parser.add_argument("--save", action="store_true", help="Ghi kết quả làm baseline mới")
+    parser.add_argument("--check", action="store_true", help="Exit 1 nếu có bước chậm/tốn bộ nhớ hơn baseline")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Đường dẫn file baseline")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    with tempfile.TemporaryDirectory(prefix="swot_bench_") as work_dir:
+        results = run_benchmarks(sizes, work_dir)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    regressions = compare_with_baseline(results, baseline)
+
+    if args.save:
+        # Giữ các kích thước không chạy lần này
+        for stage, by_size in results.items():
+            baseline.setdefault(stage, {}).update(by_size)
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2, sort_keys=True)
+        print(f"\n💾 Đã lưu baseline: {args.baseline}")
+    elif regressions:
+        print(f"\n⚠️ {len(regressions)} bước chậm/tốn bộ nhớ hơn baseline > {REGRESSION_TOLERANCE:.0%}")
+
+    if args.check and regressions and not args.save:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Benchmark thời gian khởi động của app.py và main.py
+Mỗi phép đo chạy trong một process Python mới (import lạnh), backend LLM giả lập (không gọi mạng):
+- cold_app:         import app (chế độ bare của Streamlit), tính cả import thư viện
+- cold_app_gemini:  như trên với backend Gemini (gồm import google.generativeai, tạo client)
+- cold_main:        import main (CLI)
+- first_chart:      lần vẽ biểu đồ SWOT đầu tiên sau khi import app (gồm cả import Plotly nếu được hoãn)
+- first_excel:      lần dựng file Excel đầu tiên (gồm cả import openpyxl)
+- rerun:            một lượt chạy lại toàn bộ app.py (AppTest, sau lượt đầu), import đã có sẵn trong sys.modules
+Ghi thời gian tốt nhất (giây) và bộ nhớ RSS đỉnh của process (MB); kèm danh sách module nặng
+đã được nạp sau khi import app.
+
+Chạy:
+    python benchmarks/bench_startup.py            # so sánh với baseline
+    python benchmarks/bench_startup.py --save     # ghi lại baseline
+    python benchmarks/bench_startup.py --check    # exit 1 nếu chậm/tốn bộ nhớ hơn baseline
+"""
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from bench_pipeline import REGRESSION_TOLERANCE, compare_with_baseline  # noqa: E402
+
+BASELINE_PATH = os.path.join(ROOT, "benchmarks", "baselines", "startup.json")
+HEAVY_MODULES = ["plotly", "openpyxl", "google.generativeai", "pandas", "numpy"]
+
+# Đoạn code chạy trong process con; in ra một dòng JSON kết quả
+PRELUDE = """
+import os, sys, time, json, resource, warnings, logging
+warnings.filterwarnings("ignore")
+logging.disable(logging.WARNING)
+sys.path.insert(0, {root!r})
+os.chdir({root!r})
+start = time.perf_counter()
+"""
+SCRIPTS = {
+    "cold_app": """
+import app
+elapsed = time.perf_counter() - start
+""",
+    "cold_app_gemini": """
+import app
+elapsed = time.perf_counter() - start
+""",
+    "cold_main": """
+import main
+elapsed = time.perf_counter() - start
+""",
+    "first_chart": """
+import app
+payload = {"scores": {"strengths": 8, "weaknesses": 4, "opportunities": 7, "threats": 5},
+           "summary": {"strengths": ["a"], "weaknesses": ["b"], "opportunities": ["c"], "threats": ["d"]}}
+start = time.perf_counter()
+app.display_swot_score_chart(payload["scores"])
+elapsed = time.perf_counter() - start
+""",
+    "first_excel": """
+import app
+import pandas as pd
+from excel_export import write_workbook
+start = time.perf_counter()
+write_workbook([("Sheet", pd.DataFrame({"a": [1, 2, 3]}))])
+elapsed = time.perf_counter() - start
+""",
+    "rerun": """
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file("app.py", default_timeout=120).run()
+elapsed = float("inf")
+for _ in range(10):
+    start = time.perf_counter()
+    at.run()
+    elapsed = min(elapsed, time.perf_counter() - start)
+""",
+}
+# Biến môi trường riêng của từng bước (mặc định: backend giả lập)
+STAGE_ENV = {"cold_app_gemini": {"SWOT_LLM_BACKEND": "gemini", "GOOGLE_API_KEY": "benchmark-stub"}}
+EPILOGUE = """
+loaded = [name for name in {heavy!r} if name in sys.modules]
+peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+print(json.dumps({{"seconds": elapsed, "peak_mb": peak_mb, "loaded": loaded}}))
+"""
+
+
+def run_script(stage, cache_path):
+    code = PRELUDE.format(root=ROOT) + SCRIPTS[stage] + EPILOGUE.format(heavy=HEAVY_MODULES)
+    env = dict(os.environ, SWOT_LLM_BACKEND="fake", SWOT_CACHE_PATH=cache_path)
+    env.update(STAGE_ENV.get(stage, {}))
+    output = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run_benchmarks(repeat, work_dir):
+    cache_path = os.path.join(work_dir, "cache.sqlite3")
+    results = {}
+    for stage in SCRIPTS:
+        runs = [run_script(stage, cache_path) for _ in range(1 if stage == "rerun" else repeat)]
+        best = min(runs, key=lambda run: run["seconds"])
+        results[stage] = {"-": {"seconds": round(best["seconds"], 4), "peak_mb": round(best["peak_mb"], 1)}}
+        if stage.startswith("cold_app"):
+            print(f"{stage}: module nặng đã nạp: {', '.join(best['loaded']) or '(không có)'}")
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark thời gian khởi động của SWOT Agent (import lạnh, rerun)")
+    parser.add_argument("--repeat", type=int, default=5, help="Số process chạy cho mỗi phép đo, lấy kết quả tốt nhất")
+    parser.add_argument("--save", action="store_true", help="Ghi kết quả làm baseline mới")
+    parser.add_argument("--check", action="store_true", help="Exit 1 nếu có bước chậm/tốn bộ nhớ hơn baseline")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Đường dẫn file baseline")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory(prefix="swot_bench_") as work_dir:
+        results = run_benchmarks(args.repeat, work_dir)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    regressions = compare_with_baseline(results, baseline)
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2, sort_keys=True)
+        print(f"\n💾 Đã lưu baseline: {args.baseline}")
+    elif regressions:
+        print(f"\n⚠️ {len(regressions)} bước chậm/tốn bộ nhớ hơn baseline > {REGRESSION_TOLERANCE:.0%}")
+
+    if args.check and regressions and not args.save:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+SWOT AGENT - Đăng ký dữ liệu CSV lớn làm cached content phía provider
+Phân tích lặp lại trên cùng một file upload (đổi tên quán, đổi loại phân tích, chạy lại) gửi lại
+toàn bộ dữ liệu CSV mỗi lần. Khi bật (SWOT_CONTEXT_CACHE=1), phần system + context của prompt
+(xem prompt_layout) được đăng ký một lần với backend (Gemini: CachedContent, có TTL); các lời gọi
+sau chỉ gửi handle + phần query nhỏ.
+- Chỉ context từ SWOT_CONTEXT_CACHE_MIN_TOKENS token trở lên (provider có ngưỡng tối thiểu,
+  context nhỏ thì đăng ký không có lợi)
+- Prompt đánh dấu cache_context (context chắc chắn được gửi lại, VD: phiên hỏi tiếp của một kết quả)
+  luôn được thử đăng ký, kể cả khi SWOT_CONTEXT_CACHE tắt hay context dưới ngưỡng trên
+- Đăng ký thất bại (model không hỗ trợ, context dưới ngưỡng của provider...) thì gửi bình thường,
+  và không thử lại với cùng context cho tới hết TTL
+- Handle hết hạn trước TTL một khoảng an toàn để không dùng handle provider đã xóa
+"""
+
+import os
+import time
+import hashlib
+import threading
+
+from csv_summary import estimate_tokens
+from prompt_layout import as_prompt
+
+# ============================================
+# CẤU HÌNH (có thể ghi đè bằng biến môi trường)
+# ============================================
+CONTEXT_CACHE_ENABLED = os.getenv("SWOT_CONTEXT_CACHE", "0") == "1"
+# Context nhỏ hơn chừng này token được gửi thẳng trong prompt
+CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("SWOT_CONTEXT_CACHE_MIN_TOKENS", 4096))
+# Thời gian sống của cached content phía provider
+CONTEXT_CACHE_TTL_SECONDS = int(os.getenv("SWOT_CONTEXT_CACHE_TTL_SECONDS", 3600))
+# Ngừng dùng handle trước khi provider xóa chừng này giây
+EXPIRY_MARGIN_SECONDS = 60
+
+
+class ContextCache:
+    """Bảng (backend, model, system, context) -> handle cached content, dùng chung trong process"""
+
+    def __init__(self, enabled=CONTEXT_CACHE_ENABLED, min_tokens=CONTEXT_CACHE_MIN_TOKENS,
+                 ttl_seconds=CONTEXT_CACHE_TTL_SECONDS):
+        self.enabled = enabled
+        self.min_tokens = min_tokens
+        self.ttl_seconds = ttl_seconds
+        self.created = 0
+        self.reused = 0
+        self.failed = 0
+        self._handles = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def prepare(self, backend, prompt, register=True):
+        """Prompt sẵn sàng gửi: dùng cached content nếu bật và context đủ lớn (hoặc prompt.cache_context),
+        nếu không giữ nguyên
+
+        register=False: chỉ dùng handle đã có, không đăng ký mới (VD: tính phần đã gửi của một lời gọi)
+        """
+        prompt = as_prompt(prompt)
+        forced = prompt.cache_context
+        if not ((self.enabled or forced) and prompt.context and getattr(backend, "supports_context_cache", False)):
+            return prompt
+        if not forced and estimate_tokens(prompt.context) < self.min_tokens:
+            return prompt
+        handle = self._handle(backend, prompt.system, prompt.context, register)
+        if handle is None:
+            return prompt
+        return prompt.with_cached_content(handle)
+
+    def _lookup(self, key):
+        """Handle còn hạn của key; (None, True) nếu lần đăng ký trước thất bại và chưa hết hạn chờ"""
+        with self._lock:
+            entry = self._handles.get(key)
+            if entry is None:
+                return None, False
+            handle, expires_at = entry
+            if time.time() >= expires_at:
+                del self._handles[key]
+                return None, False
+            return handle, handle is None
+
+    def _handle(self, backend, system, context, register=True):
+        key = hashlib.sha256(
+            "\x00".join((backend.name, backend.model_name, system, context)).encode("utf-8")
+        ).hexdigest()
+        handle, failed = self._lookup(key)
+        if handle is not None or failed or not register:
+            if handle is not None and register:
+                self.reused += 1
+            return handle
+
+        # Các lời gọi đồng thời trên cùng context chờ lượt đăng ký đầu tiên, không đăng ký song song
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            handle, failed = self._lookup(key)
+            if handle is not None:
+                self.reused += 1
+            elif not failed:
+                try:
+                    handle = backend.create_context_cache(system, context, self.ttl_seconds)
+                    self.created += 1
+                except Exception:
+                    handle = None
+                    self.failed += 1
+                with self._lock:
+                    self._handles[key] = (handle, time.time() + self.ttl_seconds - EXPIRY_MARGIN_SECONDS)
+        with self._lock:
+            self._key_locks.pop(key, None)
+        return handle
+
+    def clear(self):
+        with self._lock:
+            self._handles.clear()
+
+
+_context_cache_instance = None
+_context_cache_lock = threading.Lock()
+
+
+def get_context_cache():
+    """Bảng cached content dùng chung trong toàn process"""
+    global _context_cache_instance
+    with _context_cache_lock:
+        if _context_cache_instance is None:
+            _context_cache_instance = ContextCache()
+        return _context_cache_instance
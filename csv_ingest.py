@@ -0,0 +1,358 @@
+"""
+SWOT AGENT - Đọc file CSV
+- Cache DataFrame đã parse theo hash nội dung file, giới hạn bộ nhớ (LRU).
+- File rất lớn được đọc theo chunk: chỉ giữ thống kê chạy, sketch và mẫu ngẫu nhiên,
+  nên bộ nhớ đỉnh không phụ thuộc kích thước file.
+"""
+
+import os
+import hashlib
+import threading
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter, OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from csv_summary import (
+    QUANTILES, STREAM_PROFILE_ATTR, is_price_column, numeric_columns, numeric_column_stats, representative_positions
+)
+
+# ============================================
+# CẤU HÌNH (có thể ghi đè bằng biến môi trường)
+# ============================================
+DEFAULT_CSV_CACHE_MAX_BYTES = int(os.getenv("SWOT_CSV_CACHE_MAX_MB", 512)) * 1024 * 1024
+# File lớn hơn ngưỡng này được đọc theo chunk thay vì nạp toàn bộ
+STREAM_THRESHOLD_BYTES = int(os.getenv("SWOT_CSV_STREAM_THRESHOLD_MB", 100)) * 1024 * 1024
+STREAM_CHUNK_ROWS = int(os.getenv("SWOT_CSV_CHUNK_ROWS", 100_000))
+RESERVOIR_ROWS = 2000
+# Số file đọc song song khi nạp cả thư mục
+LOAD_MAX_WORKERS = int(os.getenv("SWOT_CSV_LOAD_WORKERS", os.cpu_count() or 4))
+# Engine đọc CSV: "c" (mặc định của pandas) hoặc "pyarrow" (nhanh hơn, cần cài pyarrow)
+CSV_ENGINE = os.getenv("SWOT_CSV_ENGINE", "c")
+# Số counter tối đa giữ cho mỗi cột chữ khi đếm giá trị phổ biến
+TOP_VALUE_CAPACITY = 1000
+# Số hash nhỏ nhất giữ lại để ước lượng số giá trị khác nhau (KMV sketch)
+DISTINCT_SKETCH_SIZE = 1024
+# Kích thước khối khi hash file trên đĩa
+HASH_BLOCK_BYTES = 1024 * 1024
+
+
+def content_hash(data):
+    """Hash nội dung file (bytes)"""
+    return hashlib.sha256(data).hexdigest()
+
+
+# {đường dẫn tuyệt đối: ((mtime_ns, kích thước), hash)}
+_file_hashes = {}
+_file_hashes_lock = threading.Lock()
+
+
+def file_content_hash(path):
+    """Như content_hash cho file trên đĩa: đọc theo khối (không nạp cả file vào bộ nhớ),
+    nhớ theo đường dẫn + mtime + kích thước nên nhiều tác vụ dùng chung một file chỉ đọc một lần"""
+    stat = os.stat(path)
+    key, version = os.path.abspath(path), (stat.st_mtime_ns, stat.st_size)
+    with _file_hashes_lock:
+        cached = _file_hashes.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b""):
+            digest.update(block)
+    value = digest.hexdigest()
+    with _file_hashes_lock:
+        _file_hashes[key] = (version, value)
+    return value
+
+
+class ParsedCSVCache:
+    """Cache DataFrame theo hash nội dung, dùng chung cho mọi session trong process"""
+
+    def __init__(self, max_bytes=DEFAULT_CSV_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # hash -> (df, size)
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def get_or_parse(self, data):
+        """Trả về DataFrame cho nội dung `data`, chỉ parse lần đầu gặp"""
+        key = content_hash(data)
+        df = self._get(key)
+        if df is not None:
+            return df
+
+        # Khóa theo từng key: nhiều session upload cùng file chỉ parse một lần
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            df = self._get(key)
+            if df is None:
+                if len(data) > STREAM_THRESHOLD_BYTES:
+                    df = stream_sample_frame(BytesIO(data))
+                else:
+                    df = pd.read_csv(BytesIO(data))
+                self._put(key, df)
+        with self._lock:
+            self._key_locks.pop(key, None)
+        return df
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._total_bytes}
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def _put(self, key, df):
+        size = int(df.memory_usage(deep=True).sum())
+        with self._lock:
+            # File lớn hơn cả giới hạn thì không cache
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (df, size)
+            self._total_bytes += size
+            while self._total_bytes > self.max_bytes and self._entries:
+                _, (_, old_size) = self._entries.popitem(last=False)
+                self._total_bytes -= old_size
+
+
+_csv_cache = ParsedCSVCache()
+
+
+def get_csv_cache():
+    """Cache CSV dùng chung trong toàn process"""
+    return _csv_cache
+
+
+def read_uploaded_csv(uploaded_file):
+    """Đọc file upload của Streamlit qua cache; không sửa DataFrame trả về tại chỗ"""
+    return _csv_cache.get_or_parse(uploaded_file.getvalue())
+
+
+def resolve_csv_engine(engine=None):
+    """Engine thực dùng: "pyarrow" chỉ khi đã cài pyarrow, nếu không quay về engine C của pandas"""
+    engine = engine or CSV_ENGINE
+    if engine == "pyarrow":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            return "c"
+    return engine
+
+
+def read_csv_file(path, engine=None):
+    """Đọc CSV trên đĩa; file lớn hơn ngưỡng được đọc theo chunk (xem stream_sample_frame)"""
+    if os.path.getsize(path) > STREAM_THRESHOLD_BYTES:
+        # pyarrow không hỗ trợ chunksize
+        return stream_sample_frame(path)
+    return pd.read_csv(path, engine=resolve_csv_engine(engine))
+
+
+def load_csv_files(paths, max_workers=LOAD_MAX_WORKERS, engine=None):
+    """Đọc song song nhiều file CSV (thread pool; pandas/pyarrow nhả GIL khi parse)
+
+    Trả về list (path, df, lỗi) theo đúng thứ tự `paths`; file lỗi có df=None.
+    Không báo lỗi trong thread con, để nơi gọi tự hiển thị (st.error chỉ chạy ở thread chính).
+    """
+    def read_one(path):
+        try:
+            return path, read_csv_file(path, engine), None
+        except Exception as e:
+            return path, None, e
+
+    if len(paths) <= 1 or max_workers <= 1:
+        return [read_one(path) for path in paths]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(paths))) as executor:
+        return list(executor.map(read_one, paths))
+
+
+def csv_row_count(df):
+    """Số dòng thật của file (với file đọc theo chunk, df chỉ là mẫu)"""
+    profile = df.attrs.get(STREAM_PROFILE_ATTR)
+    return profile["rows"] if profile else len(df)
+
+
+# ============================================
+# ĐỌC THEO CHUNK
+# ============================================
+class StreamingCSVProfiler:
+    """Gom hồ sơ của một file CSV qua từng chunk với bộ nhớ cố định
+
+    - Cột số: min/max/tổng/đếm chạy
+    - Cột chữ: đếm giá trị phổ biến (giới hạn số counter) và ước lượng số giá trị khác nhau (KMV)
+    - Mẫu ngẫu nhiên đều (reservoir sampling) dùng cho dòng đại diện và phân bố giá
+    Kết quả có cùng cấu trúc với csv_summary.profile_dataframe.
+    """
+
+    def __init__(self, reservoir_rows=RESERVOIR_ROWS, top_capacity=TOP_VALUE_CAPACITY,
+                 sketch_size=DISTINCT_SKETCH_SIZE, seed=0):
+        self.reservoir_rows = reservoir_rows
+        self.top_capacity = top_capacity
+        self.sketch_size = sketch_size
+        self._rng = np.random.default_rng(seed)
+        self.rows = 0
+        self.columns = None
+        self._numeric_cols = None
+        self._numeric = {}
+        self._top_values = {}
+        self._missing = {}
+        self._sketches = {}
+        self._reservoir = None
+
+    def update(self, chunk):
+        if self.columns is None:
+            self.columns = list(chunk.columns)
+            self._numeric_cols = numeric_columns(chunk)
+        else:
+            # Cột số ở chunk đầu nhưng có giá trị lạ ở chunk sau: ép về số, giá trị lạ thành thiếu
+            for col in self._numeric_cols:
+                if not pd.api.types.is_numeric_dtype(chunk[col]) or pd.api.types.is_bool_dtype(chunk[col]):
+                    chunk[col] = pd.to_numeric(chunk[col], errors="coerce")
+
+        self._update_numeric(chunk)
+        self._update_categorical(chunk)
+        self._update_reservoir(chunk)
+        self.rows += len(chunk)
+
+    def _update_numeric(self, chunk):
+        for col, stats in numeric_column_stats(chunk, self._numeric_cols).items():
+            count = len(chunk) - stats["missing"]
+            running = self._numeric.setdefault(col, {"min": np.nan, "max": np.nan, "sum": 0.0, "count": 0, "missing": 0})
+            running["missing"] += stats["missing"]
+            if count:
+                running["min"] = np.fmin(running["min"], stats["min"])
+                running["max"] = np.fmax(running["max"], stats["max"])
+                running["sum"] += stats["mean"] * count
+                running["count"] += count
+
+    def _update_categorical(self, chunk):
+        numeric_set = set(self._numeric_cols)
+        for col in self.columns:
+            if col in numeric_set:
+                continue
+            counts = chunk[col].value_counts(dropna=True)
+            self._missing[col] = self._missing.get(col, 0) + len(chunk) - int(counts.sum())
+
+            top = self._top_values.setdefault(col, Counter())
+            top.update(counts.to_dict())
+            if len(top) > self.top_capacity:
+                # Chỉ giữ các giá trị phổ biến nhất (đếm xấp xỉ cho phần đuôi)
+                self._top_values[col] = Counter(dict(top.most_common(self.top_capacity)))
+
+            hashes = pd.util.hash_pandas_object(pd.Series(counts.index), index=False).to_numpy()
+            kept = self._sketches.get(col)
+            merged = np.unique(hashes if kept is None else np.concatenate([kept, hashes]))
+            self._sketches[col] = merged[:self.sketch_size]
+
+    def _update_reservoir(self, chunk):
+        k = self.reservoir_rows
+        start = self.rows
+        if self._reservoir is None:
+            self._reservoir = chunk.iloc[:0].copy()
+
+        # Lấp đầy reservoir bằng các dòng đầu tiên
+        fill = max(0, min(k - len(self._reservoir), len(chunk)))
+        if fill:
+            head = chunk.iloc[:fill].copy()
+            head.index = range(len(self._reservoir), len(self._reservoir) + fill)
+            self._reservoir = pd.concat([self._reservoir, head])
+
+        # Algorithm R: dòng thứ i (i >= k) thay vào vị trí ngẫu nhiên với xác suất k / (i + 1)
+        if fill < len(chunk):
+            positions = np.arange(fill, len(chunk))
+            slots = self._rng.integers(0, start + positions + 1)
+            chosen = slots < k
+            if chosen.any():
+                # Nhiều dòng cùng trúng một vị trí: dòng sau thắng, đúng như chạy tuần tự
+                picked = pd.Series(positions[chosen], index=slots[chosen])
+                picked = picked[~picked.index.duplicated(keep="last")]
+                replacement = chunk.iloc[picked.to_numpy()].copy()
+                replacement.index = picked.index
+                self._reservoir = pd.concat([self._reservoir.drop(index=picked.index), replacement])
+
+    def sample(self):
+        """Mẫu ngẫu nhiên đều trên toàn file (tối đa reservoir_rows dòng)"""
+        if self._reservoir is None:
+            return pd.DataFrame()
+        return self._reservoir.sort_index()
+
+    def distinct_estimate(self, col):
+        sketch = self._sketches.get(col)
+        if sketch is None:
+            return 0
+        if len(sketch) < self.sketch_size:
+            return len(sketch)
+        # KMV: k giá trị hash nhỏ nhất trên [0, 2^64) -> ước lượng (k - 1) / hash thứ k
+        return int((self.sketch_size - 1) / (float(sketch[-1]) / 2.0 ** 64))
+
+    def profile(self, top_k=10, sample_rows=20):
+        numeric = {
+            col: {
+                "min": running["min"],
+                "max": running["max"],
+                "mean": running["sum"] / running["count"] if running["count"] else np.nan,
+                "missing": running["missing"]
+            }
+            for col, running in self._numeric.items()
+        }
+        categorical = {
+            col: {
+                "unique": self.distinct_estimate(col),
+                "top": self._top_values[col].most_common(top_k),
+                "missing": self._missing.get(col, 0)
+            }
+            for col in self._top_values
+        }
+
+        reservoir = self.sample()
+        price_columns = [col for col in numeric if is_price_column(col)]
+        price_distribution = {}
+        if price_columns and len(reservoir):
+            # Phân vị ước lượng từ mẫu ngẫu nhiên
+            quantiles = reservoir[price_columns].apply(pd.to_numeric, errors="coerce").quantile(QUANTILES)
+            price_distribution = {col: quantiles[col].tolist() for col in price_columns}
+
+        ordered = reservoir.sort_values(price_columns[0]) if price_columns and len(reservoir) else reservoir
+        return {
+            "rows": self.rows,
+            "columns": [str(col) for col in (self.columns or [])],
+            "numeric": numeric,
+            "categorical": categorical,
+            "price_distribution": price_distribution,
+            "samples": ordered.iloc[representative_positions(len(ordered), sample_rows)],
+            "streamed": True
+        }
+
+
+def stream_profile_csv(source, chunk_rows=STREAM_CHUNK_ROWS, **profiler_options):
+    """Đọc CSV theo chunk, trả về (hồ sơ, mẫu ngẫu nhiên dạng DataFrame)"""
+    profiler = StreamingCSVProfiler(**profiler_options)
+    for chunk in pd.read_csv(source, chunksize=chunk_rows):
+        profiler.update(chunk)
+    return profiler.profile(), profiler.sample()
+
+
+def stream_sample_frame(source, chunk_rows=STREAM_CHUNK_ROWS):
+    """Đọc file lớn theo chunk, trả về mẫu ngẫu nhiên kèm hồ sơ toàn file trong df.attrs
+
+    DataFrame trả về chỉ có tối đa RESERVOIR_ROWS dòng; dùng csv_row_count(df) để lấy số dòng thật.
+    csv_summary.summarize_dataframe sẽ dùng hồ sơ này thay vì thống kê lại trên mẫu.
+    """
+    profile, sample = stream_profile_csv(source, chunk_rows)
+    sample = sample.reset_index(drop=True)
+    sample.attrs[STREAM_PROFILE_ATTR] = profile
+    return sample
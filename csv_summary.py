@@ -0,0 +1,257 @@
+"""
+SWOT AGENT - Tóm tắt dữ liệu CSV để gửi cho AI
+Tạo hồ sơ gọn cho mỗi file (thống kê cột, giá trị phổ biến, phân bố giá, dòng đại diện)
+và tự rút gọn dần cho vừa ngân sách token.
+"""
+
+import os
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+# ============================================
+# CẤU HÌNH (có thể ghi đè bằng biến môi trường)
+# ============================================
+# Tổng ngân sách token cho phần dữ liệu CSV trong một prompt
+DEFAULT_TOKEN_BUDGET = int(os.getenv("SWOT_CSV_TOKEN_BUDGET", 20000))
+# Ước lượng thô: tiếng Việt có dấu ~3 ký tự / token
+CHARS_PER_TOKEN = 3
+
+# Cột có tên chứa các từ này được coi là cột giá
+PRICE_COLUMN_HINTS = ("gia", "price", "cost", "amount", "thanh tien", "doanh thu", "revenue")
+
+# Các mức chi tiết, từ đầy đủ nhất đến gọn nhất
+SUMMARY_LEVELS = [
+    {"full_data": True, "top_k": 10, "sample_rows": 20, "distribution": True},
+    {"full_data": False, "top_k": 10, "sample_rows": 20, "distribution": True},
+    {"full_data": False, "top_k": 5, "sample_rows": 10, "distribution": True},
+    {"full_data": False, "top_k": 3, "sample_rows": 5, "distribution": False},
+    {"full_data": False, "top_k": 0, "sample_rows": 0, "distribution": False},
+]
+QUANTILES = [0.1, 0.25, 0.5, 0.75, 0.9]
+# Key trong DataFrame.attrs chứa hồ sơ toàn file khi file được đọc theo chunk (csv_ingest)
+STREAM_PROFILE_ATTR = "stream_profile"
+# Số ô tối đa (dòng x cột) chuyển sang float64 trong một lượt thống kê (~32 MB)
+STATS_BLOCK_CELLS = 4_000_000
+
+
+def estimate_tokens(text):
+    """Ước lượng số token cục bộ (không gọi API)"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def fold_text(text):
+    """Chữ thường, bỏ dấu tiếng Việt, thay _ bằng khoảng trắng"""
+    text = unicodedata.normalize("NFD", str(text).lower().replace("đ", "d"))
+    text = "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+    return text.replace("_", " ").strip()
+
+
+def is_price_column(column_name):
+    folded = fold_text(column_name)
+    return any(hint in folded for hint in PRICE_COLUMN_HINTS)
+
+
+def format_number(value):
+    if value is None or pd.isna(value):
+        return "N/A"
+    value = float(value)
+    if value.is_integer():
+        return f"{int(value)}"
+    return f"{value:.2f}"
+
+
+def representative_positions(n_rows, k):
+    """k vị trí trải đều trên n_rows dòng"""
+    if n_rows == 0 or k <= 0:
+        return []
+    if k == 1 or n_rows == 1:
+        return [0]
+    return sorted({round(i * (n_rows - 1) / (k - 1)) for i in range(min(k, n_rows))})
+
+
+# ============================================
+# HỒ SƠ DỮ LIỆU
+# ============================================
+def numeric_columns(df):
+    """Mọi cột số: int/float mọi độ rộng, kiểu nullable (Int32, Float64...) và kiểu Arrow; bỏ cột bool"""
+    return [
+        col for col, dtype in df.dtypes.items()
+        if pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype)
+    ]
+
+
+def numeric_column_stats(df, columns=None):
+    """Thống kê min/max/mean/thiếu cho các cột số
+
+    Các cột được gom thành khối float64 và tính bằng numpy theo trục cột,
+    thay vì gọi .min()/.max()/.mean() riêng cho từng cột.
+    """
+    columns = numeric_columns(df) if columns is None else columns
+    if not columns:
+        return {}
+
+    n_rows = len(df)
+    block_width = max(1, STATS_BLOCK_CELLS // max(n_rows, 1))
+    stats = {}
+    for start in range(0, len(columns), block_width):
+        block_columns = columns[start:start + block_width]
+        values = df[block_columns].to_numpy(dtype="float64", na_value=np.nan)
+        missing = np.isnan(values)
+        counts = n_rows - missing.sum(axis=0)
+
+        if missing.any():
+            mins = np.where(missing, np.inf, values).min(axis=0, initial=np.inf)
+            maxs = np.where(missing, -np.inf, values).max(axis=0, initial=-np.inf)
+            sums = np.where(missing, 0.0, values).sum(axis=0)
+        else:
+            mins = values.min(axis=0, initial=np.inf)
+            maxs = values.max(axis=0, initial=-np.inf)
+            sums = values.sum(axis=0)
+
+        for i, col in enumerate(block_columns):
+            has_values = counts[i] > 0
+            stats[col] = {
+                "min": mins[i] if has_values else np.nan,
+                "max": maxs[i] if has_values else np.nan,
+                "mean": sums[i] / counts[i] if has_values else np.nan,
+                "missing": int(n_rows - counts[i])
+            }
+    return stats
+
+
+def profile_dataframe(df, top_k=10, sample_rows=20):
+    """Tính hồ sơ của một DataFrame: thống kê cột số, giá trị phổ biến, phân bố giá, dòng đại diện"""
+    num_cols = numeric_columns(df)
+    numeric = numeric_column_stats(df, num_cols)
+
+    num_set = set(num_cols)
+    categorical = {}
+    for col in df.columns:
+        if col in num_set:
+            continue
+        counts = df[col].value_counts(dropna=True)
+        categorical[col] = {
+            "unique": int(counts.size),
+            "top": list(counts.head(top_k).items()),
+            "missing": len(df) - int(counts.sum())
+        }
+
+    price_columns = [col for col in num_cols if is_price_column(col)]
+    price_distribution = {}
+    if price_columns:
+        quantiles = df[price_columns].quantile(QUANTILES)
+        price_distribution = {col: quantiles[col].tolist() for col in price_columns}
+
+    # Dòng đại diện: trải đều theo giá (nếu có cột giá) để phủ cả dải giá
+    ordered = df.sort_values(price_columns[0]) if price_columns else df
+    samples = ordered.iloc[representative_positions(len(df), sample_rows)]
+
+    return {
+        "rows": len(df),
+        "columns": [str(col) for col in df.columns],
+        "numeric": numeric,
+        "categorical": categorical,
+        "price_distribution": price_distribution,
+        "samples": samples
+    }
+
+
+def render_profile(profile, level, df=None):
+    """Chuyển hồ sơ thành văn bản ở mức chi tiết `level`"""
+    lines = [
+        f"Số dòng: {profile['rows']}",
+        f"Các cột: {', '.join(profile['columns'])}"
+    ]
+
+    if profile["numeric"]:
+        lines.append("📈 Thống kê cột số:")
+        for col, stats in profile["numeric"].items():
+            line = (f"- {col}: min={format_number(stats['min'])}, max={format_number(stats['max'])}, "
+                    f"avg={format_number(stats['mean'])}")
+            if stats["missing"]:
+                line += f", thiếu={stats['missing']}"
+            lines.append(line)
+
+    if level["top_k"] and profile["categorical"]:
+        lines.append("🏷️ Giá trị phổ biến (cột chữ):")
+        for col, stats in profile["categorical"].items():
+            top = stats["top"][:level["top_k"]]
+            values = ", ".join(f"{value} ({count})" for value, count in top)
+            remaining = stats["unique"] - len(top)
+            if remaining > 0:
+                values += f" (+{remaining} giá trị khác)"
+            lines.append(f"- {col} [{stats['unique']} giá trị]: {values}")
+
+    if level["distribution"] and profile["price_distribution"]:
+        lines.append("💵 Phân bố giá (ước lượng từ mẫu ngẫu nhiên):" if profile.get("streamed") else "💵 Phân bố giá:")
+        for col, values in profile["price_distribution"].items():
+            points = ", ".join(f"p{int(q * 100)}={format_number(v)}" for q, v in zip(QUANTILES, values))
+            lines.append(f"- {col}: {points}")
+
+    if level["full_data"] and df is not None:
+        lines.append(f"\nDỮ LIỆU CHI TIẾT (TOÀN BỘ {len(df)} DÒNG):\n{df.to_string()}")
+    elif level["sample_rows"] and len(profile["samples"]):
+        samples = profile["samples"].iloc[representative_positions(len(profile["samples"]), level["sample_rows"])]
+        lines.append(f"Mẫu dữ liệu đại diện ({len(samples)}/{profile['rows']} dòng):\n{samples.to_string()}")
+
+    return "\n".join(lines) + "\n"
+
+
+# ============================================
+# TÓM TẮT THEO NGÂN SÁCH TOKEN
+# ============================================
+def summarize_dataframe(df, token_budget=DEFAULT_TOKEN_BUDGET, count_tokens=None):
+    """Tóm tắt một DataFrame sao cho vừa `token_budget` token
+
+    Thử từ mức chi tiết nhất (toàn bộ dữ liệu) xuống gọn nhất (chỉ thống kê).
+    Các mức được thử bằng ước lượng cục bộ (estimate_tokens), không gọi mạng.
+    count_tokens: hàm đếm token chính xác (VD: model.count_tokens), gọi tối đa một lần cho
+    bản tóm tắt cuối cùng; vượt ngân sách thì cắt bớt theo tỉ lệ, không đếm lại.
+    """
+    top_level = SUMMARY_LEVELS[0]
+    # File đọc theo chunk: df chỉ là mẫu, dùng hồ sơ toàn file đã tính sẵn
+    profile = df.attrs.get(STREAM_PROFILE_ATTR)
+    if profile is None:
+        profile = profile_dataframe(df, top_k=top_level["top_k"], sample_rows=top_level["sample_rows"])
+
+    text = ""
+    for level in SUMMARY_LEVELS:
+        if level["full_data"]:
+            # Không có toàn bộ dữ liệu, hoặc chắc chắn không vừa (tránh to_string hàng MB)
+            if profile.get("streamed") or len(df) * max(len(df.columns), 1) * 2 > token_budget * CHARS_PER_TOKEN:
+                continue
+        text = render_profile(profile, level, df)
+        if estimate_tokens(text) <= token_budget:
+            break
+    else:
+        # Vẫn quá ngân sách: cắt bớt bản gọn nhất
+        text = _truncate(text, max(token_budget, 1) * CHARS_PER_TOKEN)
+
+    if count_tokens is not None:
+        tokens = count_tokens(text)
+        if tokens > token_budget:
+            text = _truncate(text, int(len(text) * token_budget / tokens))
+    return text
+
+
+def _truncate(text, max_chars):
+    return text[:max_chars] + "\n... (đã rút gọn cho vừa ngân sách)\n"
+
+
+def summarize_csv_files(named_frames, token_budget=DEFAULT_TOKEN_BUDGET, count_tokens=None):
+    """Tóm tắt nhiều file, chia ngân sách token cho từng file
+
+    named_frames: list (tên file, DataFrame)
+    Phần ngân sách file trước dùng không hết được chuyển cho các file sau.
+    Trả về list (tên file, văn bản tóm tắt).
+    """
+    results = []
+    remaining = token_budget
+    for i, (file_name, df) in enumerate(named_frames):
+        file_budget = max(remaining // (len(named_frames) - i), 1)
+        text = summarize_dataframe(df, file_budget, count_tokens)
+        remaining -= min(estimate_tokens(text), file_budget)
+        results.append((file_name, text))
+    return results
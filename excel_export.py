@@ -0,0 +1,164 @@
+"""
+SWOT AGENT - Xuất Excel lười + ghi nhớ theo kết quả
+- File Excel chỉ được dựng khi người dùng bấm tải (st.download_button nhận một hàm), không dựng
+  sẵn ở mỗi lượt chạy lại của Streamlit
+- Mỗi kết quả có một ID (hash nội dung); file đã dựng được giữ trong cache bộ nhớ dùng chung
+  của process, nên tải lại / rerun không dựng lại
+- Workbook lớn (VD: so sánh nhiều quán) được ghi bằng chế độ write-only của openpyxl: các dòng
+  được ghi thẳng ra file, bộ nhớ không tăng theo số ô
+openpyxl chỉ được import khi dựng file đầu tiên.
+"""
+
+import os
+import json
+import math
+import hashlib
+import tempfile
+import threading
+from io import BytesIO
+from collections import OrderedDict
+
+# ============================================
+# CẤU HÌNH (có thể ghi đè bằng biến môi trường)
+# ============================================
+# Từ số ô này trở lên dùng writer streaming (write-only) thay cho pandas.ExcelWriter
+EXCEL_STREAM_MIN_CELLS = int(os.getenv("SWOT_EXCEL_STREAM_CELLS", 20000))
+# Dung lượng tối đa của các file Excel đã dựng giữ trong bộ nhớ (MB)
+EXCEL_CACHE_MAX_MB = float(os.getenv("SWOT_EXCEL_CACHE_MB", 64))
+
+
+def result_id(*parts):
+    """ID ổn định của một kết quả phân tích (hash nội dung), dùng làm key cache file xuất"""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+# ============================================
+# GHI WORKBOOK
+# ============================================
+def _cell_value(value):
+    """Giá trị ô cho openpyxl: NaN -> ô trống, kiểu numpy -> kiểu Python"""
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, (list, dict, tuple)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+def _write_streaming(sheets):
+    """Ghi bằng Workbook(write_only=True): mỗi dòng được ghi ra file tạm ngay khi append"""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    for sheet_name, df in sheets:
+        worksheet = workbook.create_sheet(title=sheet_name)
+        worksheet.append([str(column) for column in df.columns])
+        for row in df.itertuples(index=False, name=None):
+            worksheet.append([_cell_value(value) for value in row])
+
+    with tempfile.TemporaryFile() as f:
+        workbook.save(f)
+        f.seek(0)
+        return f.read()
+
+
+def _write_pandas(sheets):
+    import pandas as pd
+
+    buffer = BytesIO()
+    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
+        for sheet_name, df in sheets:
+            df.to_excel(writer, sheet_name=sheet_name, index=False)
+    return buffer.getvalue()
+
+
+def write_workbook(sheets, stream_min_cells=EXCEL_STREAM_MIN_CELLS):
+    """Dựng file Excel từ list (tên sheet, DataFrame), trả về bytes
+
+    Workbook nhỏ dùng pandas.ExcelWriter (giữ định dạng quen thuộc), workbook từ stream_min_cells ô
+    trở lên dùng writer streaming.
+    """
+    cells = sum(df.size + len(df.columns) for _, df in sheets)
+    if cells >= stream_min_cells:
+        return _write_streaming(sheets)
+    return _write_pandas(sheets)
+
+
+# ============================================
+# CACHE FILE ĐÃ DỰNG
+# ============================================
+class ExcelExportCache:
+    """Cache LRU (giới hạn theo dung lượng) các file Excel đã dựng, theo ID kết quả
+
+    Dùng chung cho mọi session: cùng một kết quả chỉ dựng một lần; các lượt tải đồng thời
+    cùng ID chờ lượt dựng đầu tiên thay vì dựng song song.
+    """
+
+    def __init__(self, max_bytes=int(EXCEL_CACHE_MAX_MB * 1024 * 1024)):
+        self.max_bytes = max_bytes
+        self.builds = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        with self._lock:
+            if key in self._entries:
+                self._size -= len(self._entries.pop(key))
+            if len(data) > self.max_bytes:
+                return
+            self._entries[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def get_or_build(self, key, build_sheets):
+        """File Excel của kết quả `key`; build_sheets() (trả về list sheet) chỉ được gọi khi chưa có"""
+        data = self.get(key)
+        if data is not None:
+            return data
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            data = self.get(key)
+            if data is None:
+                data = write_workbook(build_sheets())
+                self.builds += 1
+                self.put(key, data)
+        with self._lock:
+            self._key_locks.pop(key, None)
+        return data
+
+
+_cache_instance = None
+_cache_lock = threading.Lock()
+
+
+def get_excel_cache():
+    """Cache file Excel dùng chung trong toàn process"""
+    global _cache_instance
+    with _cache_lock:
+        if _cache_instance is None:
+            _cache_instance = ExcelExportCache()
+        return _cache_instance
+
+
+def excel_download_data(export_id, build_sheets):
+    """Dữ liệu cho st.download_button: hàm trả về file Excel, chỉ chạy khi người dùng bấm tải
+
+    export_id: ID kết quả (xem result_id); build_sheets: hàm không tham số trả về list (tên sheet, DataFrame).
+    """
+    def build():
+        return get_excel_cache().get_or_build(export_id, build_sheets)
+    return build
@@ -0,0 +1,92 @@
+"""
+SWOT AGENT - Hỏi tiếp về một kết quả phân tích đã có
+Sau khi so sánh xong, câu hỏi kiểu "vì sao giá trà sữa của mình cao hơn?" trước đây chỉ trả lời
+được bằng cách chạy lại cả prompt cùng toàn bộ dữ liệu CSV.
+Mỗi kết quả (entry của result_history) có một phiên hỏi đáp riêng, lưu ngay trong entry:
+- Ngữ cảnh của phiên là chính kết quả đã có (dữ liệu JSON + bài phân tích), nhỏ hơn nhiều so với
+  dữ liệu CSV gốc và không bao giờ gửi lại file CSV
+- Ngữ cảnh giống hệt nhau giữa các câu hỏi nên mặc định (SWOT_CHAT_CONTEXT_CACHE=1) được đăng ký làm
+  cached content ngay ở câu hỏi đầu, một lần cho mỗi kết quả; các câu sau chỉ gửi handle + lịch sử
+  + câu hỏi (xem context_cache). Provider từ chối đăng ký (context dưới ngưỡng tối thiểu của model,
+  backend không hỗ trợ) thì mỗi câu hỏi vẫn gửi lại cả ngữ cảnh, nên bài phân tích trong ngữ cảnh
+  được cắt còn SWOT_CHAT_CONTEXT_MAX_CHARS ký tự
+- Mỗi câu hỏi chỉ gửi thêm SWOT_CHAT_MAX_TURNS lượt hỏi đáp gần nhất (câu trả lời cũ được cắt ngắn)
+  + câu hỏi mới
+- Mỗi lượt ghi lại số token thực gửi, số token của cả ngữ cảnh và thời gian trả lời
+"""
+
+import os
+import json
+import time
+
+from csv_summary import estimate_tokens
+from prompt_layout import Prompt, SYSTEM_PERSONA
+
+# ============================================
+# CẤU HÌNH (có thể ghi đè bằng biến môi trường)
+# ============================================
+# Số lượt hỏi đáp gần nhất gửi kèm câu hỏi mới
+CHAT_MAX_TURNS = int(os.getenv("SWOT_CHAT_MAX_TURNS", 6))
+# Giới hạn độ dài bài phân tích đưa vào ngữ cảnh (ký tự)
+CHAT_CONTEXT_MAX_CHARS = int(os.getenv("SWOT_CHAT_CONTEXT_MAX_CHARS", 20000))
+# Đăng ký ngữ cảnh của phiên làm cached content (một lần cho mỗi kết quả)
+CHAT_CONTEXT_CACHE = os.getenv("SWOT_CHAT_CONTEXT_CACHE", "1") == "1"
+# Câu trả lời cũ được cắt còn chừng này ký tự khi gửi lại làm lịch sử
+HISTORY_ANSWER_MAX_CHARS = 1500
+
+CHAT_INSTRUCTIONS = """
+NHIỆM VỤ: Trả lời câu hỏi tiếp theo của người dùng về KẾT QUẢ PHÂN TÍCH đã có (ở phần dữ liệu).
+- Chỉ dựa trên kết quả phân tích (dữ liệu JSON + bài phân tích) và các lượt hỏi đáp trước
+- Trích số liệu cụ thể (giá, điểm số, ưu đãi...) khi có; nếu kết quả không đủ thông tin thì nói rõ
+  và gợi ý dữ liệu cần bổ sung, không tự bịa số liệu
+- Trả lời ngắn gọn, đi thẳng vào câu hỏi, bằng tiếng Việt
+"""
+
+
+def _clip(text, max_chars):
+    return text if len(text) <= max_chars else text[:max_chars] + "\n...(đã cắt bớt)"
+
+
+def result_context(entry):
+    """Ngữ cảnh của phiên hỏi đáp: dữ liệu + bài phân tích của kết quả (thay cho dữ liệu CSV gốc)"""
+    data = json.dumps(entry["data"], ensure_ascii=False, default=str)
+    text = _clip(entry.get("text") or "", CHAT_CONTEXT_MAX_CHARS)
+    return f"📋 KẾT QUẢ PHÂN TÍCH: {entry['title']}\n\n📊 DỮ LIỆU (JSON):\n{data}\n\n📝 BÀI PHÂN TÍCH:\n{text}"
+
+
+class FollowupChat:
+    """Phiên hỏi đáp của một kết quả; các lượt được lưu trong entry["chat"] (sống cùng lịch sử kết quả)"""
+
+    def __init__(self, entry, max_turns=CHAT_MAX_TURNS, cache_context=CHAT_CONTEXT_CACHE):
+        self.entry = entry
+        self.max_turns = max_turns
+        self.cache_context = cache_context
+        self.turns = entry.setdefault("chat", [])
+
+    def prompt(self, question):
+        """Prompt cho câu hỏi mới: hướng dẫn (tĩnh) | kết quả phân tích (giống mọi câu hỏi) | lịch sử + câu hỏi"""
+        recent = self.turns[-self.max_turns:] if self.max_turns > 0 else []
+        history = "\n\n".join(
+            f"👤 Hỏi: {turn['question']}\n🤖 Đáp: {_clip(turn['answer'], HISTORY_ANSWER_MAX_CHARS)}" for turn in recent
+        )
+        query = f"💬 CÁC LƯỢT HỎI ĐÁP TRƯỚC:\n{history}\n\n" if history else ""
+        query += f"❓ CÂU HỎI: {question.strip()}"
+        return Prompt(f"{SYSTEM_PERSONA}\n\n{CHAT_INSTRUCTIONS.strip()}", result_context(self.entry), query,
+                      cache_context=self.cache_context)
+
+    def record(self, question, answer, sent_prompt, full_prompt, latency):
+        """Lưu một lượt hỏi đáp kèm kích thước prompt (token thực gửi / cả ngữ cảnh) và thời gian"""
+        turn = {
+            "question": question.strip(),
+            "answer": answer,
+            "sent_tokens": estimate_tokens(sent_prompt),
+            "prompt_tokens": estimate_tokens(full_prompt),
+            "latency": latency,
+            "created_at": time.time(),
+        }
+        self.turns.append(turn)
+        # Lịch sử kết quả giới hạn theo dung lượng: tính cả phần hỏi đáp
+        self.entry["size"] = self.entry.get("size", 0) + len(
+            json.dumps(turn, ensure_ascii=False).encode("utf-8")
+        )
+        return turn
@@ -0,0 +1,466 @@
+"""
+SWOT AGENT - Phân tích lại tăng dần khi file CSV chỉ đổi vài dòng
+File menu / bảng giá thường chỉ đổi vài dòng mỗi tuần, nhưng mỗi lần chạy lại đều gửi lại toàn bộ
+dữ liệu và sinh lại cả bài SWOT.
+Kho snapshot (SQLite, nén zlib) lưu cho mỗi đối tượng phân tích (loại + tên quán + tập file) hồ sơ
+từng file (các dòng theo khóa món, thống kê cột số) cùng kết quả lần trước. Lần chạy sau:
+- So với snapshot, tính phần thay đổi có cấu trúc: giá/giá trị đổi, món thêm/bỏ, thống kê dịch chuyển
+- Không đổi gì: dùng lại kết quả cũ, không gọi AI
+- Đổi ít: AI chỉ cập nhật SWOT cũ theo phần thay đổi (prompt = kết quả cũ + diff, không gửi lại CSV),
+  nên kích thước prompt và thời gian trả lời tăng theo phần thay đổi chứ không theo kích thước file
+- Chưa có snapshot, đổi tập file / cột, file đọc theo chunk (chỉ có mẫu), hoặc tỉ lệ dòng đổi vượt
+  SWOT_INCREMENTAL_MAX_CHANGE_RATIO: phân tích đầy đủ như thường (và lưu snapshot mới)
+"""
+
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+from collections import Counter
+
+from csv_summary import (
+    STREAM_PROFILE_ATTR, estimate_tokens, fold_text, format_number, is_price_column,
+    numeric_column_stats, numeric_columns
+)
+from prompt_layout import analysis_prompt
+from shop_names import fold_name
+
+# ============================================
+# CẤU HÌNH (có thể ghi đè bằng biến môi trường)
+# ============================================
+SNAPSHOT_PATH = os.getenv("SWOT_INCREMENTAL_PATH", os.path.join(".cache", "swot_snapshots.sqlite3"))
+# Bật sẵn chế độ tăng dần (checkbox ở app.py, --incremental ở main.py batch)
+INCREMENTAL_DEFAULT = os.getenv("SWOT_INCREMENTAL", "0") == "1"
+# Tỉ lệ dòng thay đổi (thêm + bỏ + sửa / số dòng cũ) tối đa để còn cập nhật tăng dần
+MAX_CHANGE_RATIO = float(os.getenv("SWOT_INCREMENTAL_MAX_CHANGE_RATIO", 0.3))
+# File nhiều dòng hơn chừng này không lưu dòng (snapshot quá lớn): luôn phân tích đầy đủ
+SNAPSHOT_MAX_ROWS = int(os.getenv("SWOT_INCREMENTAL_MAX_ROWS", 50_000))
+# Số dòng tối đa liệt kê cho mỗi nhóm thay đổi của một file (phần còn lại chỉ đếm)
+DELTA_MAX_ITEMS = 30
+# Thống kê cột số đổi ít hơn tỉ lệ này coi như không dịch chuyển
+STAT_SHIFT_MIN = 0.01
+
+# Từ (đã gấp chữ) trong tên cột gợi ý cột định danh dòng: tên món, mã sản phẩm...
+KEY_COLUMN_HINTS = {"ten", "name", "mon", "item", "product", "san", "pham", "sku", "ma", "code", "id"}
+
+# Kết quả lập kế hoạch
+UNCHANGED = "unchanged"
+UPDATE = "update"
+FULL = "full"
+
+UPDATE_INSTRUCTIONS = """
+NHIỆM VỤ: CẬP NHẬT bản phân tích SWOT đã có (ở phần dữ liệu) theo các THAY ĐỔI của dữ liệu CSV (ở cuối).
+- Dữ liệu CSV chỉ khác lần phân tích trước đúng ở phần thay đổi được liệt kê; phần còn lại giữ nguyên
+- Giữ các nhận định không bị ảnh hưởng; chỉ sửa, thêm hoặc bỏ các ý liên quan tới thay đổi
+  (giá đổi, món mới / món bỏ, thống kê dịch chuyển) và nêu rõ số liệu mới khi sửa
+- Điều chỉnh điểm số nếu thay đổi làm mạnh / yếu đi yếu tố tương ứng, không đổi điểm khi không có lý do
+"""
+# Chế độ JSON / bài cũ không chia mục được: trả về cả bài
+FULL_OUTPUT_RULE = "- Trả về bản phân tích ĐẦY ĐỦ (không chỉ phần thay đổi) theo format sau:"
+# Chế độ văn bản: chỉ viết lại các mục bị ảnh hưởng, phần còn lại ghép từ bài cũ (xem merge_sections)
+KEEP_SECTION = "GIỮ NGUYÊN"
+PARTIAL_OUTPUT_RULE = f"""- CHỈ viết lại ĐẦY ĐỦ các mục bị ảnh hưởng bởi thay đổi, giữ đúng dòng tiêu đề mục như trong format;
+  mục không bị ảnh hưởng chỉ ghi dòng tiêu đề và một dòng "{KEEP_SECTION}"
+- Các phần không thuộc mục nào của format (VD: block JSON) vẫn trả về đầy đủ
+Format:"""
+
+
+# ============================================
+# HỒ SƠ FILE (SNAPSHOT)
+# ============================================
+def key_columns(df):
+    """Cột định danh dòng: cột chữ không thiếu, không trùng giá trị, ưu tiên cột có tên gợi ý (tên món, mã...)
+
+    Không có cột nào như vậy thì thử ghép mọi cột chữ; vẫn trùng thì trả về None (so theo cả dòng).
+    """
+    numeric = set(numeric_columns(df))
+    text_columns = [col for col in df.columns if col not in numeric]
+    unique = [col for col in text_columns if df[col].notna().all() and df[col].is_unique]
+    for col in unique:
+        if KEY_COLUMN_HINTS & set(fold_text(col).split()):
+            return [col]
+    if unique:
+        return [unique[0]]
+    if text_columns and not df[text_columns].isna().any().any() and not df.duplicated(text_columns).any():
+        return text_columns
+    return None
+
+
+def _json_value(value):
+    return None if value is None or (isinstance(value, float) and value != value) else value
+
+
+def file_snapshot(df):
+    """Hồ sơ một file để so lần sau; None nếu file không so được theo dòng (đọc theo chunk, quá lớn)"""
+    if df.attrs.get(STREAM_PROFILE_ATTR) is not None or len(df) > SNAPSHOT_MAX_ROWS:
+        return None
+    columns = [str(col) for col in df.columns]
+    keys = key_columns(df)
+    # to_json: NaN -> null, kiểu numpy -> số thường, ngày -> chuỗi ISO
+    values = json.loads(df.to_json(orient="values", date_format="iso", force_ascii=False))
+    stats = {
+        str(col): {name: _json_value(float(value)) for name, value in col_stats.items()}
+        for col, col_stats in numeric_column_stats(df).items()
+    }
+    snapshot = {"columns": columns, "key": None, "rows": values, "numeric": stats, "row_count": len(df)}
+    if keys is not None:
+        positions = [list(df.columns).index(col) for col in keys]
+        snapshot["key"] = [str(col) for col in keys]
+        snapshot["rows"] = {" | ".join(str(row[i]) for i in positions): row for row in values}
+    return snapshot
+
+
+# ============================================
+# SO SÁNH HAI SNAPSHOT
+# ============================================
+def _relative_change(old, new):
+    if old is None or new is None:
+        return None if old == new else float("inf")
+    if old == new:
+        return 0.0
+    return abs(new - old) / abs(old) if old else float("inf")
+
+
+def diff_snapshots(old, new):
+    """Phần thay đổi của một file: dòng thêm / bỏ / sửa (theo khóa) và thống kê cột số dịch chuyển
+
+    Trả về None nếu hai bản không so được (đổi cột, đổi cột khóa).
+    """
+    if old["columns"] != new["columns"] or old["key"] != new["key"]:
+        return None
+    columns = new["columns"]
+    added, removed, changed = [], [], []
+
+    if new["key"] is None:
+        # Không có khóa: so theo cả dòng (dòng sửa hiện ra như một dòng bỏ + một dòng thêm)
+        old_rows = Counter(json.dumps(row, ensure_ascii=False) for row in old["rows"])
+        new_rows = Counter(json.dumps(row, ensure_ascii=False) for row in new["rows"])
+        added = [json.loads(row) for row in (new_rows - old_rows).elements()]
+        removed = [json.loads(row) for row in (old_rows - new_rows).elements()]
+    else:
+        old_rows, new_rows = old["rows"], new["rows"]
+        added = [row for key, row in new_rows.items() if key not in old_rows]
+        removed = [row for key, row in old_rows.items() if key not in new_rows]
+        for key, row in new_rows.items():
+            before = old_rows.get(key)
+            if before is None or before == row:
+                continue
+            changes = {col: [a, b] for col, a, b in zip(columns, before, row) if a != b}
+            changed.append({"key": key, "changes": changes})
+
+    stats = {}
+    for col, new_stats in new["numeric"].items():
+        old_stats = old["numeric"].get(col)
+        if old_stats is None:
+            continue
+        shifted = {
+            name: [old_stats.get(name), value] for name, value in new_stats.items()
+            if (_relative_change(old_stats.get(name), value) or 0) >= STAT_SHIFT_MIN
+        }
+        if shifted:
+            stats[col] = shifted
+
+    return {
+        "columns": columns,
+        "rows": [old["row_count"], new["row_count"]],
+        "added": added,
+        "removed": removed,
+        "changed": changed,
+        "stats": stats,
+    }
+
+
+def changed_row_count(diff):
+    return len(diff["added"]) + len(diff["removed"]) + len(diff["changed"])
+
+
+def _format_value(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return format_number(value)
+    return "N/A" if value is None else str(value)
+
+
+def _format_row(columns, row):
+    return ", ".join(f"{col}={_format_value(value)}" for col, value in zip(columns, row))
+
+
+def _format_change(col, old, new):
+    text = f"{col}: {_format_value(old)} → {_format_value(new)}"
+    change = _relative_change(old, new) if isinstance(old, (int, float)) and isinstance(new, (int, float)) else None
+    if change not in (None, float("inf")) and old:
+        text += f" ({'+' if new > old else '-'}{change * 100:.1f}%)"
+    return text
+
+
+def _limited(lines, total):
+    if total > len(lines):
+        lines.append(f"- ... (+{total - len(lines)} dòng khác)")
+    return lines
+
+
+def render_file_diff(file_name, diff, max_items=DELTA_MAX_ITEMS):
+    """Văn bản phần thay đổi của một file (chuỗi rỗng nếu không đổi)"""
+    columns = diff["columns"]
+    price_changes = [item for item in diff["changed"] if any(is_price_column(col) for col in item["changes"])]
+    other_changes = [item for item in diff["changed"] if item not in price_changes]
+    lines = []
+
+    for title, items in (("💵 Giá thay đổi", price_changes), ("✏️ Giá trị khác thay đổi", other_changes)):
+        if items:
+            lines.append(f"{title} ({len(items)}):")
+            lines += _limited([
+                f"- {item['key']}: " + "; ".join(_format_change(col, old, new) for col, (old, new) in item["changes"].items())
+                for item in items[:max_items]
+            ], len(items))
+    for title, rows in (("➕ Dòng mới", diff["added"]), ("➖ Dòng bị bỏ", diff["removed"])):
+        if rows:
+            lines.append(f"{title} ({len(rows)}):")
+            lines += _limited([f"- {_format_row(columns, row)}" for row in rows[:max_items]], len(rows))
+    if diff["stats"]:
+        lines.append("📈 Thống kê cột số dịch chuyển:")
+        for col, shifted in diff["stats"].items():
+            lines.append(f"- {col}: " + ", ".join(_format_change(name, old, new) for name, (old, new) in shifted.items()))
+
+    if not lines:
+        return ""
+    old_rows, new_rows = diff["rows"]
+    return f"--- File: {file_name} ({old_rows} → {new_rows} dòng) ---\n" + "\n".join(lines) + "\n"
+
+
+# ============================================
+# KHO SNAPSHOT
+# ============================================
+def subject_key(kind, shop_name, file_names):
+    """Key của một đối tượng phân tích: loại + tên quán (đã gấp chữ) + tập tên file"""
+    payload = json.dumps([kind, fold_name(shop_name), sorted(file_names)], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SnapshotStore:
+    """Snapshot lần phân tích gần nhất của mỗi đối tượng (hồ sơ từng file + kết quả), trên SQLite"""
+
+    def __init__(self, path=SNAPSHOT_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS snapshots (
+                subject TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    def get(self, subject):
+        """{"files": {tên file: snapshot}, "result": {"data", "text"}} hoặc None"""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM snapshots WHERE subject = ?", (subject,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(zlib.decompress(row[0]).decode("utf-8"))
+
+    def save(self, subject, files, data, text):
+        value = zlib.compress(json.dumps(
+            {"files": files, "result": {"data": data, "text": text}}, ensure_ascii=False, default=str
+        ).encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO snapshots (subject, value, updated_at) VALUES (?, ?, ?)",
+                (subject, value, time.time())
+            )
+            self._conn.commit()
+
+    def delete(self, subject):
+        with self._lock:
+            self._conn.execute("DELETE FROM snapshots WHERE subject = ?", (subject,))
+            self._conn.commit()
+
+
+_store_instance = None
+_store_lock = threading.Lock()
+
+
+def get_snapshot_store():
+    """Kho snapshot dùng chung trong toàn process"""
+    global _store_instance
+    with _store_lock:
+        if _store_instance is None:
+            _store_instance = SnapshotStore()
+        return _store_instance
+
+
+# ============================================
+# LẬP KẾ HOẠCH PHÂN TÍCH
+# ============================================
+class IncrementalPlan:
+    """Cách phân tích lần này (UNCHANGED / UPDATE / FULL) + những gì cần để lưu snapshot sau đó
+
+    previous: kết quả lần trước {"data", "text"}; delta_text: phần thay đổi gửi cho AI (UPDATE).
+    """
+
+    def __init__(self, subject, files, mode, reason="", previous=None, diffs=None, store=None):
+        self.subject = subject
+        self.files = files
+        self.mode = mode
+        self.reason = reason
+        self.previous = previous
+        self.diffs = diffs or {}
+        self.store = store or get_snapshot_store()
+        self.delta_text = "".join(
+            render_file_diff(file_name, diff) for file_name, diff in self.diffs.items()
+        )
+
+    @property
+    def delta_tokens(self):
+        return estimate_tokens(self.delta_text) if self.delta_text else 0
+
+    def describe(self):
+        """Mô tả ngắn phần thay đổi, VD: '3 giá đổi, 2 dòng mới, 1 dòng bị bỏ'"""
+        counts = Counter()
+        for diff in self.diffs.values():
+            for item in diff["changed"]:
+                counts["price" if any(is_price_column(col) for col in item["changes"]) else "value"] += 1
+            counts["added"] += len(diff["added"])
+            counts["removed"] += len(diff["removed"])
+            counts["stats"] += len(diff["stats"])
+        labels = (("price", "giá đổi"), ("value", "giá trị khác đổi"), ("added", "dòng mới"),
+                  ("removed", "dòng bị bỏ"), ("stats", "cột số dịch chuyển"))
+        parts = [f"{counts[name]} {label}" for name, label in labels if counts[name]]
+        return ", ".join(parts) or "không có thay đổi"
+
+    def partial_output(self, response_format, json_mode=False):
+        """Chỉ cần AI viết lại các mục bị ảnh hưởng: chế độ văn bản và bài cũ chia được theo mục của format
+
+        Đầu ra (phần chiếm phần lớn thời gian trả lời) khi đó cũng chỉ tăng theo phần thay đổi.
+        """
+        markers = section_markers(response_format)
+        return not json_mode and bool(markers) and bool(split_sections(self.previous.get("text") or "", markers)[1])
+
+    def update_prompt(self, response_format, query="", json_mode=False):
+        """Prompt cập nhật: hướng dẫn cập nhật + format (tĩnh) | kết quả lần trước | phần thay đổi"""
+        return update_prompt(response_format, self.previous, self.delta_text, query, json_mode,
+                             partial=self.partial_output(response_format, json_mode))
+
+    def merge(self, response_format, text, json_mode=False):
+        """Bài hoàn chỉnh từ câu trả lời của AI (ghép với bài cũ nếu chỉ yêu cầu viết lại một phần)"""
+        if not self.partial_output(response_format, json_mode):
+            return text
+        return merge_sections(self.previous["text"], text, section_markers(response_format))
+
+    def commit(self, data, text):
+        """Lưu hồ sơ file hiện tại + kết quả vừa có làm mốc cho lần sau (bỏ qua nếu không so được)"""
+        if self.files is not None:
+            self.store.save(self.subject, self.files, data, text)
+
+
+def plan_incremental(kind, shop_name, named_frames, store=None, max_change_ratio=MAX_CHANGE_RATIO):
+    """So tập file hiện tại với snapshot lần trước của (kind, shop_name, tên các file)
+
+    named_frames: list (tên file, DataFrame)
+    """
+    store = store or get_snapshot_store()
+    subject = subject_key(kind, shop_name, [file_name for file_name, _ in named_frames])
+    files = {}
+    for file_name, df in named_frames:
+        snapshot = file_snapshot(df)
+        if snapshot is None:
+            return IncrementalPlan(subject, None, FULL, f"{file_name} quá lớn để so theo dòng", store=store)
+        files[file_name] = snapshot
+
+    previous = store.get(subject)
+    if previous is None or set(previous["files"]) != set(files):
+        return IncrementalPlan(subject, files, FULL, "chưa có lần phân tích trước trên các file này", store=store)
+
+    diffs, changed_rows, old_rows = {}, 0, 0
+    for file_name, snapshot in files.items():
+        diff = diff_snapshots(previous["files"][file_name], snapshot)
+        if diff is None:
+            return IncrementalPlan(subject, files, FULL, f"{file_name} đổi cột so với lần trước", store=store)
+        changed_rows += changed_row_count(diff)
+        old_rows += diff["rows"][0]
+        if changed_row_count(diff) or diff["stats"]:
+            diffs[file_name] = diff
+
+    if not diffs:
+        return IncrementalPlan(subject, files, UNCHANGED, previous=previous["result"], store=store)
+    ratio = changed_rows / max(old_rows, 1)
+    if ratio > max_change_ratio:
+        return IncrementalPlan(
+            subject, files, FULL, f"{ratio:.0%} số dòng thay đổi (ngưỡng {max_change_ratio:.0%})", store=store
+        )
+    return IncrementalPlan(subject, files, UPDATE, previous=previous["result"], diffs=diffs, store=store)
+
+
+# ============================================
+# PROMPT CẬP NHẬT
+# ============================================
+def section_markers(response_format):
+    """Ký hiệu mở đầu các mục của format, VD: 📗 ở dòng '📗 STRENGTHS (Điểm mạnh):'"""
+    markers = []
+    for line in response_format.splitlines():
+        line = line.strip()
+        if line.endswith(":") and line[:1] and not (line[0].isalnum() or line[0] in "-*#`{[\"'<"):
+            markers.append(line.split()[0])
+    return markers
+
+
+def split_sections(text, markers):
+    """(phần đầu, [(ký hiệu mục, khối văn bản của mục)]); dòng tiêu đề có thể có thêm '#', '**'"""
+    head, sections, current = [], [], None
+    for line in text.splitlines(keepends=True):
+        stripped = line.strip().lstrip("#* ")
+        marker = next((m for m in markers if stripped.startswith(m)), None)
+        if marker is not None:
+            current = [line]
+            sections.append((marker, current))
+        else:
+            (current if current is not None else head).append(line)
+    return "".join(head), [(marker, "".join(lines)) for marker, lines in sections]
+
+
+def _is_kept(block):
+    body = block.split("\n", 1)[1] if "\n" in block else ""
+    return body.strip().strip("-*_.:() ").upper() == KEEP_SECTION
+
+
+def merge_sections(previous_text, new_text, markers):
+    """Bài cũ với các mục AI viết lại thay vào (mục ghi KEEP_SECTION hoặc không có thì giữ bản cũ)"""
+    _, new_sections = split_sections(new_text, markers)
+    if not new_sections:
+        return new_text
+    head, old_sections = split_sections(previous_text, markers)
+    rewritten = {marker: block for marker, block in new_sections if not _is_kept(block)}
+    merged = [rewritten.pop(marker, block) for marker, block in old_sections]
+    # Mục mới không có trong bài cũ: thêm vào cuối
+    merged += [block for marker, block in new_sections if marker in rewritten]
+    return head + "".join(block if block.endswith("\n") else block + "\n" for block in merged)
+
+
+def previous_context(previous):
+    """Kết quả lần trước làm ngữ cảnh (thay cho dữ liệu CSV gốc)"""
+    parts = ["📋 KẾT QUẢ PHÂN TÍCH LẦN TRƯỚC:"]
+    if previous.get("data") is not None:
+        parts.append(f"📊 DỮ LIỆU (JSON):\n{json.dumps(previous['data'], ensure_ascii=False, default=str)}")
+    if previous.get("text"):
+        parts.append(f"📝 BÀI PHÂN TÍCH:\n{previous['text']}")
+    return "\n\n".join(parts)
+
+
+def update_prompt(response_format, previous, delta_text, query="", json_mode=False, partial=False):
+    """Prompt cập nhật SWOT cũ theo phần thay đổi; query: phần riêng của lần gọi (VD: tên quán)
+
+    partial: chỉ yêu cầu viết lại các mục bị ảnh hưởng (ghép lại bằng merge_sections)
+    """
+    instructions = f"{UPDATE_INSTRUCTIONS.strip()}\n{PARTIAL_OUTPUT_RULE if partial else FULL_OUTPUT_RULE}\n"
+    delta = f"🔄 THAY ĐỔI DỮ LIỆU CSV SO VỚI LẦN TRƯỚC:\n{delta_text}"
+    return analysis_prompt(instructions, response_format, json_mode, context=previous_context(previous),
+                           query=f"{query.strip()}\n\n{delta}" if query.strip() else delta)
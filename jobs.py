@@ -0,0 +1,151 @@
+"""
+SWOT AGENT - Chạy phân tích dài ở nền
+Phân tích nhiều quán có thể mất cả phút; chạy trong luồng script của Streamlit thì session bị
+chặn suốt thời gian đó và tải lại trang là mất kết quả.
+Job được đưa vào một pool worker dùng chung trong process (SWOT_JOB_WORKERS luồng):
+- submit() trả về ngay một Job có ID; giao diện lưu ID (VD: trong URL) để theo dõi
+- Job có trạng thái (queued / running / done / error / cancelled), tiến độ 0-1 và thông điệp
+- Kết quả được giữ trong process SWOT_JOB_TTL_SECONDS giây sau khi xong, nên tải lại trang
+  (session mới) vẫn lấy được kết quả theo ID
+Hàm của job chạy ngoài luồng script: không được gọi st.*; context (nhãn metrics...) lúc submit
+được sao chép sang worker.
+"""
+
+import os
+import time
+import uuid
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+# ============================================
+# CẤU HÌNH (có thể ghi đè bằng biến môi trường)
+# ============================================
+# Số job chạy đồng thời trong toàn process (các job còn lại xếp hàng)
+JOB_WORKERS = int(os.getenv("SWOT_JOB_WORKERS", 4))
+# Thời gian giữ job đã kết thúc (và kết quả) trong bộ nhớ
+JOB_TTL_SECONDS = int(os.getenv("SWOT_JOB_TTL_SECONDS", 3600))
+# Chu kỳ giao diện kiểm tra trạng thái job đang chạy (giây)
+JOB_POLL_SECONDS = float(os.getenv("SWOT_JOB_POLL_SECONDS", 2))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+ERROR = "error"
+CANCELLED = "cancelled"
+FINISHED_STATUSES = (DONE, ERROR, CANCELLED)
+
+
+class Job:
+    """Một job nền; hàm của job nhận chính Job làm tham số đầu để báo tiến độ"""
+
+    def __init__(self, title, tab=None):
+        self.id = uuid.uuid4().hex[:16]
+        self.title = title
+        self.tab = tab
+        self.status = QUEUED
+        self.progress = 0.0
+        self.message = ""
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._future = None
+
+    def set_progress(self, progress=None, message=None):
+        """Cập nhật tiến độ (0-1) và/hoặc thông điệp; gọi từ trong hàm của job"""
+        if progress is not None:
+            self.progress = min(max(float(progress), 0.0), 1.0)
+        if message is not None:
+            self.message = message
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATUSES
+
+    @property
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+
+class JobManager:
+    """Pool worker + bảng job dùng chung trong process (mọi session Streamlit)"""
+
+    def __init__(self, max_workers=JOB_WORKERS, ttl_seconds=JOB_TTL_SECONDS):
+        self.max_workers = max(1, max_workers)
+        self.ttl_seconds = ttl_seconds
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="swot-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, title, func, *args, tab=None, **kwargs):
+        """Xếp hàng func(job, *args, **kwargs), trả về Job ngay; giá trị trả về của func là job.result"""
+        job = Job(title, tab=tab)
+        context = contextvars.copy_context()
+        with self._lock:
+            self._purge_expired()
+            self._jobs[job.id] = job
+            job._future = self._executor.submit(context.run, self._run, job, func, args, kwargs)
+        return job
+
+    def _run(self, job, func, args, kwargs):
+        with self._lock:
+            if job.status == CANCELLED:
+                return
+            job.status = RUNNING
+            job.started_at = time.time()
+        try:
+            job.result = func(job, *args, **kwargs)
+        except Exception as e:
+            job.error = str(e) or type(e).__name__
+            job.status = ERROR
+        else:
+            job.progress = 1.0
+            job.status = DONE
+        finally:
+            job.finished_at = time.time()
+
+    def get(self, job_id):
+        """Job theo ID, None nếu không có (hoặc đã hết hạn)"""
+        with self._lock:
+            self._purge_expired()
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Hủy job còn đang xếp hàng; job đang chạy không dừng giữa chừng được. Trả về True nếu đã hủy"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status != QUEUED:
+                return False
+            job.status = CANCELLED
+            job.finished_at = time.time()
+            job._future.cancel()
+            return True
+
+    def jobs(self):
+        with self._lock:
+            self._purge_expired()
+            return list(self._jobs.values())
+
+    def _purge_expired(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at is not None and now - job.finished_at > self.ttl_seconds]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+_manager_instance = None
+_manager_lock = threading.Lock()
+
+
+def get_job_manager():
+    """Bộ chạy job dùng chung trong toàn process"""
+    global _manager_instance
+    with _manager_lock:
+        if _manager_instance is None:
+            _manager_instance = JobManager()
+        return _manager_instance
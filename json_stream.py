@@ -0,0 +1,148 @@
+"""
+SWOT AGENT - Parse JSON theo từng đoạn stream
+Nhận lần lượt các đoạn văn bản của một payload JSON (chế độ JSON có cấu trúc) và báo
+ngay mỗi giá trị vừa hoàn chỉnh (object, mảng, chuỗi) kèm đường dẫn của nó,
+để giao diện vẽ biểu đồ điểm / ma trận SWOT trước khi phản hồi kết thúc.
+"""
+
+import json
+
+
+class IncrementalJSONParser:
+    """Parser JSON tăng dần: feed(đoạn) -> list (đường dẫn, giá trị) vừa hoàn chỉnh
+
+    Đường dẫn là tuple key/index tính từ gốc, VD: ("scores",), ("summary", "strengths"),
+    ("competitors", 0, "name"). Số và true/false/null không được báo riêng, chúng có mặt
+    trong object/mảng chứa chúng khi object/mảng đó đóng lại. Gốc hoàn chỉnh có đường dẫn ().
+    Mỗi ký tự chỉ được quét một lần: object/mảng được dựng dần từ các giá trị con đã hoàn chỉnh
+    (không json.loads lại cả khối khi đóng), chỉ chuỗi và số/literal được json.loads riêng;
+    các đoạn được giữ trong list, chỉ nối một lần khi đọc `text`.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        # Mỗi frame: kind ("{" hoặc "["), path, value đang dựng, key hiện tại, đang chờ key, index phần tử
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        # Các đoạn của chuỗi / số-literal đang đọc dở (có thể trải qua nhiều đoạn stream)
+        self._token = []
+        self._in_scalar = False
+
+    def _child_path(self):
+        if not self._stack:
+            return ()
+        frame = self._stack[-1]
+        return frame["path"] + ((frame["key"],) if frame["kind"] == "{" else (frame["index"],))
+
+    def _add_value(self, value):
+        """Gắn giá trị vừa hoàn chỉnh vào object/mảng đang mở"""
+        if not self._stack:
+            return
+        frame = self._stack[-1]
+        if frame["kind"] == "{":
+            frame["value"][frame["key"]] = value
+        else:
+            frame["value"].append(value)
+
+    def _end_scalar(self, events):
+        """Số / true / false / null vừa kết thúc (gặp dấu phân cách)"""
+        self._in_scalar = False
+        token = "".join(self._token).strip()
+        self._token = []
+        try:
+            self._add_value(json.loads(token))
+        except ValueError:
+            # Payload lỗi: bỏ qua, lần parse cuối cùng sẽ báo lỗi
+            pass
+
+    def feed(self, chunk):
+        self._chunks.append(chunk)
+        events = []
+        i = 0
+        n = len(chunk)
+        while i < n:
+            if self._in_string:
+                # Chép nguyên cả đoạn không có ký tự đặc biệt của chuỗi
+                j = i
+                while j < n:
+                    ch = chunk[j]
+                    if self._escape:
+                        self._escape = False
+                    elif ch == "\\":
+                        self._escape = True
+                    elif ch == '"':
+                        break
+                    j += 1
+                self._token.append(chunk[i:j])
+                if j == n:
+                    break
+                self._in_string = False
+                try:
+                    value = json.loads('"' + "".join(self._token) + '"')
+                except ValueError:
+                    value = None
+                self._token = []
+                frame = self._stack[-1] if self._stack else None
+                if frame and frame["kind"] == "{" and frame["expect_key"]:
+                    frame["key"] = value
+                    frame["expect_key"] = False
+                else:
+                    events.append((self._child_path(), value))
+                    self._add_value(value)
+                i = j + 1
+                continue
+
+            ch = chunk[i]
+            if self._in_scalar and ch in ",}] \t\r\n":
+                self._end_scalar(events)
+            if ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._stack.append({
+                    "kind": ch, "path": self._child_path(), "value": {} if ch == "{" else [],
+                    "key": None, "expect_key": ch == "{", "index": 0
+                })
+            elif ch in "}]" and self._stack:
+                frame = self._stack.pop()
+                events.append((frame["path"], frame["value"]))
+                self._add_value(frame["value"])
+            elif ch == "," and self._stack:
+                frame = self._stack[-1]
+                if frame["kind"] == "{":
+                    frame["expect_key"] = True
+                else:
+                    frame["index"] += 1
+            elif ch not in ": \t\r\n,}]":
+                self._in_scalar = True
+                self._token.append(ch)
+            i += 1
+        return events
+
+    @property
+    def text(self):
+        """Toàn bộ văn bản đã nhận"""
+        return "".join(self._chunks)
+
+
+def assign_path(target, path, value):
+    """Gán value vào dict lồng nhau `target` theo đường dẫn (tạo dict/list trung gian nếu thiếu)"""
+    if not path:
+        return value if isinstance(value, dict) else target
+    node = target
+    for key, next_key in zip(path, path[1:]):
+        empty = [] if isinstance(next_key, int) else {}
+        if isinstance(node, list):
+            while len(node) <= key:
+                node.append(None)
+            if node[key] is None:
+                node[key] = empty
+        else:
+            node.setdefault(key, empty)
+        node = node[key]
+    last = path[-1]
+    if isinstance(node, list):
+        while len(node) <= last:
+            node.append(None)
+    node[last] = value
+    return target
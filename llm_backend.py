@@ -0,0 +1,391 @@
+"""
+SWOT AGENT - Backend LLM có thể thay thế
+llm_client (dùng chung cho app.py, main.py) chỉ làm việc với giao diện chung generate / stream / count_tokens,
+backend cụ thể được chọn bằng biến môi trường SWOT_LLM_BACKEND:
+- gemini: Google Gemini (mặc định)
+- openai: server tương thích OpenAI (/v1/chat/completions), VD: vLLM, llama.cpp, Ollama tự host
+- fake:   backend giả lập cục bộ, kết quả xác định theo prompt, độ trễ và tỉ lệ lỗi cấu hình được
+          (dùng để load test mà không tốn quota)
+Prompt là chuỗi hoặc prompt_layout.Prompt (system / context / query): phần system được gửi qua
+system_instruction (Gemini) hoặc message "system" (OpenAI); context đã đăng ký cached content
+(xem context_cache) không được gửi lại.
+"""
+
+import os
+import json
+import time
+import random
+import hashlib
+import threading
+import urllib.error
+import urllib.request
+
+from csv_summary import estimate_tokens
+from swot_schema import ANALYSIS_SCHEMAS
+from prompt_layout import Prompt, as_prompt
+
+# ============================================
+# CẤU HÌNH (có thể ghi đè bằng biến môi trường)
+# ============================================
+LLM_BACKEND = os.getenv("SWOT_LLM_BACKEND", "gemini").strip().lower()
+
+GEMINI_MODEL = os.getenv("SWOT_GEMINI_MODEL", "models/gemini-flash-latest")
+
+OPENAI_BASE_URL = os.getenv("SWOT_OPENAI_BASE_URL", "http://localhost:8000/v1")
+OPENAI_MODEL = os.getenv("SWOT_OPENAI_MODEL", "default")
+OPENAI_API_KEY = os.getenv("SWOT_OPENAI_API_KEY", "")
+
+# Thời gian tới đoạn đầu tiên, thời gian giữa các đoạn khi stream, tỉ lệ lời gọi lỗi (0-1)
+FAKE_LATENCY_SECONDS = float(os.getenv("SWOT_FAKE_LATENCY_SECONDS", 0.5))
+FAKE_CHUNK_DELAY_SECONDS = float(os.getenv("SWOT_FAKE_CHUNK_DELAY_SECONDS", 0.02))
+FAKE_ERROR_RATE = float(os.getenv("SWOT_FAKE_ERROR_RATE", 0))
+FAKE_SEED = int(os.getenv("SWOT_FAKE_SEED", 0))
+FAKE_CHUNK_CHARS = 80
+
+
+class LLMBackendError(Exception):
+    """Lỗi từ backend, kèm mã HTTP ở thuộc tính code (rate_limit dựa vào đó để thử lại)"""
+
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
+
+
+# ============================================
+# GIAO DIỆN CHUNG
+# ============================================
+class LLMBackend:
+    """Giao diện backend: mọi phương thức nhận/trả văn bản thuần
+
+    model_name được đưa vào key cache, để kết quả của các backend/model không lẫn nhau.
+    """
+
+    name = "base"
+    model_name = ""
+    # Có create_context_cache (đăng ký system + context phía provider)
+    supports_context_cache = False
+
+    def generate(self, prompt, generation_config=None, timeout=None):
+        """Sinh toàn bộ phản hồi, trả về văn bản"""
+        raise NotImplementedError
+
+    def stream(self, prompt, generation_config=None, timeout=None):
+        """Sinh phản hồi dạng stream, trả về iterator các đoạn văn bản"""
+        raise NotImplementedError
+
+    def count_tokens(self, text):
+        """Số token của text (mặc định: ước lượng cục bộ)"""
+        return estimate_tokens(text)
+
+    def create_context_cache(self, system_instruction, context, ttl_seconds):
+        """Đăng ký system_instruction + context làm cached content, trả về handle dùng trong Prompt.cached_content"""
+        raise NotImplementedError
+
+
+# ============================================
+# GEMINI
+# ============================================
+class GeminiBackend(LLMBackend):
+    """Gemini qua google.generativeai
+
+    Thư viện (~1 giây để import) và client chỉ được nạp ở lời gọi đầu tiên, một lần cho cả process
+    (backend là singleton, xem get_llm_backend), không phải mỗi lượt chạy lại của Streamlit.
+    Mỗi system_instruction (mỗi loại phân tích) có một GenerativeModel riêng, tạo một lần.
+    """
+
+    name = "gemini"
+    supports_context_cache = True
+
+    def __init__(self, api_key=None, model_name=GEMINI_MODEL):
+        self.api_key = api_key
+        self.model_name = model_name
+        self._genai = None
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def _client(self):
+        """Module google.generativeai đã cấu hình API key (gọi khi đang giữ self._lock)"""
+        if self._genai is None:
+            import google.generativeai as genai
+
+            if self.api_key:
+                genai.configure(api_key=self.api_key)
+            self._genai = genai
+        return self._genai
+
+    def _model_for(self, system_instruction=""):
+        with self._lock:
+            model = self._models.get(system_instruction)
+            if model is None:
+                model = self._models[system_instruction] = self._client().GenerativeModel(
+                    self.model_name, system_instruction=system_instruction or None
+                )
+            return model
+
+    @property
+    def model(self):
+        return self._model_for()
+
+    def _request(self, prompt):
+        """(model, nội dung lượt người dùng) của prompt"""
+        prompt = as_prompt(prompt)
+        if prompt.cached_content:
+            with self._lock:
+                genai = self._client()
+            return genai.GenerativeModel.from_cached_content(cached_content=prompt.cached_content), prompt.query
+        return self._model_for(prompt.system), prompt.user_text()
+
+    def generate(self, prompt, generation_config=None, timeout=None):
+        model, contents = self._request(prompt)
+        response = model.generate_content(
+            contents, generation_config=generation_config, request_options={"timeout": timeout}
+        )
+        return response.text
+
+    def stream(self, prompt, generation_config=None, timeout=None):
+        model, contents = self._request(prompt)
+        response = model.generate_content(
+            contents, generation_config=generation_config, stream=True, request_options={"timeout": timeout}
+        )
+        for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunk không có nội dung văn bản (VD: chunk kết thúc)
+                continue
+            yield text
+
+    def count_tokens(self, text):
+        return self.model.count_tokens(text).total_tokens
+
+    def create_context_cache(self, system_instruction, context, ttl_seconds):
+        import datetime
+
+        with self._lock:
+            self._client()
+        from google.generativeai import caching
+
+        cached = caching.CachedContent.create(
+            model=self.model_name,
+            system_instruction=system_instruction or None,
+            contents=[context],
+            ttl=datetime.timedelta(seconds=ttl_seconds)
+        )
+        return cached.name
+
+
+# ============================================
+# SERVER TƯƠNG THÍCH OPENAI
+# ============================================
+class OpenAICompatibleBackend(LLMBackend):
+    """Gọi /chat/completions của server tự host qua HTTP (thư viện chuẩn, không cần SDK)"""
+
+    name = "openai"
+
+    def __init__(self, base_url=OPENAI_BASE_URL, model_name=OPENAI_MODEL, api_key=OPENAI_API_KEY):
+        self.base_url = base_url.rstrip("/")
+        self.model_name = model_name
+        self.api_key = api_key
+
+    def _payload(self, prompt, generation_config, stream):
+        """Chuyển generation_config kiểu Gemini sang tham số OpenAI"""
+        config = generation_config or {}
+        prompt = as_prompt(prompt)
+        # Phần tĩnh trong message system đứng đầu: server có prefix caching (VD: vLLM) dùng lại được
+        messages = [{"role": "system", "content": prompt.system}] if prompt.system else []
+        messages.append({"role": "user", "content": prompt.user_text()})
+        payload = {
+            "model": self.model_name,
+            "messages": messages,
+            "stream": stream
+        }
+        for gemini_key, openai_key in (("temperature", "temperature"), ("top_p", "top_p"),
+                                       ("max_output_tokens", "max_tokens")):
+            if gemini_key in config:
+                payload[openai_key] = config[gemini_key]
+        if config.get("response_schema"):
+            payload["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {"name": "swot_analysis", "schema": config["response_schema"]}
+            }
+        elif config.get("response_mime_type") == "application/json":
+            payload["response_format"] = {"type": "json_object"}
+        return payload
+
+    def _post(self, payload, timeout):
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        request = urllib.request.Request(
+            f"{self.base_url}/chat/completions",
+            data=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+            headers=headers,
+            method="POST"
+        )
+        try:
+            return urllib.request.urlopen(request, timeout=timeout)
+        except urllib.error.HTTPError as e:
+            detail = e.read().decode("utf-8", errors="replace")[:500]
+            raise LLMBackendError(f"HTTP {e.code} từ {self.base_url}: {detail}", code=e.code) from e
+        except urllib.error.URLError as e:
+            raise ConnectionError(f"Không kết nối được {self.base_url}: {e.reason}") from e
+
+    def generate(self, prompt, generation_config=None, timeout=None):
+        with self._post(self._payload(prompt, generation_config, stream=False), timeout) as response:
+            data = json.loads(response.read().decode("utf-8"))
+        return data["choices"][0]["message"].get("content") or ""
+
+    def stream(self, prompt, generation_config=None, timeout=None):
+        # Server-sent events: mỗi dòng "data: {...}", kết thúc bằng "data: [DONE]"
+        with self._post(self._payload(prompt, generation_config, stream=True), timeout) as response:
+            for raw_line in response:
+                line = raw_line.decode("utf-8").strip()
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    return
+                choices = json.loads(data).get("choices") or [{}]
+                text = choices[0].get("delta", {}).get("content")
+                if text:
+                    yield text
+
+
+# ============================================
+# BACKEND GIẢ LẬP
+# ============================================
+def _fake_value(schema, rng, label=""):
+    """Giá trị ngẫu nhiên (theo rng) khớp với schema kiểu swot_schema"""
+    kind = schema.get("type")
+    if kind == "object":
+        return {key: _fake_value(sub, rng, key) for key, sub in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [_fake_value(schema.get("items", {}), rng, label) for _ in range(3)]
+    if kind == "integer":
+        return rng.randint(1, 10)
+    if kind == "number":
+        return round(rng.uniform(1, 10), 1)
+    return f"{schema.get('description') or label} #{rng.randint(1, 99)}"
+
+
+class FakeBackend(LLMBackend):
+    """Backend cục bộ cho load test: không gọi mạng, phản hồi xác định theo prompt + config
+
+    - Chế độ JSON (có response_schema): trả về JSON khớp schema
+    - Chế độ văn bản: bài viết ngắn + block ```json gộp các trường của mọi loại phân tích,
+      để hàm extract_* nào cũng đọc được
+    Lỗi giả lập (429/503, theo error_rate) xảy ra trước đoạn đầu tiên nên được thử lại như lỗi thật;
+    chuỗi lỗi xác định theo seed.
+    Cached content được giữ trong bộ nhớ; phản hồi chỉ phụ thuộc nội dung đầy đủ của prompt (có hay
+    không dùng cached content đều như nhau). requests / sent_tokens đếm số lời gọi và token thực gửi.
+    """
+
+    name = "fake"
+    model_name = "fake"
+    supports_context_cache = True
+
+    def __init__(self, latency_seconds=FAKE_LATENCY_SECONDS, chunk_delay_seconds=FAKE_CHUNK_DELAY_SECONDS,
+                 error_rate=FAKE_ERROR_RATE, seed=FAKE_SEED):
+        self.latency_seconds = latency_seconds
+        self.chunk_delay_seconds = chunk_delay_seconds
+        self.error_rate = error_rate
+        self._error_rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._contexts = {}
+        self.contexts_created = 0
+        self.requests = 0
+        self.sent_tokens = 0
+
+    def create_context_cache(self, system_instruction, context, ttl_seconds):
+        handle = "cachedContents/fake-" + hashlib.sha256(f"{system_instruction}\x00{context}".encode("utf-8")).hexdigest()[:16]
+        with self._lock:
+            self._contexts[handle] = (system_instruction, context)
+            self.contexts_created += 1
+        return handle
+
+    def _receive(self, prompt):
+        """Nội dung đầy đủ của prompt (ghép lại từ cached content nếu có), đếm phần thực gửi"""
+        prompt = as_prompt(prompt)
+        with self._lock:
+            self.requests += 1
+            self.sent_tokens += estimate_tokens(prompt.sent_text())
+            if not prompt.cached_content:
+                return prompt.text()
+            if prompt.cached_content not in self._contexts:
+                raise LLMBackendError(f"Backend giả lập: không có cached content {prompt.cached_content}", code=404)
+            system, context = self._contexts[prompt.cached_content]
+        return Prompt(system, context, prompt.query).text()
+
+    def _response_text(self, prompt, generation_config):
+        config = generation_config or {}
+        payload = json.dumps({"prompt": prompt, "config": config}, sort_keys=True, ensure_ascii=False, default=str)
+        rng = random.Random(hashlib.sha256(payload.encode("utf-8")).hexdigest())
+        if config.get("response_schema"):
+            return json.dumps(_fake_value(config["response_schema"], rng), ensure_ascii=False)
+
+        merged = {}
+        for schema in ANALYSIS_SCHEMAS.values():
+            merged.update(_fake_value(schema, rng))
+        narrative = "\n".join(
+            f"- Ý phân tích {i} ({rng.randint(100, 999)}) dựa trên {estimate_tokens(prompt)} token dữ liệu."
+            for i in range(1, 9)
+        )
+        return f"## Phân tích (backend giả lập)\n{narrative}\n\n```json\n{json.dumps(merged, ensure_ascii=False, indent=2)}\n```\n"
+
+    def _wait_first_token(self, timeout):
+        """Chờ độ trễ cấu hình (không quá timeout), rồi có thể ném lỗi giả lập"""
+        if timeout is not None and self.latency_seconds > timeout:
+            time.sleep(timeout)
+            raise TimeoutError("Backend giả lập: hết thời gian chờ phản hồi")
+        time.sleep(self.latency_seconds)
+        with self._lock:
+            failed = self._error_rng.random() < self.error_rate
+            code = self._error_rng.choice((429, 503))
+        if failed:
+            raise LLMBackendError(f"Backend giả lập: lỗi {code}", code=code)
+
+    def generate(self, prompt, generation_config=None, timeout=None):
+        prompt = self._receive(prompt)
+        self._wait_first_token(timeout)
+        return self._response_text(prompt, generation_config)
+
+    def stream(self, prompt, generation_config=None, timeout=None):
+        prompt = self._receive(prompt)
+        self._wait_first_token(timeout)
+        text = self._response_text(prompt, generation_config)
+        for start in range(0, len(text), FAKE_CHUNK_CHARS):
+            if start and self.chunk_delay_seconds:
+                time.sleep(self.chunk_delay_seconds)
+            yield text[start:start + FAKE_CHUNK_CHARS]
+
+
+# ============================================
+# CHỌN BACKEND
+# ============================================
+BACKENDS = {
+    "gemini": GeminiBackend,
+    "openai": OpenAICompatibleBackend,
+    "fake": FakeBackend
+}
+
+
+def create_llm_backend(name=LLM_BACKEND, api_key=None):
+    """Tạo backend theo tên; api_key chỉ dùng cho Gemini"""
+    if name not in BACKENDS:
+        raise ValueError(f"SWOT_LLM_BACKEND không hợp lệ: {name!r} (chọn một trong {', '.join(BACKENDS)})")
+    if name == "gemini":
+        return GeminiBackend(api_key=api_key)
+    return BACKENDS[name]()
+
+
+_backend_instance = None
+_backend_lock = threading.Lock()
+
+
+def get_llm_backend(api_key=None):
+    """Backend dùng chung trong toàn process (theo SWOT_LLM_BACKEND)"""
+    global _backend_instance
+    with _backend_lock:
+        if _backend_instance is None:
+            _backend_instance = create_llm_backend(api_key=api_key)
+        return _backend_instance
@@ -0,0 +1,131 @@
+"""
+SWOT AGENT - Lời gọi LLM dùng chung cho app.py và main.py
+Mỗi lời gọi đi qua cùng một đường: cache phản hồi trên đĩa -> single-flight (gộp lời gọi giống hệt
+đang chạy) -> cached content cho dữ liệu CSV lớn -> limiter (RPM/TPM, AIMD, thử lại) -> backend,
+và được ghi số liệu qua metrics. app.py / main.py chỉ quyết định có dùng cache hay không.
+"""
+
+from response_cache import get_response_cache, make_cache_key
+from rate_limit import call_with_retry, stream_with_retry
+from single_flight import get_single_flight, flight_key
+from prompt_layout import as_prompt
+from context_cache import get_context_cache
+from metrics import get_metrics, current_labels
+from csv_summary import estimate_tokens
+from shop_names import key_text
+
+
+def count_tokens(backend, text):
+    """Đếm token bằng backend (Gemini: API count_tokens), lỗi thì dùng ước lượng cục bộ
+
+    Qua limiter dùng chung như lời gọi sinh, kết quả lưu trong cache phản hồi (cùng nội dung không đếm lại).
+    """
+    cache = get_response_cache()
+    cache_key = make_cache_key(text, backend.model_name, {"count_tokens": True})
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return int(cached)
+    try:
+        tokens = call_with_retry(lambda timeout: backend.count_tokens(text), max_retries=1)
+    except Exception:
+        return estimate_tokens(text)
+    cache.set(cache_key, str(tokens))
+    return tokens
+
+
+def _keys(backend, prompt, generation_config):
+    """(key cache, key single-flight) theo tên chuẩn của quán (xem shop_names.key_text);
+    prompt gửi đi giữ nguyên tên người dùng gõ"""
+    key_prompt = key_text(prompt)
+    return (make_cache_key(key_prompt, backend.model_name, generation_config),
+            flight_key(key_prompt, backend.model_name, generation_config))
+
+
+def call_llm(backend, prompt, use_cache=True, generation_config=None, stream=False):
+    """Gọi backend, trả về văn bản phản hồi
+
+    stream=True: trả về iterator các đoạn văn bản (xem stream_llm)
+    """
+    if stream:
+        # Nhãn (tab, chế độ) lấy ngay lúc gọi, vì generator chỉ chạy khi được đọc
+        return stream_llm(backend, prompt, use_cache, generation_config, labels=current_labels())
+
+    # Prompt có thể đã tách phần (prompt_layout.Prompt); key cache và single-flight xem _keys
+    prompt = as_prompt(prompt)
+    full_prompt = prompt.text()
+    call = get_metrics().start_call(full_prompt, backend.name)
+    cache = get_response_cache()
+    cache_key, key = _keys(backend, prompt, generation_config)
+    if use_cache:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            call.finish(cached, cache_hit=True)
+            return cached
+
+    def generate():
+        # Dữ liệu CSV lớn: đăng ký cached content một lần, các lời gọi sau chỉ gửi phần thay đổi
+        request = get_context_cache().prepare(backend, prompt)
+        call.prompt_sent(request.sent_text())
+        # Qua limiter dùng chung: RPM/TPM, AIMD khi bị 429, thử lại có backoff trong deadline
+        return call_with_retry(
+            lambda timeout: backend.generate(request, generation_config, timeout=timeout),
+            tokens=estimate_tokens(full_prompt),
+            on_retry=call.retry
+        )
+
+    # Lời gọi giống hệt đang chạy ở session/luồng khác: chờ và dùng chung kết quả, không gọi thêm
+    try:
+        text, coalesced = get_single_flight().run(
+            key,
+            generate,
+            # Kể cả khi bỏ qua cache, kết quả mới vẫn được lưu để làm mới cache
+            on_complete=lambda text: cache.set(cache_key, text)
+        )
+    except Exception as e:
+        call.finish(error=e)
+        raise
+    call.finish(text, coalesced=coalesced)
+    return text
+
+
+def stream_llm(backend, prompt, use_cache=True, generation_config=None, labels=None):
+    """Gọi backend ở chế độ stream, trả về từng đoạn văn bản ngay khi có"""
+    prompt = as_prompt(prompt)
+    full_prompt = prompt.text()
+    call = get_metrics().start_call(full_prompt, backend.name, labels)
+    cache = get_response_cache()
+    cache_key, key = _keys(backend, prompt, generation_config)
+    if use_cache:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            call.finish(cached, cache_hit=True)
+            yield cached
+            return
+
+    def start_stream():
+        request = get_context_cache().prepare(backend, prompt)
+        call.prompt_sent(request.sent_text())
+        return stream_with_retry(
+            lambda timeout: backend.stream(request, generation_config, timeout=timeout),
+            tokens=estimate_tokens(full_prompt),
+            on_retry=call.retry
+        )
+
+    parts = []
+    # Lời gọi giống hệt đang chạy: nhận chung các đoạn của lời gọi đó thay vì gọi thêm
+    response, coalesced = get_single_flight().stream(
+        key,
+        start_stream,
+        # Chỉ lưu cache khi đã nhận đủ phản hồi
+        on_complete=lambda text: cache.set(cache_key, text)
+    )
+    try:
+        for text in response:
+            call.first_token()
+            parts.append(text)
+            yield text
+    except BaseException as e:
+        # Kể cả khi người đọc dừng giữa chừng (GeneratorExit)
+        call.finish("".join(parts), error=e, coalesced=coalesced)
+        raise
+    call.finish("".join(parts), coalesced=coalesced)
@@ -0,0 +1,303 @@
+"""
+SWOT AGENT - Đo lường từng lời gọi LLM
+Mỗi lời gọi call_gemini ghi lại: tab, chế độ phân tích, backend, số ký tự/token prompt,
+token đầu ra, thời gian tới token đầu tiên (TTFT), tổng thời gian, số lần thử lại, cache hit,
+gộp chung với lời gọi giống hệt đang chạy (coalesced), lỗi.
+- Chế độ (mode) do decorator @track_mode trên các hàm analyze_* đặt, tab do giao diện đặt
+  bằng metrics_context(tab=...); cả hai đi theo contextvars của lời gọi.
+- Xuất dạng text Prometheus: ghi ra file (SWOT_METRICS_FILE) và/hoặc phục vụ qua HTTP
+  (SWOT_METRICS_PORT, đường dẫn /metrics)
+- summary_table(): p50/p95/p99 theo tab/chế độ cho panel quản trị ở sidebar
+Token được ước lượng cục bộ (không tốn thêm lời gọi count_tokens).
+"""
+
+import os
+import time
+import threading
+import contextlib
+import contextvars
+import functools
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from csv_summary import estimate_tokens
+
+# ============================================
+# CẤU HÌNH (có thể ghi đè bằng biến môi trường)
+# ============================================
+METRICS_FILE = os.getenv("SWOT_METRICS_FILE", "")
+METRICS_PORT = int(os.getenv("SWOT_METRICS_PORT", 0))
+# Hiện panel quản trị ở sidebar
+METRICS_ADMIN = os.getenv("SWOT_METRICS_ADMIN", "0") == "1"
+# Số lời gọi gần nhất giữ lại cho mỗi (tab, chế độ) để tính phân vị
+METRICS_WINDOW = int(os.getenv("SWOT_METRICS_WINDOW", 1000))
+
+QUANTILES = (0.5, 0.95, 0.99)
+DEFAULT_LABELS = {"tab": "-", "mode": "-"}
+
+_labels = contextvars.ContextVar("swot_metrics_labels", default=DEFAULT_LABELS)
+
+
+# ============================================
+# NHÃN THEO NGỮ CẢNH
+# ============================================
+@contextlib.contextmanager
+def metrics_context(**labels):
+    """Gắn nhãn (tab, mode) cho mọi lời gọi LLM bên trong khối with"""
+    token = _labels.set(dict(_labels.get(), **labels))
+    try:
+        yield
+    finally:
+        _labels.reset(token)
+
+
+def current_labels():
+    return dict(_labels.get())
+
+
+def track_mode(mode):
+    """Decorator cho các hàm analyze_*: lời gọi LLM bên trong được gắn chế độ `mode`"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with metrics_context(mode=mode):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def quantile(sorted_values, q):
+    """Phân vị q của danh sách đã sắp xếp (nội suy tuyến tính)"""
+    if not sorted_values:
+        return float("nan")
+    position = (len(sorted_values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+# ============================================
+# GHI NHẬN
+# ============================================
+class _Series:
+    """Số liệu cộng dồn + cửa sổ gần nhất của một bộ nhãn (tab, mode, backend)"""
+
+    def __init__(self, window):
+        self.calls = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.retries = 0
+        self.prompt_chars = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.latency_sum = 0.0
+        self.latencies = deque(maxlen=window)
+        self.ttfts = deque(maxlen=window)
+
+
+class MetricsRegistry:
+    """Kho số liệu dùng chung trong process (mọi session/thread)"""
+
+    def __init__(self, window=METRICS_WINDOW, export_path=METRICS_FILE):
+        self.window = window
+        self.export_path = export_path
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def record(self, labels, prompt_chars, prompt_tokens, output_tokens, latency, ttft,
+               retries=0, cache_hit=False, error=False, coalesced=False):
+        key = (labels.get("tab", "-"), labels.get("mode", "-"), labels.get("backend", "-"))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _Series(self.window)
+            series.calls += 1
+            series.cache_hits += int(cache_hit)
+            series.coalesced += int(coalesced)
+            series.errors += int(error)
+            series.retries += retries
+            series.prompt_chars += prompt_chars
+            series.prompt_tokens += prompt_tokens
+            series.output_tokens += output_tokens
+            series.latency_sum += latency
+            series.latencies.append(latency)
+            if ttft is not None:
+                series.ttfts.append(ttft)
+        if self.export_path:
+            self.write_file(self.export_path)
+
+    def start_call(self, prompt, backend_name, labels=None):
+        """Bắt đầu đo một lời gọi; labels mặc định lấy theo ngữ cảnh hiện tại"""
+        return CallRecorder(self, prompt, dict(labels or current_labels(), backend=backend_name))
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    # ---------- Xuất số liệu ----------
+    def render_prometheus(self):
+        """Số liệu dạng text exposition của Prometheus"""
+        counters = [
+            ("swot_llm_calls_total", "Số lời gọi LLM", "calls"),
+            ("swot_llm_cache_hits_total", "Số lời gọi lấy từ cache", "cache_hits"),
+            ("swot_llm_coalesced_total", "Số lời gọi dùng chung kết quả của lời gọi giống hệt đang chạy", "coalesced"),
+            ("swot_llm_errors_total", "Số lời gọi lỗi", "errors"),
+            ("swot_llm_retries_total", "Số lần thử lại", "retries"),
+            ("swot_llm_prompt_chars_total", "Tổng số ký tự prompt", "prompt_chars"),
+            ("swot_llm_prompt_tokens_total", "Tổng token prompt (ước lượng)", "prompt_tokens"),
+            ("swot_llm_output_tokens_total", "Tổng token đầu ra (ước lượng)", "output_tokens"),
+        ]
+        with self._lock:
+            items = sorted(self._series.items())
+            lines = []
+            for name, help_text, attr in counters:
+                lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} counter"])
+                lines.extend(f"{name}{{{_label_text(key)}}} {getattr(series, attr)}" for key, series in items)
+
+            for name, help_text, attr in (
+                ("swot_llm_latency_seconds", "Tổng thời gian lời gọi LLM", "latencies"),
+                ("swot_llm_ttft_seconds", "Thời gian tới token đầu tiên", "ttfts"),
+            ):
+                lines.extend([f"# HELP {name} {help_text} (phân vị trên {self.window} lời gọi gần nhất)",
+                              f"# TYPE {name} summary"])
+                for key, series in items:
+                    values = sorted(getattr(series, attr))
+                    labels = _label_text(key)
+                    for q in QUANTILES:
+                        lines.append(f'{name}{{{labels},quantile="{q}"}} {quantile(values, q):.6f}')
+                    total = series.latency_sum if attr == "latencies" else sum(values)
+                    lines.append(f"{name}_sum{{{labels}}} {total:.6f}")
+                    lines.append(f"{name}_count{{{labels}}} {series.calls if attr == 'latencies' else len(values)}")
+        return "\n".join(lines) + "\n"
+
+    def write_file(self, path):
+        """Ghi số liệu ra file (ghi file tạm rồi đổi tên, để người đọc không thấy file dở dang)"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render_prometheus())
+        os.replace(tmp_path, path)
+
+    def summary_table(self, group_by=("tab", "mode")):
+        """Bảng tóm tắt theo nhóm nhãn: list dict (số lời gọi, cache hit, p50/p95/p99, token...)"""
+        positions = {"tab": 0, "mode": 1, "backend": 2}
+        groups = {}
+        with self._lock:
+            for key, series in self._series.items():
+                group_key = tuple(key[positions[name]] for name in group_by)
+                groups.setdefault(group_key, []).append(series)
+
+            rows = []
+            for group_key, series_list in sorted(groups.items()):
+                calls = sum(s.calls for s in series_list)
+                latencies = sorted(v for s in series_list for v in s.latencies)
+                ttfts = sorted(v for s in series_list for v in s.ttfts)
+                row = dict(zip(group_by, group_key))
+                row.update({
+                    "calls": calls,
+                    "cache_hit_rate": sum(s.cache_hits for s in series_list) / calls if calls else 0.0,
+                    "coalesced": sum(s.coalesced for s in series_list),
+                    "errors": sum(s.errors for s in series_list),
+                    "retries": sum(s.retries for s in series_list),
+                    "avg_prompt_tokens": sum(s.prompt_tokens for s in series_list) / calls if calls else 0.0,
+                    "output_tokens": sum(s.output_tokens for s in series_list),
+                    "ttft_p50": quantile(ttfts, 0.5),
+                })
+                for q in QUANTILES:
+                    row[f"latency_p{int(q * 100)}"] = quantile(latencies, q)
+                rows.append(row)
+        return rows
+
+
+def _label_text(key):
+    tab, mode, backend = (value.replace("\\", "\\\\").replace('"', '\\"') for value in key)
+    return f'tab="{tab}",mode="{mode}",backend="{backend}"'
+
+
+class CallRecorder:
+    """Đo một lời gọi: first_token() khi nhận đoạn đầu, retry() mỗi lần thử lại, finish() khi xong"""
+
+    def __init__(self, registry, prompt, labels):
+        self.registry = registry
+        self.labels = labels
+        self.prompt_chars = len(prompt)
+        self.prompt_tokens = estimate_tokens(prompt)
+        self.started_at = time.perf_counter()
+        self.ttft = None
+        self.retries = 0
+        self._finished = False
+
+    def prompt_sent(self, prompt):
+        """Phần prompt thực gửi đi (VD: không tính dữ liệu CSV đã nằm trong cached content)"""
+        self.prompt_chars = len(prompt)
+        self.prompt_tokens = estimate_tokens(prompt)
+
+    def first_token(self):
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self.started_at
+
+    def retry(self, attempt=None, error=None):
+        self.retries += 1
+
+    def finish(self, text="", cache_hit=False, error=None, coalesced=False):
+        if self._finished:
+            return
+        self._finished = True
+        latency = time.perf_counter() - self.started_at
+        self.registry.record(
+            self.labels, self.prompt_chars, self.prompt_tokens,
+            estimate_tokens(text) if text else 0, latency,
+            self.ttft if self.ttft is not None else (latency if text else None),
+            retries=self.retries, cache_hit=cache_hit, error=error is not None, coalesced=coalesced
+        )
+
+
+_registry_instance = None
+_registry_lock = threading.Lock()
+
+
+def get_metrics():
+    """Kho số liệu dùng chung trong toàn process"""
+    global _registry_instance
+    with _registry_lock:
+        if _registry_instance is None:
+            _registry_instance = MetricsRegistry()
+        return _registry_instance
+
+
+# ============================================
+# HTTP ENDPOINT
+# ============================================
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = get_metrics().render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Không in log truy cập ra console
+        pass
+
+
+_server_instance = None
+
+
+def start_metrics_server(port=METRICS_PORT, host="0.0.0.0"):
+    """Phục vụ /metrics trên thread nền (một lần mỗi process); port=0 thì không bật"""
+    global _server_instance
+    if not port:
+        return None
+    with _registry_lock:
+        if _server_instance is None:
+            _server_instance = ThreadingHTTPServer((host, port), _MetricsHandler)
+            threading.Thread(target=_server_instance.serve_forever, name="swot-metrics", daemon=True).start()
+        return _server_instance
@@ -0,0 +1,163 @@
+"""
+SWOT AGENT - Profile từng lượt chạy lại (rerun) của Streamlit
+Chỉ bật khi đặt SWOT_PROFILE_DIR: mỗi rerun và phần code của từng tab được đo bằng cProfile,
+kết quả ghi vào thư mục đó, tên file gắn nhãn tab và nút bấm:
+- <thời điểm>_<pid>_rerun_button-btn1.prof   (pstats, mở bằng snakeviz / flameprof / pstats)
+- <thời điểm>_<pid>_rerun_button-btn1.txt    (top hàm theo thời gian cộng dồn, đọc nhanh)
+Các phần lồng nhau (tab bên trong rerun) không chạy hai profiler cùng lúc: profiler ngoài
+tạm dừng trong lúc đo phần trong, rồi cộng số liệu phần trong vào khi ghi file.
+Stack các phần đang đo được giữ theo scope (app.py: một scope cho mỗi session), không theo thread:
+Streamlit chạy mỗi rerun trên một thread mới, nên phần "rerun" của lượt bị ngắt (st.rerun, người
+dùng bấm nút khi trang đang chạy) chỉ được tìm thấy và dừng ở lượt sau nếu cùng scope.
+"""
+
+import os
+import re
+import time
+import pstats
+import cProfile
+import threading
+import contextlib
+from datetime import datetime
+
+# ============================================
+# CẤU HÌNH (có thể ghi đè bằng biến môi trường)
+# ============================================
+PROFILE_DIR = os.getenv("SWOT_PROFILE_DIR", "")
+# Không ghi file cho phần chạy nhanh hơn ngưỡng này (ms), tránh hàng loạt file của tab không thao tác
+PROFILE_MIN_MS = float(os.getenv("SWOT_PROFILE_MIN_MS", 10))
+# Số hàm liệt kê trong file .txt
+PROFILE_TOP_N = int(os.getenv("SWOT_PROFILE_TOP", 40))
+
+# scope -> stack các phần đang đo; scope hiện tại của thread do start_profile đặt
+_stacks = {}
+_stacks_lock = threading.Lock()
+_local = threading.local()
+
+
+def profiling_enabled():
+    return bool(PROFILE_DIR)
+
+
+def _scope():
+    scope = getattr(_local, "scope", None)
+    return ("thread", threading.get_ident()) if scope is None else scope
+
+
+def _stack(scope=None):
+    with _stacks_lock:
+        return _stacks.setdefault(_scope() if scope is None else scope, [])
+
+
+def _slug(value):
+    """Chuỗi an toàn cho tên file"""
+    return re.sub(r"[^A-Za-z0-9_.-]+", "-", str(value)).strip("-")[:40] or "none"
+
+
+class ProfileSection:
+    """Một phần được profile; khi profiling tắt mọi phương thức đều không làm gì"""
+
+    def __init__(self, name, **tags):
+        self.name = name
+        self.tags = {key: value for key, value in tags.items() if value is not None}
+        self.profiler = None
+        self.children = []
+        self.started_at = None
+        self.scope = None
+
+    def start(self):
+        if not profiling_enabled():
+            return self
+        self.scope = _scope()
+        stack = _stack(self.scope)
+        parent = stack[-1] if stack else None
+        if parent:
+            parent.profiler.disable()
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Đã có công cụ profile khác đang chạy (VD: debugger): bỏ qua phần này
+            if parent:
+                parent.profiler.enable()
+            return self
+        self.profiler = profiler
+        self.started_at = time.perf_counter()
+        stack.append(self)
+        return self
+
+    def tag(self, **tags):
+        self.tags.update({key: value for key, value in tags.items() if value is not None})
+
+    def stop(self):
+        """Dừng đo và ghi file, trả về đường dẫn file .prof (None nếu không ghi)
+
+        Có thể gọi từ thread khác thread đã start (dừng phần của lượt chạy trước, xem start_profile).
+        """
+        if self.profiler is None:
+            return None
+        self.profiler.disable()
+        elapsed_ms = (time.perf_counter() - self.started_at) * 1000
+        stack = _stack(self.scope)
+        # Bỏ cả các phần con chưa dừng (VD: bị ngắt bởi exception)
+        while stack and stack[-1] is not self:
+            stack.pop()
+        if stack:
+            stack.pop()
+        parent = stack[-1] if stack else None
+        if not stack:
+            with _stacks_lock:
+                if _stacks.get(self.scope) is stack:
+                    del _stacks[self.scope]
+        profiler, self.profiler = self.profiler, None
+
+        path = None
+        if elapsed_ms >= PROFILE_MIN_MS:
+            path = self._dump(profiler, elapsed_ms)
+        if parent:
+            parent.children.append(profiler)
+            parent.children.extend(self.children)
+            parent.profiler.enable()
+        return path
+
+    def _dump(self, profiler, elapsed_ms):
+        stats = pstats.Stats(profiler)
+        for child in self.children:
+            stats.add(child)
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        tag_text = "_".join(f"{_slug(key)}-{_slug(value)}" for key, value in self.tags.items())
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        base = os.path.join(PROFILE_DIR, "_".join(filter(None, [stamp, str(os.getpid()), _slug(self.name), tag_text])))
+        stats.dump_stats(base + ".prof")
+        with open(base + ".txt", "w", encoding="utf-8") as f:
+            f.write(f"{self.name} {self.tags} - {elapsed_ms:.1f} ms (thời gian thực)\n")
+            stats.stream = f
+            stats.sort_stats("cumulative").print_stats(PROFILE_TOP_N)
+        return base + ".prof"
+
+
+def start_profile(name, scope=None, **tags):
+    """Bắt đầu profile một phần kéo dài (VD: cả rerun), gọi .stop() khi kết thúc
+
+    scope (VD: ID session): các phần bắt đầu sau đó trên thread này dùng stack của scope. Phần cùng
+    tên còn sót trong scope (lượt trước bị ngắt giữa chừng, có thể trên thread khác) được dừng và
+    ghi trước.
+    """
+    if not profiling_enabled():
+        return ProfileSection(name, **tags)
+    if scope is not None:
+        _local.scope = scope
+    for section in [section for section in _stack() if section.name == name]:
+        section.tag(interrupted=1)
+        section.stop()
+    return ProfileSection(name, **tags).start()
+
+
+@contextlib.contextmanager
+def profile_section(name, **tags):
+    """Profile khối with (VD: phần code của một tab), ghi file khi kết thúc khối"""
+    section = ProfileSection(name, **tags).start()
+    try:
+        yield section
+    finally:
+        section.stop()
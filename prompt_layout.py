@@ -0,0 +1,72 @@
+"""
+SWOT AGENT - Bố cục prompt: phần tĩnh trước, phần thay đổi sau
+Prompt cũ trộn hướng dẫn + format/schema (dài, giống nhau mọi lần) với tên quán và dữ liệu CSV
+(thay đổi), nên provider không tận dụng được cache theo tiền tố (prefix caching).
+Mỗi prompt được tách thành 3 phần, xếp từ ít thay đổi nhất tới nhiều nhất:
+- system:  vai trò + nhiệm vụ + format/schema, chỉ phụ thuộc loại phân tích (gửi qua system_instruction)
+- context: dữ liệu CSV lớn, giống nhau giữa các lần phân tích trên cùng file upload
+           (có thể đăng ký một lần làm cached content, xem context_cache)
+- query:   phần nhỏ thay đổi theo từng lần gọi (tên quán, địa chỉ chi nhánh...)
+"""
+
+from swot_schema import JSON_MODE_INSTRUCTION
+
+# Vai trò chung của mọi phân tích (đầu system_instruction)
+SYSTEM_PERSONA = "Bạn là chuyên gia phân tích kinh doanh và là một Data Analyst trong lĩnh vực F&B tại Việt Nam."
+# Lượt người dùng của phân tích không có tham số riêng (VD: tự nhận diện quán từ CSV)
+DATA_QUERY = "Hãy phân tích dữ liệu ở trên theo đúng yêu cầu và format đã cho."
+
+
+class Prompt:
+    """Prompt đã tách phần; cached_content là handle của context đã đăng ký phía provider (nếu có)
+
+    cache_context=True: context được gửi lại qua nhiều lời gọi (VD: hỏi tiếp về một kết quả), luôn thử
+    đăng ký cached content dù SWOT_CONTEXT_CACHE tắt hay context nhỏ hơn ngưỡng (xem context_cache)
+    """
+
+    def __init__(self, system="", context="", query="", cached_content=None, cache_context=False):
+        self.system = system
+        self.context = context
+        self.query = query
+        self.cached_content = cached_content
+        self.cache_context = cache_context
+
+    def text(self):
+        """Toàn bộ nội dung (dùng cho key cache, single-flight, backend không hỗ trợ system_instruction)"""
+        return "\n\n".join(part for part in (self.system, self.context, self.query) if part)
+
+    def user_text(self):
+        """Phần gửi trong lượt người dùng: context (nếu chưa nằm trong cached content) + query"""
+        context = "" if self.cached_content else self.context
+        return "\n\n".join(part for part in (context, self.query) if part)
+
+    def sent_text(self):
+        """Phần thực sự gửi đi ở mỗi lời gọi (system + lượt người dùng, không tính context đã cache)"""
+        if self.cached_content:
+            return self.query
+        return self.text()
+
+    def with_cached_content(self, handle):
+        """Bản sao dùng context đã đăng ký (system và context nằm trong cached content)"""
+        return Prompt(self.system, self.context, self.query, cached_content=handle, cache_context=self.cache_context)
+
+
+def as_prompt(prompt):
+    """Chuỗi thường -> Prompt chỉ có query (text() giữ nguyên chuỗi, nên key cache không đổi)"""
+    if isinstance(prompt, Prompt):
+        return prompt
+    return Prompt(query=prompt)
+
+
+def prompt_text(prompt):
+    return as_prompt(prompt).text()
+
+
+def analysis_prompt(instructions, response_format, json_mode=False, context="", query=""):
+    """Prompt của một phân tích: vai trò + nhiệm vụ + format (tĩnh) | dữ liệu CSV | phần thay đổi
+
+    instructions, response_format không được chứa tên quán hay dữ liệu của lần gọi; chế độ JSON
+    thay response_format bằng JSON_MODE_INSTRUCTION (schema nằm trong generation_config).
+    """
+    system = f"{SYSTEM_PERSONA}\n\n{instructions.strip()}\n\n{(JSON_MODE_INSTRUCTION if json_mode else response_format).strip()}"
+    return Prompt(system, context.strip(), query.strip() or DATA_QUERY)
@@ -0,0 +1,238 @@
+"""
+SWOT AGENT - Giới hạn tốc độ và thử lại khi gọi Gemini
+- Token bucket cho số request/phút (RPM) và số token/phút (TPM)
+- Số lời gọi đồng thời tự điều chỉnh theo AIMD: tăng dần khi thành công, giảm một nửa khi gặp 429
+- Thử lại với backoff lũy thừa có jitter, trong giới hạn thời gian (deadline) của mỗi lời gọi
+Một limiter dùng chung cho mọi session/thread trong process (app.py và main.py).
+"""
+
+import os
+import time
+import random
+import threading
+
+# ============================================
+# CẤU HÌNH (có thể ghi đè bằng biến môi trường)
+# ============================================
+DEFAULT_RPM = int(os.getenv("SWOT_GEMINI_RPM", 60))
+DEFAULT_TPM = int(os.getenv("SWOT_GEMINI_TPM", 1_000_000))
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("SWOT_GEMINI_MAX_CONCURRENCY", 8))
+DEFAULT_MAX_RETRIES = int(os.getenv("SWOT_GEMINI_MAX_RETRIES", 4))
+DEFAULT_DEADLINE_SECONDS = float(os.getenv("SWOT_GEMINI_DEADLINE_SECONDS", 120))
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 30.0
+
+# Mã HTTP coi là lỗi tạm thời: quá tải, lỗi server, hết thời gian
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class DeadlineExceededError(TimeoutError):
+    """Hết thời gian cho phép của một lời gọi (kể cả thời gian chờ và thử lại)"""
+
+
+def error_status_code(error):
+    """Mã HTTP của lỗi (google.api_core.exceptions có thuộc tính code), None nếu không có"""
+    code = getattr(error, "code", None)
+    return code if isinstance(code, int) else None
+
+
+def is_retryable_error(error):
+    return error_status_code(error) in RETRYABLE_STATUS_CODES or isinstance(error, (ConnectionError, TimeoutError))
+
+
+def is_throttle_error(error):
+    return error_status_code(error) == 429
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE_SECONDS, cap=BACKOFF_MAX_SECONDS):
+    """Backoff lũy thừa với full jitter: ngẫu nhiên trong [0, min(cap, base * 2^attempt)]"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+# ============================================
+# TOKEN BUCKET & AIMD
+# ============================================
+class TokenBucket:
+    """Bucket nạp đều `rate_per_minute` đơn vị mỗi phút, chứa tối đa `capacity`"""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(capacity or rate_per_minute)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount, now):
+        """Số giây phải chờ để đủ `amount` (không trừ)"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount):
+        self.tokens -= min(amount, self.capacity)
+
+
+class AIMDConcurrency:
+    """Giới hạn số lời gọi đồng thời, tăng cộng khi thành công và giảm nhân khi bị 429"""
+
+    def __init__(self, max_limit, min_limit=1):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self, deadline=None):
+        """Chờ lượt gọi, trả về thời điểm bắt đầu (truyền lại cho release)"""
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise DeadlineExceededError("Hết thời gian chờ lượt gọi Gemini")
+                self._cond.wait(remaining)
+            self.in_flight += 1
+            return time.monotonic()
+
+    def release(self, started_at, throttled=False):
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                # Chỉ giảm với lời gọi bắt đầu sau lần giảm trước: một đợt 429 chỉ giảm một lần
+                if started_at >= self._last_decrease:
+                    self.limit = max(self.min_limit, self.limit / 2)
+                    self._last_decrease = time.monotonic()
+            else:
+                # Tăng khoảng 1 sau mỗi "cửa sổ" limit lời gọi thành công
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+
+class RateLimiter:
+    """Kết hợp RPM, TPM và AIMD; dùng chung trong process"""
+
+    def __init__(self, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.concurrency = AIMDConcurrency(max_concurrency)
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens, deadline=None):
+        """Chờ đến khi được gọi: có lượt đồng thời, đủ request và token trong bucket
+
+        Trả về permit, phải truyền lại cho release() khi lời gọi kết thúc.
+        """
+        permit = self.concurrency.acquire(deadline)
+        try:
+            while True:
+                with self._lock:
+                    now = time.monotonic()
+                    wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+                    if wait == 0:
+                        self.requests.take(1)
+                        self.tokens.take(tokens)
+                        return permit
+                if deadline is not None and time.monotonic() + wait > deadline:
+                    raise DeadlineExceededError("Vượt hạn mức RPM/TPM, không kịp gọi trước deadline")
+                time.sleep(wait)
+        except BaseException:
+            self.concurrency.release(permit)
+            raise
+
+    def release(self, permit, throttled=False):
+        self.concurrency.release(permit, throttled)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "concurrency_limit": int(self.concurrency.limit),
+                "in_flight": self.concurrency.in_flight,
+                "request_tokens": round(self.requests.tokens, 1),
+                "tpm_tokens": round(self.tokens.tokens)
+            }
+
+
+_limiter_instance = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Limiter dùng chung trong toàn process"""
+    global _limiter_instance
+    with _limiter_lock:
+        if _limiter_instance is None:
+            _limiter_instance = RateLimiter()
+        return _limiter_instance
+
+
+# ============================================
+# GỌI CÓ GIỚI HẠN VÀ THỬ LẠI
+# ============================================
+def call_with_retry(func, tokens=1, limiter=None, deadline_seconds=DEFAULT_DEADLINE_SECONDS,
+                    max_retries=DEFAULT_MAX_RETRIES, on_retry=None):
+    """Gọi func(timeout) qua limiter, thử lại lỗi tạm thời với backoff có jitter
+
+    timeout truyền cho func là thời gian còn lại tới deadline (giây).
+    Lỗi không thử lại được, hoặc hết lượt thử / hết deadline: ném lỗi cuối cùng.
+    on_retry(attempt, error): gọi trước mỗi lần thử lại (VD: để đếm số lần thử lại).
+    """
+    limiter = limiter or get_rate_limiter()
+    deadline = time.monotonic() + deadline_seconds
+    attempt = 0
+    while True:
+        permit = limiter.acquire(tokens, deadline)
+        throttled = False
+        try:
+            return func(max(deadline - time.monotonic(), 0.1))
+        except Exception as e:
+            throttled = is_throttle_error(e)
+            if not is_retryable_error(e) or attempt >= max_retries:
+                raise
+            delay = backoff_delay(attempt)
+            if time.monotonic() + delay >= deadline:
+                raise
+            if on_retry:
+                on_retry(attempt, e)
+        finally:
+            limiter.release(permit, throttled)
+        time.sleep(delay)
+        attempt += 1
+
+
+def stream_with_retry(open_stream, tokens=1, limiter=None, deadline_seconds=DEFAULT_DEADLINE_SECONDS,
+                      max_retries=DEFAULT_MAX_RETRIES, on_retry=None):
+    """Như call_with_retry cho lời gọi stream: open_stream(timeout) trả về iterator
+
+    Chỉ thử lại khi chưa nhận được chunk nào; lỗi giữa chừng được ném ra nguyên vẹn
+    (không thể rút lại phần văn bản đã hiển thị). Giữ lượt đồng thời cho tới khi stream kết thúc.
+    """
+    limiter = limiter or get_rate_limiter()
+    deadline = time.monotonic() + deadline_seconds
+    attempt = 0
+    while True:
+        permit = limiter.acquire(tokens, deadline)
+        throttled = False
+        started = False
+        try:
+            for chunk in open_stream(max(deadline - time.monotonic(), 0.1)):
+                started = True
+                yield chunk
+            return
+        except Exception as e:
+            throttled = is_throttle_error(e)
+            if started or not is_retryable_error(e) or attempt >= max_retries:
+                raise
+            delay = backoff_delay(attempt)
+            if time.monotonic() + delay >= deadline:
+                raise
+            if on_retry:
+                on_retry(attempt, e)
+        finally:
+            limiter.release(permit, throttled)
+        time.sleep(delay)
+        attempt += 1
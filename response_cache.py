@@ -0,0 +1,147 @@
+"""
+SWOT AGENT - Cache phản hồi LLM trên đĩa
+Lưu trên SQLite, nén zlib, có TTL và loại bỏ LRU theo số lượng/dung lượng.
+Dùng chung cho app.py (Streamlit) và main.py (CLI).
+"""
+
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+
+# ============================================
+# CẤU HÌNH CACHE (có thể ghi đè bằng biến môi trường)
+# ============================================
+DEFAULT_CACHE_PATH = os.getenv("SWOT_CACHE_PATH", os.path.join(".cache", "swot_responses.sqlite3"))
+DEFAULT_TTL_SECONDS = int(os.getenv("SWOT_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+DEFAULT_MAX_ENTRIES = int(os.getenv("SWOT_CACHE_MAX_ENTRIES", 2000))
+DEFAULT_MAX_BYTES = int(os.getenv("SWOT_CACHE_MAX_MB", 200)) * 1024 * 1024
+
+
+def make_cache_key(prompt, model_name, generation_config=None):
+    """Tạo key theo nội dung: prompt + tên model + cấu hình sinh"""
+    payload = json.dumps(
+        {"prompt": prompt, "model": model_name, "config": generation_config or {}},
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Cache key-value trên SQLite với TTL và loại bỏ LRU"""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl_seconds=DEFAULT_TTL_SECONDS,
+                 max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # check_same_thread=False: Streamlit chạy mỗi session trên một thread riêng
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses(accessed_at)")
+        self._conn.commit()
+
+    def get(self, key):
+        """Trả về chuỗi đã cache, hoặc None nếu không có / đã hết hạn"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if self.ttl_seconds and now - created_at > self.ttl_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            # Cập nhật thời điểm truy cập cho LRU
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return zlib.decompress(value).decode("utf-8")
+
+    def set(self, key, value):
+        """Lưu chuỗi vào cache rồi dọn bớt nếu vượt giới hạn"""
+        blob = zlib.compress(value.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, blob, len(blob), now, now)
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def stats(self):
+        """Số bản ghi và tổng dung lượng (byte, đã nén)"""
+        with self._lock:
+            count, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        return {"entries": count, "bytes": total}
+
+    def _evict(self, now):
+        # 1. Xóa bản ghi hết hạn
+        if self.ttl_seconds:
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+
+        # 2. Xóa bản ghi ít dùng nhất cho đến khi nằm trong giới hạn
+        count, total = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+
+        to_delete = []
+        rows = self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at ASC").fetchall()
+        for key, size in rows:
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            to_delete.append((key,))
+            count -= 1
+            total -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", to_delete)
+
+
+_cache_instance = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Cache dùng chung trong toàn process"""
+    global _cache_instance
+    with _cache_lock:
+        if _cache_instance is None:
+            _cache_instance = ResponseCache()
+        return _cache_instance
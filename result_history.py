@@ -0,0 +1,103 @@
+"""
+SWOT AGENT - Lưu kết quả phân tích trong session (st.session_state)
+Kết quả chỉ tồn tại trong nhánh `if st.button(...)` sẽ mất ở lượt chạy lại kế tiếp (bấm tải file,
+đổi widget bất kỳ), người dùng phải bấm phân tích lại và tốn thêm một lời gọi LLM.
+Mỗi kết quả hoàn chỉnh (dữ liệu JSON, văn bản phân tích, tham số hiển thị) được lưu vào lịch sử
+theo tab; hiển thị lại một kết quả cũ chỉ vẽ lại biểu đồ từ dữ liệu, không gọi model.
+Lịch sử có giới hạn số kết quả mỗi tab và tổng dung lượng mỗi session; kết quả cũ nhất bị bỏ trước.
+"""
+
+import os
+import json
+import time
+
+from excel_export import result_id
+
+# ============================================
+# CẤU HÌNH (có thể ghi đè bằng biến môi trường)
+# ============================================
+# Số kết quả giữ lại cho mỗi tab
+RESULT_HISTORY_PER_TAB = int(os.getenv("SWOT_RESULT_HISTORY_PER_TAB", 10))
+# Tổng dung lượng lịch sử của một session (MB, tính theo JSON của dữ liệu + văn bản)
+RESULT_HISTORY_MAX_MB = float(os.getenv("SWOT_RESULT_HISTORY_MAX_MB", 20))
+
+STATE_KEY = "_swot_result_history"
+# Định dạng thời điểm phân tích, đóng dấu một lần khi lưu kết quả (dùng khi hiển thị / xuất file)
+ANALYZED_AT_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class ResultHistory:
+    """Lịch sử kết quả theo tab, lưu trong một mapping của session (st.session_state)
+
+    Mỗi kết quả là một dict: id, tab, kind (loại phân tích), title, data, text, params
+    (tham số cần để hiển thị lại, VD: tên quán), created_at, analyzed_at, size.
+    """
+
+    def __init__(self, state, per_tab=RESULT_HISTORY_PER_TAB, max_bytes=int(RESULT_HISTORY_MAX_MB * 1024 * 1024)):
+        if STATE_KEY not in state:
+            state[STATE_KEY] = {"tabs": {}, "selected": {}}
+        self._store = state[STATE_KEY]
+        self.per_tab = per_tab
+        self.max_bytes = max_bytes
+
+    def add(self, tab, kind, title, data, text="", **params):
+        """Lưu một kết quả (mới nhất lên đầu) và chọn nó làm kết quả đang hiển thị của tab"""
+        entry = {
+            "id": result_id(kind, data, text, params),
+            "tab": tab,
+            "kind": kind,
+            "title": title,
+            "data": data,
+            "text": text,
+            "params": params,
+            "created_at": time.time(),
+        }
+        entry["analyzed_at"] = time.strftime(ANALYZED_AT_FORMAT, time.localtime(entry["created_at"]))
+        entry["size"] = len(json.dumps([data, text, params], ensure_ascii=False, default=str).encode("utf-8"))
+
+        entries = self._store["tabs"].setdefault(tab, [])
+        # Kết quả trùng (VD: lấy từ cache) chỉ được đưa lên đầu, giữ các lượt hỏi tiếp (followup_chat) của nó
+        for old in entries:
+            if old["id"] == entry["id"] and old.get("chat"):
+                entry["chat"] = old["chat"]
+                entry["size"] = old["size"]
+        entries[:] = [old for old in entries if old["id"] != entry["id"]]
+        entries.insert(0, entry)
+        del entries[self.per_tab:]
+        self._enforce_size(keep=entry)
+        self.select(tab, entry["id"])
+        return entry
+
+    def _enforce_size(self, keep):
+        """Bỏ kết quả cũ nhất (trên mọi tab) tới khi tổng dung lượng về dưới giới hạn"""
+        while self.total_bytes() > self.max_bytes:
+            candidates = [entry for entries in self._store["tabs"].values() for entry in entries if entry is not keep]
+            if not candidates:
+                return
+            oldest = min(candidates, key=lambda entry: entry["created_at"])
+            self._store["tabs"][oldest["tab"]].remove(oldest)
+
+    def entries(self, tab):
+        """Các kết quả của tab, mới nhất trước"""
+        return list(self._store["tabs"].get(tab, []))
+
+    def get(self, tab, entry_id):
+        return next((entry for entry in self._store["tabs"].get(tab, []) if entry["id"] == entry_id), None)
+
+    def select(self, tab, entry_id):
+        self._store["selected"][tab] = entry_id
+
+    def selected(self, tab):
+        """Kết quả đang chọn của tab (mặc định: mới nhất), None nếu tab chưa có kết quả"""
+        entry = self.get(tab, self._store["selected"].get(tab))
+        if entry is None:
+            entries = self._store["tabs"].get(tab)
+            entry = entries[0] if entries else None
+        return entry
+
+    def clear(self, tab):
+        self._store["tabs"].pop(tab, None)
+        self._store["selected"].pop(tab, None)
+
+    def total_bytes(self):
+        return sum(entry["size"] for entries in self._store["tabs"].values() for entry in entries)
@@ -0,0 +1,262 @@
+"""
+SWOT AGENT - Chuẩn hóa tên quán / thương hiệu
+Người dùng gõ "highlands", "Highlands Coffee", "HIGHLANDS coffee " hay "Highland" cho cùng một chuỗi;
+mỗi cách gõ tạo ra một prompt khác nên cache phản hồi không bao giờ trúng.
+Chỉ mục cục bộ (SQLite, không gọi dịch vụ mạng) ánh xạ mọi cách gõ về một tên chuẩn:
+1. Gấp chữ: bỏ dấu tiếng Việt (kể cả đ -> d), chữ thường, bỏ dấu câu, gộp khoảng trắng
+2. Phần lõi: bỏ các từ chung chung của ngành (coffee, cà phê, tea, trà sữa...) ở đầu/cuối tên
+3. So khớp mờ (difflib) phần lõi với các tên đã gặp, trên ngưỡng SWOT_SHOP_MATCH_THRESHOLD
+Tên gặp lần đầu trở thành tên chuẩn (viết hoa chữ đầu nếu người dùng gõ toàn chữ thường/hoa),
+các cách gõ sau được ghi lại làm bí danh.
+Chỉ khớp chính xác sau khi gấp chữ (bước 1) được áp dụng tự động; khớp lõi / mờ (bước 2, 3) chỉ là
+gợi ý, cần người dùng xác nhận ("Passion" gần giống "Passio" nhưng là quán khác).
+Tên chuẩn chỉ dùng để tính key cache / single-flight (key_text); prompt gửi model luôn giữ nguyên
+tên người dùng gõ.
+"""
+
+import contextlib
+import contextvars
+
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from difflib import SequenceMatcher
+
+from prompt_layout import Prompt, as_prompt
+
+# ============================================
+# CẤU HÌNH (có thể ghi đè bằng biến môi trường)
+# ============================================
+SHOP_INDEX_PATH = os.getenv("SWOT_SHOP_INDEX_PATH", os.path.join(".cache", "swot_shop_names.sqlite3"))
+# Độ giống tối thiểu (0-1) của phần lõi để coi hai tên là một
+SHOP_MATCH_THRESHOLD = float(os.getenv("SWOT_SHOP_MATCH_THRESHOLD", 0.88))
+# Tắt chuẩn hóa (giữ nguyên tên người dùng gõ)
+SHOP_CANONICALIZE = os.getenv("SWOT_SHOP_CANONICALIZE", "1") == "1"
+# Phần lõi ngắn hơn chừng này ký tự chỉ so khớp chính xác (tên ngắn dễ trùng nhầm)
+MIN_FUZZY_LENGTH = 5
+
+# Từ chung chung (đã gấp chữ) bỏ ở đầu/cuối tên khi so khớp, VD: "Highlands Coffee" ~ "Highlands",
+# "Cà phê Trung Nguyên" ~ "Trung Nguyên"; từ ở giữa tên được giữ ("The Coffee House")
+GENERIC_WORDS = {
+    "coffee", "cafe", "caphe", "ca", "phe", "tea", "tra", "sua", "milk", "milktea",
+    "quan", "tiem", "shop", "store", "and", "va",
+}
+
+# Loại tên: quán/thương hiệu được so khớp mờ, địa chỉ chi nhánh chỉ gấp chữ
+SHOP = "shop"
+LOCATION = "location"
+
+# {tên người dùng gõ: tên chuẩn} của phạm vi hiện tại (một tab / một tác vụ batch), xem key_text
+_key_names = contextvars.ContextVar("swot_shop_key_names", default=None)
+
+
+def fold_name(name):
+    """Gấp chữ để so sánh: 'Phúc Long  Coffee & Tea' -> 'phuc long coffee tea'"""
+    text = unicodedata.normalize("NFD", str(name)).replace("đ", "d").replace("Đ", "D")
+    text = "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+    text = re.sub(r"[^0-9a-z]+", " ", text.lower())
+    return " ".join(text.split())
+
+
+def core_name(folded):
+    """Phần lõi của tên đã gấp: bỏ từ chung chung ở hai đầu và chữ 's' số nhiều cuối từ
+    (giữ nguyên nếu bỏ xong không còn gì, VD: 'quan ca phe')"""
+    words = folded.split()
+    while words and words[-1] in GENERIC_WORDS:
+        words.pop()
+    while words and words[0] in GENERIC_WORDS:
+        words.pop(0)
+    if not words:
+        return folded
+    return " ".join(word[:-1] if len(word) > 3 and word.endswith("s") else word for word in words)
+
+
+def tidy_name(name):
+    """Tên hiển thị của tên gặp lần đầu: gộp khoảng trắng, viết hoa chữ đầu nếu gõ toàn thường/hoa"""
+    text = " ".join(str(name).split())
+    if text == text.lower() or text == text.upper():
+        text = text.title()
+    return text
+
+
+class ShopNameIndex:
+    """Chỉ mục bí danh -> tên chuẩn, lưu trên SQLite, dùng chung cho app.py và main.py"""
+
+    def __init__(self, path=SHOP_INDEX_PATH, threshold=SHOP_MATCH_THRESHOLD):
+        self.path = path
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        # {loại: {bí danh đã gấp: tên chuẩn}}, {loại: {phần lõi: tên chuẩn}}
+        self._aliases = {}
+        self._cores = {}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS shop_aliases (
+                kind TEXT NOT NULL,
+                alias TEXT NOT NULL,
+                canonical TEXT NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 1,
+                last_seen REAL NOT NULL,
+                PRIMARY KEY (kind, alias)
+            )
+        """)
+        self._conn.commit()
+        for kind, alias, canonical in self._conn.execute("SELECT kind, alias, canonical FROM shop_aliases"):
+            self._remember(kind, alias, canonical)
+
+    def _remember(self, kind, alias, canonical):
+        self._aliases.setdefault(kind, {})[alias] = canonical
+        self._cores.setdefault(kind, {}).setdefault(core_name(fold_name(canonical)), canonical)
+
+    def _match(self, kind, folded):
+        """(tên chuẩn đã có khớp với tên đã gấp, khớp chính xác hay không); (None, False) nếu chưa gặp"""
+        canonical = self._aliases.get(kind, {}).get(folded)
+        if canonical is not None or kind != SHOP:
+            return canonical, canonical is not None
+        cores = self._cores.get(kind, {})
+        core = core_name(folded)
+        if core in cores:
+            return cores[core], False
+        if len(core) < MIN_FUZZY_LENGTH:
+            return None, False
+        best, best_ratio = None, self.threshold
+        for known_core, known in cores.items():
+            if len(known_core) < MIN_FUZZY_LENGTH:
+                continue
+            ratio = SequenceMatcher(None, core, known_core).ratio()
+            if ratio >= best_ratio:
+                best, best_ratio = known, ratio
+        return best, False
+
+    def suggestion(self, name, kind=SHOP):
+        """Tên chuẩn gần giống (khớp lõi / mờ) cần người dùng xác nhận; None nếu khớp chính xác hoặc chưa gặp"""
+        folded = fold_name(name)
+        if not folded:
+            return None
+        with self._lock:
+            canonical, exact = self._match(kind, folded)
+        return None if exact else canonical
+
+    def canonical(self, name, kind=SHOP, accept_suggestion=False):
+        """Tên chuẩn của name (ghi nhận name làm bí danh); chuỗi rỗng giữ nguyên
+
+        Gợi ý khớp lõi / mờ chỉ được dùng khi accept_suggestion; không thì name là tên chuẩn của chính nó
+        và không được ghi nhận (lần sau vẫn hỏi lại).
+        """
+        folded = fold_name(name)
+        if not folded:
+            return " ".join(str(name).split())
+        with self._lock:
+            canonical, exact = self._match(kind, folded)
+            if canonical is not None and not exact and not accept_suggestion:
+                return tidy_name(name)
+            if canonical is None:
+                canonical = tidy_name(name)
+            self._remember(kind, folded, canonical)
+            self._conn.execute(
+                """INSERT INTO shop_aliases (kind, alias, canonical, last_seen) VALUES (?, ?, ?, ?)
+                   ON CONFLICT(kind, alias) DO UPDATE SET hits = hits + 1, last_seen = excluded.last_seen""",
+                (kind, folded, canonical, time.time())
+            )
+            self._conn.commit()
+        return canonical
+
+    def key(self, name, kind=SHOP):
+        """Key chuẩn (ổn định) của name, dùng cho cache/ID kết quả"""
+        canonical = self.canonical(name, kind)
+        return hashlib.sha256(f"{kind}:{fold_name(canonical)}".encode("utf-8")).hexdigest()[:16]
+
+    def aliases(self, kind=SHOP):
+        """{tên chuẩn: [bí danh đã gấp...]}"""
+        with self._lock:
+            grouped = {}
+            for alias, canonical in self._aliases.get(kind, {}).items():
+                grouped.setdefault(canonical, []).append(alias)
+            return grouped
+
+
+_index_instance = None
+_index_lock = threading.Lock()
+
+
+def get_shop_index():
+    """Chỉ mục tên quán dùng chung trong toàn process"""
+    global _index_instance
+    with _index_lock:
+        if _index_instance is None:
+            _index_instance = ShopNameIndex()
+        return _index_instance
+
+
+def canonical_shop_name(name, kind=SHOP, accept_suggestion=False):
+    """Tên chuẩn để tính key cache (không đưa vào prompt); trả về nguyên tên (đã gộp khoảng trắng)
+    nếu tắt SWOT_SHOP_CANONICALIZE"""
+    if not SHOP_CANONICALIZE:
+        return " ".join(str(name).split())
+    return get_shop_index().canonical(name, kind, accept_suggestion)
+
+
+def shop_name_suggestion(name, kind=SHOP):
+    """Tên gần giống đã gặp, cần người dùng xác nhận trước khi dùng chung cache; None nếu không có"""
+    if not SHOP_CANONICALIZE:
+        return None
+    return get_shop_index().suggestion(name, kind)
+
+
+# ============================================
+# KEY CACHE THEO TÊN CHUẨN
+# ============================================
+@contextlib.contextmanager
+def key_name_scope():
+    """Phạm vi ghi nhận tên người dùng gõ -> tên chuẩn (một tab / một tác vụ batch)"""
+    token = _key_names.set({})
+    try:
+        yield
+    finally:
+        _key_names.reset(token)
+
+
+def use_shop_name(name, kind=SHOP, accept_suggestion=False):
+    """Tên để đưa vào prompt: đúng tên người dùng gõ (chỉ gộp khoảng trắng)
+
+    Tên chuẩn tương ứng được ghi vào phạm vi hiện tại để key_text dùng khi tính key cache.
+    """
+    name = " ".join(str(name).split())
+    if not name:
+        return name
+    canonical = canonical_shop_name(name, kind, accept_suggestion)
+    names = _key_names.get()
+    if names is not None:
+        # Ghi cả tên đã chuẩn: danh sách tên chuẩn trong key giống nhau với mọi cách gõ
+        names[name] = canonical
+    return name
+
+
+def key_text(prompt):
+    """Văn bản dùng để tính key cache / single-flight (không dùng làm prompt)
+
+    Gồm các tên chuẩn của phạm vi hiện tại + system / context giữ nguyên + query với tên người dùng gõ
+    được thay bằng tên chuẩn (nguyên từ), để các cách gõ của cùng một quán dùng chung kết quả.
+    Dữ liệu CSV và hướng dẫn (system / context) không bị thay: tên ngắn hay chung chung ("Tea")
+    không làm hai prompt khác dữ liệu trùng key.
+    """
+    prompt = as_prompt(prompt)
+    names = _key_names.get()
+    if not names:
+        return prompt.text()
+    query = prompt.query
+    # Tên dài trước: "Highlands Coffee" không bị thay dở thành "<chuẩn> Coffee"
+    for name in sorted(names, key=len, reverse=True):
+        query = re.sub(rf"(?<!\w){re.escape(name)}(?!\w)", lambda _, name=name: names[name], query)
+    canonical = json.dumps(sorted(set(names.values())), ensure_ascii=False)
+    return "\n\n".join((f"🏪 {canonical}", Prompt(prompt.system, prompt.context, query).text()))
@@ -0,0 +1,250 @@
+"""
+SWOT AGENT - Gộp các lời gọi LLM giống nhau đang chạy (single-flight)
+Khi nhiều người (nhiều session Streamlit, nhiều luồng batch) phân tích cùng một quán cùng lúc,
+cache chưa có kết quả nên mỗi lời gọi đều tự gửi một request giống hệt nhau.
+Lời gọi đầu tiên với một key (leader) gọi backend; các lời gọi cùng key đến trong lúc đó
+(follower) không gọi backend, không xếp hàng ở limiter, mà chờ và nhận chung kết quả:
+- Chế độ stream: follower nhận lại các đoạn đã có rồi tiếp tục nhận đoạn mới ngay khi leader nhận được
+- Lỗi của leader (đã qua thử lại) được trả cho mọi follower
+- Người đọc của leader dừng giữa chừng (VD: rời trang): nếu còn follower, phần còn lại được đọc
+  tiếp ở thread nền cho họ; nếu không, lời gọi bị hủy
+Key dựa trên prompt đã chuẩn hóa khoảng trắng + model + cấu hình sinh.
+"""
+
+import threading
+
+from response_cache import make_cache_key
+
+
+class FlightAborted(Exception):
+    """Leader dừng trước khi nhận đủ phản hồi (không phải lỗi từ backend)"""
+
+
+def normalize_prompt(prompt):
+    """Prompt chỉ khác nhau ở khoảng trắng / xuống dòng được coi là một"""
+    return " ".join(prompt.split())
+
+
+def flight_key(prompt, model_name, generation_config=None):
+    return make_cache_key(normalize_prompt(prompt), model_name, generation_config)
+
+
+class _Flight:
+    """Một lời gọi đang chạy: các đoạn văn bản đã nhận + trạng thái kết thúc"""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.followers = 0
+        self.cond = threading.Condition()
+
+    def publish(self, chunk):
+        with self.cond:
+            self.chunks.append(chunk)
+            self.cond.notify_all()
+
+    def finish(self, error=None):
+        with self.cond:
+            self.done = True
+            self.error = error
+            self.cond.notify_all()
+
+
+class _Stream:
+    """Bọc generator trả cho người gọi: đóng / bị thu gom trước lần next() đầu vẫn gọi on_unstarted
+
+    Generator chưa chạy lần nào thì close() không chạy thân của nó (không vào try / finally).
+    """
+
+    def __init__(self, gen, on_unstarted):
+        self._gen = gen
+        self._on_unstarted = on_unstarted
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self._on_unstarted = None
+        return next(self._gen)
+
+    def close(self):
+        on_unstarted, self._on_unstarted = self._on_unstarted, None
+        if on_unstarted:
+            on_unstarted()
+        self._gen.close()
+
+    def __del__(self):
+        self.close()
+
+
+class SingleFlight:
+    """Bảng các lời gọi đang chạy theo key, dùng chung trong process"""
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def _join(self, key):
+        """(flight, True) nếu là leader, (flight, False) nếu đã có lời gọi cùng key đang chạy"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                self.coalesced += 1
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            return flight, True
+
+    def _finish(self, key, flight, error=None):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.finish(error)
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._flights)
+
+    # ---------- Không stream ----------
+    def run(self, key, fn, on_complete=None):
+        """Trả về (văn bản, shared); fn() chỉ được gọi nếu là leader
+
+        on_complete(text): leader gọi trước khi báo xong (VD: ghi cache), để lời gọi đến sau
+        không lọt vào khoảng giữa lúc hết "đang chạy" và lúc cache có kết quả.
+        """
+        flight, leader = self._join(key)
+        if not leader:
+            try:
+                return "".join(self._follow(flight)), True
+            except FlightAborted:
+                pass
+            finally:
+                self._leave(flight)
+            return self.run(key, fn, on_complete)
+        try:
+            text = fn()
+            flight.publish(text)
+            if on_complete:
+                on_complete(text)
+        except BaseException as e:
+            self._finish(key, flight, e)
+            raise
+        self._finish(key, flight)
+        return text, False
+
+    # ---------- Stream ----------
+    def stream(self, key, fn, on_complete=None):
+        """Trả về (iterator các đoạn văn bản, shared); fn() trả về iterator, chỉ được gọi nếu là leader
+
+        Leader và follower có thể trộn chế độ: lời gọi không stream cũng chờ được leader đang stream.
+        """
+        flight, leader = self._join(key)
+        if leader:
+            return self._lead_stream(key, flight, fn, on_complete), False
+        return _Stream(self._follow_stream(key, flight, fn, on_complete), lambda: self._leave(flight)), True
+
+    def _lead_stream(self, key, flight, fn, on_complete):
+        def chunks():
+            upstream = None
+            try:
+                # fn() trong try: lỗi ngay khi bắt đầu gọi cũng được báo cho follower
+                upstream = iter(fn())
+                for chunk in upstream:
+                    flight.publish(chunk)
+                    yield chunk
+            except GeneratorExit:
+                self._leader_left(key, flight, upstream, on_complete)
+                raise
+            except BaseException as e:
+                self._finish(key, flight, e)
+                raise
+            self._complete(key, flight, on_complete)
+
+        # Đóng trước lần next() đầu: thân generator không chạy, flight được giải phóng tại đây
+        return _Stream(chunks(), lambda: self._leader_left(key, flight, None, on_complete))
+
+    def _complete(self, key, flight, on_complete):
+        try:
+            if on_complete:
+                on_complete("".join(flight.chunks))
+        finally:
+            self._finish(key, flight)
+
+    def _leader_left(self, key, flight, upstream, on_complete):
+        """Người đọc của leader dừng giữa chừng: còn follower thì đọc tiếp ở thread nền cho họ, không thì hủy
+
+        upstream là None khi leader dừng trước khi gọi fn(): follower nhận FlightAborted và tự gọi lại.
+        """
+        with self._lock:
+            abandoned = upstream is None or flight.followers == 0
+            if abandoned and self._flights.get(key) is flight:
+                # Lời gọi đến sau sẽ bắt đầu lời gọi mới
+                del self._flights[key]
+        if abandoned:
+            flight.finish(FlightAborted("Lời gọi gốc bị dừng giữa chừng"))
+            return
+
+        def drain():
+            try:
+                for chunk in upstream:
+                    flight.publish(chunk)
+            except BaseException as e:
+                self._finish(key, flight, e)
+                return
+            self._complete(key, flight, on_complete)
+
+        threading.Thread(target=drain, name="swot-single-flight", daemon=True).start()
+
+    def _follow_stream(self, key, flight, fn, on_complete):
+        received = 0
+        try:
+            for chunk in self._follow(flight):
+                received += 1
+                yield chunk
+            return
+        except FlightAborted:
+            if received:
+                raise
+        finally:
+            self._leave(flight)
+        # Chưa nhận đoạn nào: tự gọi (hoặc theo leader mới nếu có)
+        chunks, _ = self.stream(key, fn, on_complete)
+        yield from chunks
+
+    def _leave(self, flight):
+        """Follower thôi chờ (nhận xong, lỗi hoặc dừng giữa chừng)"""
+        with self._lock:
+            flight.followers -= 1
+
+    def _follow(self, flight):
+        """Các đoạn của flight từ đầu, chờ đoạn mới tới khi leader xong; ném lại lỗi của leader"""
+        index = 0
+        while True:
+            with flight.cond:
+                while index >= len(flight.chunks) and not flight.done:
+                    flight.cond.wait()
+                chunks = flight.chunks[index:]
+                done = flight.done and index + len(chunks) >= len(flight.chunks)
+                error = flight.error
+            for chunk in chunks:
+                index += 1
+                yield chunk
+            if done:
+                if error is not None:
+                    raise error
+                return
+
+
+_flight_instance = None
+_flight_lock = threading.Lock()
+
+
+def get_single_flight():
+    """Bảng single-flight dùng chung trong toàn process"""
+    global _flight_instance
+    with _flight_lock:
+        if _flight_instance is None:
+            _flight_instance = SingleFlight()
+        return _flight_instance
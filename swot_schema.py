@@ -0,0 +1,294 @@
+"""
+SWOT AGENT - Chế độ JSON có cấu trúc
+Gemini trả về thẳng JSON theo schema (response_mime_type="application/json") thay vì
+viết bài phân tích rồi lặp lại cùng nội dung trong block ```json.
+- Schema cho từng loại phân tích
+- Parse payload (luôn là JSON hợp lệ) và chuẩn hóa điểm số
+- Dựng phần "Phân tích chi tiết" từ dữ liệu có cấu trúc, không cần AI viết lại
+"""
+
+import os
+import re
+import json
+
+# ============================================
+# CẤU HÌNH (có thể ghi đè bằng biến môi trường)
+# ============================================
+# Bật sẵn chế độ JSON (vẫn có thể đổi ở sidebar)
+JSON_MODE_DEFAULT = os.getenv("SWOT_JSON_MODE", "0") == "1"
+
+# Thay cho phần hướng dẫn format ở cuối prompt khi dùng chế độ JSON
+JSON_MODE_INSTRUCTION = """
+Trả về kết quả CHỈ dưới dạng JSON theo schema đã cho (không viết thêm văn bản).
+Điểm số là số nguyên từ 1-10. Mỗi danh sách gồm 3 ý ngắn gọn, cụ thể, dựa trên dữ liệu.
+"""
+
+SWOT_KEYS = ["strengths", "weaknesses", "opportunities", "threats"]
+
+
+# ============================================
+# SCHEMA
+# ============================================
+def _string(description):
+    return {"type": "string", "description": description}
+
+
+def _string_list(description):
+    return {"type": "array", "items": {"type": "string"}, "description": description}
+
+
+def _object(properties, required=None):
+    return {"type": "object", "properties": properties, "required": required or list(properties)}
+
+
+SCORES_SCHEMA = _object({
+    key: {"type": "integer", "description": f"Điểm {key} từ 1-10"} for key in SWOT_KEYS
+})
+SUMMARY_SCHEMA = _object({
+    "strengths": _string_list("Điểm mạnh"),
+    "weaknesses": _string_list("Điểm yếu"),
+    "opportunities": _string_list("Cơ hội"),
+    "threats": _string_list("Thách thức")
+})
+RANKING_SCHEMA = {
+    "type": "array",
+    "items": _object({
+        "rank": {"type": "integer"},
+        "name": _string("Tên quán"),
+        "total_score": {"type": "number", "description": "Điểm tổng"},
+        "note": _string("Lý do xếp hạng")
+    })
+}
+CONCLUSION_PROPERTIES = {
+    "competitive_advantages": _string_list("Lợi thế cạnh tranh của quán của tôi"),
+    "areas_to_improve": _string_list("Điểm cần cải thiện"),
+    "strategies": _string_list("Đề xuất chiến lược")
+}
+
+
+def _shop_schema(**extra):
+    return _object(dict({"name": _string("Tên quán"), "scores": SCORES_SCHEMA, "summary": SUMMARY_SCHEMA}, **extra))
+
+
+COMPARISON_SCHEMA = _object(dict({
+    "detected_shops": _string_list("Tên các quán nhận diện được"),
+    "my_shop": _shop_schema(promotions=_string_list("Ưu đãi hiện tại")),
+    "competitor": _shop_schema(promotions=_string_list("Ưu đãi hiện tại")),
+    "price_comparison": {
+        "type": "array",
+        "items": _object({
+            "product": _string("Sản phẩm"),
+            "my_price": _string("Giá quán của tôi (VNĐ)"),
+            "competitor_price": _string("Giá đối thủ (VNĐ)"),
+            "difference": _string("Chênh lệch"),
+            "note": _string("Ghi chú")
+        })
+    },
+    "discount_comparison": _object({
+        "my_shop_discounts": _string_list("Giảm giá của quán của tôi"),
+        "competitor_discounts": _string_list("Giảm giá của đối thủ"),
+        "discount_analysis": _string("Phân tích chênh lệch giảm giá")
+    })
+}, **CONCLUSION_PROPERTIES))
+
+MULTI_COMPARISON_SCHEMA = _object(dict({
+    "detected_shops": _string_list("Tên các quán nhận diện được"),
+    "my_shop": _shop_schema(),
+    "competitors": {"type": "array", "items": _shop_schema()},
+    "ranking": RANKING_SCHEMA
+}, **CONCLUSION_PROPERTIES))
+
+# Loại phân tích -> schema của payload
+ANALYSIS_SCHEMAS = {
+    "swot": _object({
+        "shop_name": _string("Tên quán"),
+        "scores": SCORES_SCHEMA,
+        "summary": SUMMARY_SCHEMA,
+        "strategies": _string_list("Đề xuất chiến lược")
+    }),
+    "comparison": COMPARISON_SCHEMA,
+    "multi_comparison": MULTI_COMPARISON_SCHEMA,
+    "single_shop": _shop_schema(),
+    "merge": _object(dict({
+        "my_shop_index": {"type": "integer", "description": "Vị trí (index) của quán của tôi trong danh sách"},
+        "ranking": RANKING_SCHEMA
+    }, **CONCLUSION_PROPERTIES)),
+    "branch": _object({
+        "brand_name": _string("Tên thương hiệu"),
+        "branch_location": _string("Địa chỉ chi nhánh"),
+        "scores": SCORES_SCHEMA,
+        "location_analysis": _object({
+            "area_characteristics": _string("Đặc điểm khu vực"),
+            "target_customers": _string("Khách hàng mục tiêu tại đây"),
+            "nearby_competitors": _string_list("Đối thủ gần đó"),
+            "traffic_level": _string("Mức độ giao thông")
+        }),
+        "summary": SUMMARY_SCHEMA,
+        "local_strategies": _string_list("Chiến lược cho chi nhánh")
+    })
+}
+
+
+def json_generation_config(analysis_type):
+    """generation_config cho chế độ JSON của một loại phân tích"""
+    return {
+        "response_mime_type": "application/json",
+        "response_schema": ANALYSIS_SCHEMAS[analysis_type]
+    }
+
+
+# ============================================
+# PARSE
+# ============================================
+def _clamp_scores(value):
+    """Đưa mọi "scores" trong payload về số nguyên 1-10 (schema không ràng buộc được khoảng)"""
+    if isinstance(value, list):
+        for item in value:
+            _clamp_scores(item)
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            if key == "scores" and isinstance(item, dict):
+                for score_key, score in item.items():
+                    if isinstance(score, (int, float)):
+                        item[score_key] = min(10, max(1, int(round(score))))
+            else:
+                _clamp_scores(item)
+
+
+def parse_json_response(response_text):
+    """Parse payload của chế độ JSON; lỗi (VD: phản hồi bị cắt) được ném ra, không dùng điểm giả"""
+    text = response_text.strip()
+    if text.startswith("```"):
+        # Phòng trường hợp model vẫn bọc JSON trong code block
+        text = text.strip("`").removeprefix("json").strip()
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Phản hồi JSON không hợp lệ: {e}") from e
+    if not isinstance(data, dict):
+        raise ValueError("Phản hồi JSON không phải object")
+    _clamp_scores(data)
+    return data
+
+
+def parse_json_block(response_text):
+    """Parse block ```json ở cuối bài viết (chế độ thường); không có hoặc hỏng thì ném ValueError
+
+    Dùng khi kết quả được lưu / xếp hạng / gộp tiếp: không thay bằng điểm mẫu như khi chỉ vẽ biểu đồ.
+    """
+    json_match = re.search(r'```json\s*(.*?)\s*```', response_text, re.DOTALL)
+    if not json_match:
+        raise ValueError("Phản hồi không có block JSON")
+    return parse_json_response(json_match.group(1))
+
+
+# ============================================
+# DỰNG PHẦN PHÂN TÍCH CHI TIẾT
+# ============================================
+SWOT_HEADINGS = {
+    "strengths": "📗 STRENGTHS (Điểm mạnh)",
+    "weaknesses": "📕 WEAKNESSES (Điểm yếu)",
+    "opportunities": "📘 OPPORTUNITIES (Cơ hội)",
+    "threats": "📙 THREATS (Thách thức)"
+}
+
+
+def _bullets(items):
+    return [f"- {item}" for item in items or []]
+
+
+def _swot_lines(shop):
+    lines = []
+    scores = shop.get("scores", {})
+    summary = shop.get("summary", {})
+    for key in SWOT_KEYS:
+        score = f" — {scores[key]}/10" if key in scores else ""
+        lines.append(f"**{SWOT_HEADINGS[key]}{score}**")
+        lines.extend(_bullets(summary.get(key)))
+        lines.append("")
+    return lines
+
+
+def _conclusion_lines(data):
+    # Dòng trống giữa các mục để markdown không nối đoạn sau vào danh sách trước
+    lines = ["## ⚔️ SO SÁNH & KẾT LUẬN:", "**Lợi thế cạnh tranh:**"]
+    lines.extend(_bullets(data.get("competitive_advantages")))
+    lines.extend(["", "**Điểm cần cải thiện:**"])
+    lines.extend(_bullets(data.get("areas_to_improve")))
+    lines.extend(["", "**💡 Đề xuất chiến lược:**"])
+    lines.extend(f"{i}. {strategy}" for i, strategy in enumerate(data.get("strategies", []), 1))
+    return lines
+
+
+def render_analysis_markdown(analysis_type, data):
+    """Văn bản "Phân tích chi tiết" dựng từ payload JSON (thay cho bài viết của AI)"""
+    lines = []
+    if analysis_type in ("swot", "single_shop"):
+        lines.extend(_swot_lines(data))
+        if data.get("strategies"):
+            lines.append("**💡 ĐỀ XUẤT CHIẾN LƯỢC:**")
+            lines.extend(f"{i}. {strategy}" for i, strategy in enumerate(data["strategies"], 1))
+
+    elif analysis_type == "branch":
+        location = data.get("location_analysis", {})
+        lines.extend([
+            "**📍 PHÂN TÍCH VỊ TRÍ:**",
+            f"- Đặc điểm khu vực: {location.get('area_characteristics', '')}",
+            f"- Khách hàng mục tiêu: {location.get('target_customers', '')}",
+            f"- Đối thủ gần đó: {', '.join(location.get('nearby_competitors', []))}",
+            f"- Mức độ giao thông: {location.get('traffic_level', '')}",
+            ""
+        ])
+        lines.extend(_swot_lines(data))
+        lines.append("**💡 ĐỀ XUẤT CHIẾN LƯỢC CHO CHI NHÁNH:**")
+        lines.extend(f"{i}. {strategy}" for i, strategy in enumerate(data.get("local_strategies", []), 1))
+
+    elif analysis_type == "comparison":
+        for key in ("my_shop", "competitor"):
+            shop = data.get(key, {})
+            lines.append(f"## {'🏪' if key == 'my_shop' else '🎯'} PHÂN TÍCH {shop.get('name', '')}:")
+            lines.extend(_swot_lines(shop))
+            if shop.get("promotions"):
+                lines.append("**💰 ƯU ĐÃI HIỆN TẠI:**")
+                lines.extend(_bullets(shop["promotions"]))
+                lines.append("")
+        if data.get("price_comparison"):
+            lines.extend([
+                "## 💵 SO SÁNH GIÁ SẢN PHẨM:",
+                "| Sản phẩm | Quán của bạn | Đối thủ | Chênh lệch | Ghi chú |",
+                "|----------|--------------|---------|------------|---------|"
+            ])
+            lines.extend(
+                f"| {row.get('product', '')} | {row.get('my_price', '')} | {row.get('competitor_price', '')} "
+                f"| {row.get('difference', '')} | {row.get('note', '')} |"
+                for row in data["price_comparison"]
+            )
+            lines.append("")
+        discounts = data.get("discount_comparison", {})
+        if discounts:
+            lines.append("## 🎁 SO SÁNH KHUYẾN MÃI & GIẢM GIÁ:")
+            lines.append(f"- Ưu đãi của bạn: {', '.join(discounts.get('my_shop_discounts', []))}")
+            lines.append(f"- Ưu đãi đối thủ: {', '.join(discounts.get('competitor_discounts', []))}")
+            lines.append(f"- Phân tích chênh lệch: {discounts.get('discount_analysis', '')}")
+            lines.append("")
+        lines.extend(_conclusion_lines(data))
+
+    elif analysis_type in ("multi_comparison", "merge"):
+        shops = [data["my_shop"]] if data.get("my_shop") else []
+        for i, shop in enumerate(shops + data.get("competitors", [])):
+            lines.append(f"## {'🏪' if i == 0 else '🎯'} PHÂN TÍCH {shop.get('name', '')}:")
+            lines.extend(_swot_lines(shop))
+        if data.get("ranking"):
+            lines.extend([
+                "## 🏆 BẢNG XẾP HẠNG:",
+                "| Hạng | Quán | Điểm tổng | Ghi chú |",
+                "|------|------|-----------|---------|"
+            ])
+            lines.extend(
+                f"| {row.get('rank', '')} | {row.get('name', '')} | {row.get('total_score', '')} | {row.get('note', '')} |"
+                for row in data["ranking"]
+            )
+            lines.append("")
+        lines.extend(_conclusion_lines(data))
+
+    return "\n".join(lines).strip()
@@ -0,0 +1,89 @@
+import threading
+import time
+
+import pytest
+
+from context_cache import EXPIRY_MARGIN_SECONDS, ContextCache
+from llm_backend import FakeBackend
+from prompt_layout import Prompt
+
+CONTEXT = "ten,gia\n" + "tra sua,30000\n" * 400
+
+
+@pytest.fixture
+def backend():
+    return FakeBackend(latency_seconds=0, chunk_delay_seconds=0)
+
+
+def _prompt(query="quán A", context=CONTEXT):
+    return Prompt("system", context, query)
+
+
+def test_large_context_is_registered_once_and_reused(backend):
+    cache = ContextCache(enabled=True, min_tokens=100)
+    first = cache.prepare(backend, _prompt("quán A"))
+    second = cache.prepare(backend, _prompt("quán B"))
+    assert first.cached_content and first.cached_content == second.cached_content
+    assert second.sent_text() == "quán B"
+    assert (cache.created, cache.reused, backend.contexts_created) == (1, 1, 1)
+    # Cùng nội dung đầy đủ với prompt gốc: phản hồi không đổi
+    assert backend.generate(second) == backend.generate(_prompt("quán B"))
+
+
+def test_prompt_is_sent_as_is_when_disabled_or_context_small(backend):
+    assert ContextCache(enabled=False, min_tokens=100).prepare(backend, _prompt()).cached_content is None
+    assert ContextCache(enabled=True, min_tokens=10 ** 6).prepare(backend, _prompt()).cached_content is None
+    assert ContextCache(enabled=True, min_tokens=0).prepare(backend, "chuỗi thường").cached_content is None
+    assert backend.contexts_created == 0
+
+
+def test_registration_failure_falls_back_and_is_not_retried_until_ttl(backend, monkeypatch):
+    attempts = []
+
+    def reject(system, context, ttl_seconds):
+        attempts.append(1)
+        raise RuntimeError("context dưới ngưỡng của provider")
+
+    monkeypatch.setattr(backend, "create_context_cache", reject)
+    cache = ContextCache(enabled=True, min_tokens=100, ttl_seconds=EXPIRY_MARGIN_SECONDS + 10)
+    for query in ("quán A", "quán B"):
+        prompt = cache.prepare(backend, _prompt(query))
+        assert prompt.cached_content is None and prompt.sent_text() == _prompt(query).text()
+    assert (len(attempts), cache.failed, cache.created) == (1, 1, 0)
+
+    # Hết hạn chờ: thử đăng ký lại
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 11)
+    cache.prepare(backend, _prompt())
+    assert len(attempts) == 2
+
+
+def test_handle_expires_before_provider_ttl(backend, monkeypatch):
+    cache = ContextCache(enabled=True, min_tokens=100, ttl_seconds=EXPIRY_MARGIN_SECONDS + 10)
+    handle = cache.prepare(backend, _prompt()).cached_content
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 11)
+    # Chỉ đọc (register=False): handle cũ đã hết hạn, không đăng ký mới
+    assert cache.prepare(backend, _prompt(), register=False).cached_content is None
+    assert cache.prepare(backend, _prompt()).cached_content == handle
+    assert backend.contexts_created == 2
+
+
+def test_concurrent_calls_register_context_once(backend, monkeypatch):
+    real_create = backend.create_context_cache
+
+    def slow_create(*args):
+        time.sleep(0.05)
+        return real_create(*args)
+
+    monkeypatch.setattr(backend, "create_context_cache", slow_create)
+    cache = ContextCache(enabled=True, min_tokens=100)
+    handles = []
+    threads = [threading.Thread(target=lambda: handles.append(cache.prepare(backend, _prompt()).cached_content))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(handles)) == 1 and handles[0]
+    assert backend.contexts_created == 1
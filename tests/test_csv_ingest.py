@@ -0,0 +1,124 @@
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import csv_ingest
+from csv_ingest import (ParsedCSVCache, content_hash, csv_row_count, file_content_hash, load_csv_files,
+                        stream_profile_csv, stream_sample_frame)
+from csv_summary import profile_dataframe
+
+
+def _csv(name, rows=20):
+    return ("ten,gia\n" + "".join(f"{name} {i},{20000 + i}\n" for i in range(rows))).encode("utf-8")
+
+
+def test_parsed_csv_cache_parses_same_content_once(monkeypatch):
+    cache = ParsedCSVCache()
+    parsed = []
+    real_read_csv = csv_ingest.pd.read_csv
+    monkeypatch.setattr(csv_ingest.pd, "read_csv", lambda *args, **kwargs: parsed.append(1) or real_read_csv(*args, **kwargs))
+    first = cache.get_or_parse(_csv("tra sua"))
+    # Cùng nội dung (VD: upload lại cùng file ở session khác): dùng lại DataFrame đã parse
+    assert cache.get_or_parse(_csv("tra sua")) is first
+    assert len(parsed) == 1
+    cache.get_or_parse(_csv("ca phe"))
+    assert len(parsed) == 2
+
+
+def test_parsed_csv_cache_evicts_least_recently_used():
+    a, b, c = _csv("a"), _csv("b"), _csv("c")
+    size = int(ParsedCSVCache().get_or_parse(a).memory_usage(deep=True).sum())
+    cache = ParsedCSVCache(max_bytes=2 * size)
+    df_a = cache.get_or_parse(a)
+    cache.get_or_parse(b)
+    # Đọc lại a: b trở thành bản ghi ít dùng nhất
+    assert cache.get_or_parse(a) is df_a
+    cache.get_or_parse(c)
+    assert cache.stats() == {"entries": 2, "bytes": 2 * size}
+    assert cache.get_or_parse(a) is df_a
+    assert content_hash(b) not in cache._entries
+
+
+def test_parsed_csv_cache_skips_frames_larger_than_limit():
+    cache = ParsedCSVCache(max_bytes=10)
+    assert len(cache.get_or_parse(_csv("a"))) == 20
+    assert cache.stats() == {"entries": 0, "bytes": 0}
+
+
+def test_file_hash_reads_in_blocks_and_is_memoized(tmp_path, monkeypatch):
+    monkeypatch.setattr(csv_ingest, "HASH_BLOCK_BYTES", 7)
+    path = tmp_path / "menu.csv"
+    path.write_bytes(b"ten,gia\n" + b"ca phe,20000\n" * 100)
+    assert file_content_hash(str(path)) == content_hash(path.read_bytes())
+
+    opened = []
+    real_open = open
+    monkeypatch.setattr("builtins.open", lambda *args, **kwargs: opened.append(args) or real_open(*args, **kwargs))
+    file_content_hash(str(path))
+    assert opened == []
+
+    # Nội dung đổi (mtime / kích thước đổi): hash lại
+    monkeypatch.undo()
+    path.write_bytes(b"ten,gia\nbanh mi,15000\n")
+    assert file_content_hash(str(path)) == content_hash(path.read_bytes())
+
+
+def _menu_csv(rows=5000):
+    rng = np.random.default_rng(1)
+    df = pd.DataFrame({
+        "stt": range(rows),
+        "ten_mon": [f"Món {i % 37}" for i in range(rows)],
+        "loai": rng.choice(["Trà", "Cà phê", "Bánh", None], rows),
+        "gia": rng.integers(15000, 80000, rows).astype(float),
+        "danh_gia": rng.uniform(1, 5, rows).round(1),
+    })
+    df.loc[::97, "gia"] = np.nan
+    return df.to_csv(index=False)
+
+
+def test_streaming_profile_matches_full_load():
+    text = _menu_csv()
+    full = profile_dataframe(pd.read_csv(StringIO(text)))
+    streamed, sample = stream_profile_csv(StringIO(text), chunk_rows=700, reservoir_rows=300)
+
+    assert streamed["rows"] == full["rows"] == 5000
+    assert streamed["columns"] == full["columns"]
+    assert streamed["numeric"].keys() == full["numeric"].keys()
+    for col, stats in full["numeric"].items():
+        for name in ("min", "max", "mean"):
+            assert streamed["numeric"][col][name] == pytest.approx(stats[name])
+        assert streamed["numeric"][col]["missing"] == stats["missing"]
+    for col, stats in full["categorical"].items():
+        # Ít giá trị khác nhau hơn kích thước sketch: đếm chính xác
+        assert streamed["categorical"][col]["unique"] == stats["unique"]
+        assert streamed["categorical"][col]["missing"] == stats["missing"]
+        assert dict(streamed["categorical"][col]["top"]) == dict(stats["top"])
+    # Mẫu ngẫu nhiên: đúng kích thước, không trùng dòng, lấy từ khắp file
+    assert len(sample) == 300 and sample["stt"].is_unique
+    assert sample["stt"].max() >= 700
+
+
+def test_stream_sample_frame_keeps_real_row_count():
+    df = stream_sample_frame(StringIO(_menu_csv()), chunk_rows=1000)
+    assert len(df) == csv_ingest.RESERVOIR_ROWS
+    assert csv_row_count(df) == 5000
+
+
+@pytest.mark.parametrize("max_workers", [1, 4])
+def test_load_csv_files_keeps_order_and_reports_errors_per_file(tmp_path, max_workers):
+    paths = []
+    for i in range(6):
+        path = tmp_path / f"quan_{i}.csv"
+        path.write_bytes(_csv(f"quan {i}", rows=i + 1))
+        paths.append(str(path))
+    (tmp_path / "quan_2.csv").write_bytes(b"")
+    paths.insert(4, str(tmp_path / "khong_co.csv"))
+
+    results = load_csv_files(paths, max_workers=max_workers)
+    assert [path for path, _, _ in results] == paths
+    failed = [i for i, (_, df, error) in enumerate(results) if error is not None]
+    assert failed == [2, 4]
+    assert all(results[i][1] is None for i in failed)
+    assert [len(df) for _, df, error in results if error is None] == [1, 2, 4, 5, 6]
@@ -0,0 +1,27 @@
+import pandas as pd
+
+from csv_summary import summarize_dataframe
+
+
+def _menu(rows):
+    return pd.DataFrame({
+        "Tên món": [f"Món {i}" for i in range(rows)],
+        "Giá": [20000 + (i % 40) * 1000 for i in range(rows)],
+    })
+
+
+def test_summary_counts_real_tokens_once():
+    calls = []
+
+    def count_tokens(text):
+        calls.append(text)
+        return 1
+
+    text = summarize_dataframe(_menu(3000), token_budget=500, count_tokens=count_tokens)
+    assert calls == [text]
+
+
+def test_summary_truncated_when_real_count_over_budget():
+    text = summarize_dataframe(_menu(50), token_budget=2000, count_tokens=lambda text: 4000)
+    assert text.endswith("(đã rút gọn cho vừa ngân sách)\n")
+    assert len(text) < len(summarize_dataframe(_menu(50), token_budget=2000))
@@ -0,0 +1,60 @@
+import pytest
+
+import llm_client
+from context_cache import ContextCache
+from followup_chat import FollowupChat
+from llm_backend import FakeBackend
+from response_cache import ResponseCache
+
+
+@pytest.fixture
+def context_cache(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite3"))
+    monkeypatch.setattr(llm_client, "get_response_cache", lambda: cache)
+    # SWOT_CONTEXT_CACHE tắt: phiên hỏi đáp vẫn đăng ký ngữ cảnh của kết quả
+    context_cache = ContextCache(enabled=False)
+    monkeypatch.setattr(llm_client, "get_context_cache", lambda: context_cache)
+    return context_cache
+
+
+def _entry():
+    data = {"scores": {"strengths": 7}, "items": [{"name": f"Món {i}", "price": 30000 + i} for i in range(50)]}
+    return {"tab": "compare", "id": 1, "title": "A vs B", "data": data, "text": "Phân tích chi tiết. " * 200}
+
+
+def test_result_context_is_registered_once_per_entry(context_cache):
+    backend = FakeBackend(latency_seconds=0, chunk_delay_seconds=0)
+    chat = FollowupChat(_entry())
+    for question in ("Vì sao giá cao hơn?", "Nên giảm giá món nào?"):
+        prompt = chat.prompt(question)
+        answer = "".join(llm_client.stream_llm(backend, prompt))
+        sent = context_cache.prepare(backend, prompt, register=False).sent_text()
+        chat.record(question, answer, sent, prompt.text(), 0.0)
+
+    assert backend.contexts_created == 1
+    assert (context_cache.created, context_cache.reused) == (1, 1)
+    # Chỉ lịch sử + câu hỏi được gửi, không gửi lại kết quả
+    for turn in chat.turns:
+        assert turn["sent_tokens"] * 2 < turn["prompt_tokens"]
+
+
+def test_registration_failure_falls_back_to_full_context(context_cache, monkeypatch):
+    backend = FakeBackend(latency_seconds=0, chunk_delay_seconds=0)
+
+    def reject(system, context, ttl_seconds):
+        raise RuntimeError("context quá nhỏ")
+
+    monkeypatch.setattr(backend, "create_context_cache", reject)
+    chat = FollowupChat(_entry())
+    prompt = chat.prompt("Vì sao giá cao hơn?")
+    assert "".join(llm_client.stream_llm(backend, prompt))
+    assert context_cache.prepare(backend, prompt).sent_text() == prompt.text()
+    # Thất bại được nhớ tới hết TTL: không thử đăng ký lại mỗi câu hỏi
+    assert context_cache.failed == 1
+
+
+def test_chat_context_cache_can_be_disabled(context_cache):
+    backend = FakeBackend(latency_seconds=0, chunk_delay_seconds=0)
+    prompt = FollowupChat(_entry(), cache_context=False).prompt("Vì sao giá cao hơn?")
+    assert context_cache.prepare(backend, prompt).cached_content is None
+    assert backend.contexts_created == 0
@@ -0,0 +1,59 @@
+import pandas as pd
+
+from incremental import (
+    FULL, KEEP_SECTION, UNCHANGED, UPDATE, SnapshotStore, diff_snapshots, file_snapshot, merge_sections,
+    plan_incremental,
+)
+
+
+def _menu(rows=20):
+    return pd.DataFrame({
+        "Tên món": [f"Món {i}" for i in range(rows)],
+        "Giá": [20000 + i * 1000 for i in range(rows)],
+    })
+
+
+def test_diff_by_key_column():
+    old = _menu()
+    new = old.copy()
+    new.loc[3, "Giá"] = 99000
+    new = pd.concat([new.drop(index=[5]), pd.DataFrame({"Tên món": ["Trà đào"], "Giá": [45000]})],
+                    ignore_index=True)
+
+    diff = diff_snapshots(file_snapshot(old), file_snapshot(new))
+    assert diff["changed"] == [{"key": "Món 3", "changes": {"Giá": [23000, 99000]}}]
+    assert diff["added"] == [["Trà đào", 45000]]
+    assert diff["removed"] == [["Món 5", 25000]]
+    assert diff_snapshots(file_snapshot(old), file_snapshot(old.rename(columns={"Giá": "Price"}))) is None
+
+
+def test_plan_modes_follow_the_committed_snapshot(tmp_path):
+    store = SnapshotStore(str(tmp_path / "snapshots.sqlite3"))
+    menu = _menu()
+
+    plan = plan_incremental("swot", "Quán A", [("menu.csv", menu)], store=store)
+    assert plan.mode == FULL
+    # Chưa commit (VD: phản hồi không có JSON hợp lệ): lần sau vẫn phân tích đầy đủ
+    assert plan_incremental("swot", "Quán A", [("menu.csv", menu)], store=store).mode == FULL
+    plan.commit({"scores": {}}, "bài cũ")
+
+    plan = plan_incremental("swot", "Quán A", [("menu.csv", menu.copy())], store=store)
+    assert plan.mode == UNCHANGED
+    assert plan.previous == {"data": {"scores": {}}, "text": "bài cũ"}
+
+    changed = menu.copy()
+    changed.loc[0, "Giá"] = 15000
+    plan = plan_incremental("swot", "Quán A", [("menu.csv", changed)], store=store)
+    assert plan.mode == UPDATE and plan.describe().startswith("1 giá đổi")
+
+    changed["Giá"] = changed["Giá"] * 2
+    assert plan_incremental("swot", "Quán A", [("menu.csv", changed)], store=store).mode == FULL
+
+
+def test_merge_keeps_unaffected_sections():
+    markers = ["📗", "📕"]
+    previous = "Mở đầu\n📗 STRENGTHS:\n- mạnh cũ\n📕 WEAKNESSES:\n- yếu cũ\n"
+    answer = f"📗 STRENGTHS:\n{KEEP_SECTION}\n📕 WEAKNESSES:\n- yếu mới\n"
+    assert merge_sections(previous, answer, markers) == (
+        "Mở đầu\n📗 STRENGTHS:\n- mạnh cũ\n📕 WEAKNESSES:\n- yếu mới\n"
+    )
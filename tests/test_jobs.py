@@ -0,0 +1,68 @@
+import threading
+
+from jobs import CANCELLED, DONE, ERROR, JobManager
+from metrics import current_labels, metrics_context
+
+
+def _wait(job, timeout=5):
+    job._future.result(timeout=timeout)
+
+
+def test_job_result_progress_and_context():
+    manager = JobManager(max_workers=2)
+
+    def work(job, value):
+        job.set_progress(0.5, "Đang phân tích")
+        return value, current_labels()["tab"]
+
+    with metrics_context(tab="competitor"):
+        job = manager.submit("A vs B", work, 7, tab="competitor")
+    _wait(job)
+    assert (job.status, job.progress, job.result) == (DONE, 1.0, (7, "competitor"))
+    assert job.message == "Đang phân tích"
+    assert manager.get(job.id) is job
+
+
+def test_job_error_is_recorded():
+    manager = JobManager(max_workers=1)
+
+    def fail(job):
+        raise ValueError("Phản hồi không có block JSON")
+
+    job = manager.submit("lỗi", fail)
+    _wait(job)
+    assert (job.status, job.error, job.result) == (ERROR, "Phản hồi không có block JSON", None)
+    assert job.finished and job.finished_at is not None
+
+
+def test_only_queued_jobs_can_be_cancelled():
+    manager = JobManager(max_workers=1)
+    started, release = threading.Event(), threading.Event()
+
+    def block(job):
+        started.set()
+        release.wait(5)
+        return "xong"
+
+    running = manager.submit("đang chạy", block)
+    queued = manager.submit("xếp hàng", lambda job: "không chạy")
+    assert started.wait(5)
+    assert manager.cancel(running.id) is False
+    assert manager.cancel(queued.id) is True
+    assert manager.cancel("khong-co") is False
+
+    release.set()
+    _wait(running)
+    assert running.status == DONE
+    assert (queued.status, queued.result) == (CANCELLED, None)
+
+
+def test_finished_jobs_expire_after_ttl():
+    manager = JobManager(max_workers=1, ttl_seconds=60)
+    job = manager.submit("xong", lambda job: 1)
+    _wait(job)
+    job.finished_at -= 59
+    assert manager.get(job.id) is job
+    job.finished_at -= 2
+    assert manager.get(job.id) is None
+    assert manager.jobs() == []
@@ -0,0 +1,27 @@
+import json
+
+from json_stream import IncrementalJSONParser, assign_path
+
+
+def test_events_match_payload_whatever_the_chunking():
+    payload = {
+        "scores": {"strengths": 8, "threats": 3.5},
+        "summary": {"strengths": ["Giá \"tốt\"", "Vị trí\\n đẹp"]},
+        "flags": [True, None, -1e3],
+    }
+    text = json.dumps(payload, ensure_ascii=False)
+    for size in (1, 3, 7, len(text)):
+        parser = IncrementalJSONParser()
+        events = [event for i in range(0, len(text), size) for event in parser.feed(text[i:i + size])]
+        assert events[-1] == ((), payload)
+        assert (("scores",), payload["scores"]) in events
+        assert (("summary", "strengths", 1), "Vị trí\\n đẹp") in events
+        assert parser.text == text
+
+
+def test_partial_result_built_from_events():
+    parser = IncrementalJSONParser()
+    partial = {}
+    for path, value in parser.feed('{"scores": {"strengths": 7}, "summary": {"threats": ["A"'):
+        partial = assign_path(partial, path, value)
+    assert partial == {"scores": {"strengths": 7}, "summary": {"threats": ["A"]}}
@@ -0,0 +1,73 @@
+import pytest
+
+from llm_backend import FakeBackend, LLMBackendError, OpenAICompatibleBackend, create_llm_backend
+from prompt_layout import Prompt
+from swot_schema import ANALYSIS_SCHEMAS, json_generation_config, parse_json_block, parse_json_response
+
+
+def _fake(**kwargs):
+    return FakeBackend(latency_seconds=0, chunk_delay_seconds=0, **kwargs)
+
+
+def test_fake_response_is_deterministic_and_stream_matches_generate():
+    backend = _fake()
+    text = backend.generate("Phân tích quán A")
+    assert backend.generate("Phân tích quán A") == text
+    assert "".join(backend.stream("Phân tích quán A")) == text
+    assert backend.generate("Phân tích quán B") != text
+    # Chế độ văn bản: block JSON đọc được bởi mọi hàm extract_*
+    assert set(ANALYSIS_SCHEMAS["swot"]["required"]) <= parse_json_block(text).keys()
+
+
+def test_fake_json_mode_matches_schema():
+    data = parse_json_response(_fake().generate("Phân tích quán A", json_generation_config("comparison")))
+    assert set(ANALYSIS_SCHEMAS["comparison"]["required"]) <= data.keys()
+
+
+def test_fake_cached_content_sends_less_and_answers_the_same():
+    backend = _fake()
+    prompt = Prompt("system", "dữ liệu CSV " * 500, "quán A")
+    full = backend.generate(prompt)
+    full_tokens = backend.sent_tokens
+
+    handle = backend.create_context_cache(prompt.system, prompt.context, 60)
+    assert backend.generate(prompt.with_cached_content(handle)) == full
+    assert backend.sent_tokens - full_tokens < full_tokens / 10
+
+    with pytest.raises(LLMBackendError) as error:
+        backend.generate(prompt.with_cached_content("cachedContents/khong-co"))
+    assert error.value.code == 404
+
+
+def test_fake_errors_and_timeouts():
+    with pytest.raises(LLMBackendError) as error:
+        _fake(error_rate=1).generate("quán A")
+    assert error.value.code in (429, 503)
+
+    with pytest.raises(TimeoutError):
+        FakeBackend(latency_seconds=0.05).generate("quán A", timeout=0.01)
+
+
+def test_openai_payload_maps_prompt_parts_and_config():
+    backend = OpenAICompatibleBackend(base_url="http://localhost:8000/v1/", model_name="m")
+    payload = backend._payload(
+        Prompt("system", "context", "query"),
+        {"temperature": 0.2, "max_output_tokens": 100, **json_generation_config("swot")},
+        stream=True
+    )
+    assert backend.base_url == "http://localhost:8000/v1"
+    assert payload["messages"] == [
+        {"role": "system", "content": "system"},
+        {"role": "user", "content": "context\n\nquery"}
+    ]
+    assert (payload["temperature"], payload["max_tokens"], payload["stream"]) == (0.2, 100, True)
+    assert payload["response_format"]["json_schema"]["schema"] == ANALYSIS_SCHEMAS["swot"]
+
+    # Chuỗi thường: chỉ có lượt người dùng
+    assert backend._payload("câu hỏi", None, stream=False)["messages"] == [{"role": "user", "content": "câu hỏi"}]
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        create_llm_backend("khong-co")
+    assert isinstance(create_llm_backend("fake"), FakeBackend)
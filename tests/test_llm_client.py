@@ -0,0 +1,38 @@
+import pytest
+
+import llm_client
+from llm_backend import FakeBackend
+from response_cache import ResponseCache
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite3"))
+    monkeypatch.setattr(llm_client, "get_response_cache", lambda: cache)
+    return cache
+
+
+def test_second_call_is_served_from_cache(cache):
+    backend = FakeBackend(latency_seconds=0, chunk_delay_seconds=0)
+    first = llm_client.call_llm(backend, "Phân tích quán A")
+    assert llm_client.call_llm(backend, "Phân tích quán A") == first
+    assert "".join(llm_client.call_llm(backend, "Phân tích quán A", stream=True)) == first
+    assert backend.requests == 1
+
+    # Bỏ qua cache: gọi lại backend và làm mới cache
+    llm_client.call_llm(backend, "Phân tích quán A", use_cache=False)
+    assert backend.requests == 2
+
+
+def test_stream_result_is_cached_for_non_stream_call(cache):
+    backend = FakeBackend(latency_seconds=0, chunk_delay_seconds=0)
+    streamed = "".join(llm_client.stream_llm(backend, "Phân tích quán B"))
+    assert llm_client.call_llm(backend, "Phân tích quán B") == streamed
+    assert backend.requests == 1
+
+
+def test_count_tokens_is_cached(cache):
+    backend = FakeBackend(latency_seconds=0, chunk_delay_seconds=0)
+    tokens = llm_client.count_tokens(backend, "một đoạn văn bản")
+    assert tokens > 0
+    assert llm_client.count_tokens(backend, "một đoạn văn bản") == tokens
@@ -0,0 +1,59 @@
+import pytest
+
+from metrics import MetricsRegistry, current_labels, metrics_context, quantile, track_mode
+
+
+def test_quantile_interpolates_sorted_values():
+    assert quantile([1, 2, 3, 4], 0.5) == 2.5
+    assert quantile([1, 2, 3, 4], 0.99) == pytest.approx(3.97)
+    assert quantile([5], 0.95) == 5
+
+
+def test_labels_follow_context_and_track_mode():
+    @track_mode("swot")
+    def analyze():
+        return current_labels()
+
+    with metrics_context(tab="name"):
+        assert analyze() == {"tab": "name", "mode": "swot"}
+    assert current_labels() == {"tab": "-", "mode": "-"}
+
+
+def test_summary_table_groups_calls_by_labels():
+    registry = MetricsRegistry(window=10, export_path="")
+    for latency in (0.1, 0.2, 0.3):
+        registry.record({"tab": "name", "mode": "swot", "backend": "fake"}, 100, 25, 50, latency, latency / 2)
+    registry.record({"tab": "name", "mode": "comparison", "backend": "fake"}, 40, 10, 0, 0.5, None,
+                    cache_hit=True)
+
+    (row,) = registry.summary_table(("tab",))
+    assert row["tab"] == "name" and row["calls"] == 4
+    assert row["cache_hit_rate"] == 0.25
+    assert row["latency_p50"] == pytest.approx(0.25)
+    assert [r["mode"] for r in registry.summary_table(("tab", "mode"))] == ["comparison", "swot"]
+
+
+def test_call_recorder_counts_sent_prompt_and_finishes_once():
+    registry = MetricsRegistry(export_path="")
+    call = registry.start_call("x" * 400, "fake", {"tab": "csv", "mode": "swot"})
+    call.prompt_sent("x" * 40)
+    call.retry()
+    call.finish("phản hồi")
+    call.finish("phản hồi")
+    (row,) = registry.summary_table(("tab", "mode", "backend"))
+    assert (row["calls"], row["retries"], row["backend"]) == (1, 1, "fake")
+    assert row["avg_prompt_tokens"] < 400 / 4
+
+
+def test_prometheus_export(tmp_path):
+    registry = MetricsRegistry(export_path="")
+    # Chưa có lời gọi: vẫn xuất được (chỉ có HELP/TYPE)
+    assert "# TYPE swot_llm_calls_total counter" in registry.render_prometheus()
+
+    path = tmp_path / "metrics" / "swot.prom"
+    registry.export_path = str(path)
+    registry.record({"tab": 'a"b', "mode": "swot", "backend": "fake"}, 10, 3, 5, 0.2, 0.1, error=True)
+    text = path.read_text(encoding="utf-8")
+    assert 'swot_llm_calls_total{tab="a\\"b",mode="swot",backend="fake"} 1' in text
+    assert 'swot_llm_errors_total{tab="a\\"b",mode="swot",backend="fake"} 1' in text
+    assert 'swot_llm_latency_seconds{tab="a\\"b",mode="swot",backend="fake",quantile="0.5"} 0.200000' in text
@@ -0,0 +1,61 @@
+import threading
+
+import pytest
+
+import profiling
+from profiling import profile_section, start_profile
+
+
+@pytest.fixture
+def profile_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(profiling, "PROFILE_MIN_MS", 0)
+    return tmp_path
+
+
+def _run_in_thread(func):
+    result = []
+    thread = threading.Thread(target=lambda: result.append(func()))
+    thread.start()
+    thread.join()
+    return result[0]
+
+
+def test_interrupted_rerun_is_closed_by_next_rerun_on_another_thread(profile_dir):
+    def interrupted_rerun():
+        section = start_profile("rerun", scope="session-1", button="btn1")
+        with profile_section("tab", tab="name"):
+            sum(range(1000))
+        # Lượt chạy bị ngắt: không tới được section.stop()
+        return section
+
+    first = _run_in_thread(interrupted_rerun)
+    assert first.profiler is not None
+
+    def next_rerun():
+        section = start_profile("rerun", scope="session-1")
+        return section, section.stop()
+
+    second, path = _run_in_thread(next_rerun)
+    assert first.profiler is None and first.tags["interrupted"] == 1
+    assert path and "interrupted-1" not in path
+    assert len(list(profile_dir.glob("*interrupted-1*.prof"))) == 1
+    assert profiling._stacks == {}
+
+
+def test_sessions_do_not_close_each_other(profile_dir):
+    other = _run_in_thread(lambda: start_profile("rerun", scope="session-1"))
+    own = _run_in_thread(lambda: start_profile("rerun", scope="session-2"))
+    assert other.profiler is not None
+    other.stop()
+    own.stop()
+    assert not list(profile_dir.glob("*interrupted*"))
+
+
+def test_nothing_is_recorded_when_disabled(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_DIR", "")
+    section = start_profile("rerun", scope="session-1")
+    with profile_section("tab"):
+        pass
+    assert section.stop() is None
+    assert profiling._stacks == {}
@@ -0,0 +1,140 @@
+import time
+
+import pytest
+
+import rate_limit
+from llm_backend import FakeBackend, LLMBackendError
+from rate_limit import AIMDConcurrency, DeadlineExceededError, RateLimiter, TokenBucket, call_with_retry, stream_with_retry
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(rate_limit, "backoff_delay", lambda attempt: 0.01)
+
+
+def _limiter():
+    return RateLimiter(rpm=60_000, tpm=10_000_000, max_concurrency=8)
+
+
+def test_aimd_halves_once_per_wave_then_recovers():
+    aimd = AIMDConcurrency(8)
+    wave = [aimd.acquire() for _ in range(3)]
+    for permit in wave:
+        aimd.release(permit, throttled=True)
+    # Ba lời gọi cùng đợt bị 429: chỉ giảm một lần
+    assert aimd.limit == 4
+
+    aimd.release(aimd.acquire(), throttled=True)
+    assert aimd.limit == 2
+
+    limits = []
+    for _ in range(6):
+        aimd.release(aimd.acquire())
+        limits.append(aimd.limit)
+    assert limits == sorted(limits) and 3 < limits[-1] < 5
+    for _ in range(200):
+        aimd.release(aimd.acquire())
+    assert aimd.limit == 8
+
+
+def test_retry_gives_up_at_deadline():
+    calls = []
+
+    def unavailable(timeout):
+        calls.append(timeout)
+        raise LLMBackendError("503", code=503)
+
+    started = time.monotonic()
+    with pytest.raises(LLMBackendError):
+        call_with_retry(unavailable, limiter=_limiter(), deadline_seconds=0.2, max_retries=1000)
+    assert time.monotonic() - started < 0.5
+    assert len(calls) > 1
+    # timeout truyền cho mỗi lần thử là thời gian còn lại tới deadline
+    assert calls[0] <= 0.2
+
+
+def test_non_retryable_error_is_not_retried():
+    calls = []
+
+    def bad_request(timeout):
+        calls.append(timeout)
+        raise LLMBackendError("400", code=400)
+
+    with pytest.raises(LLMBackendError):
+        call_with_retry(bad_request, limiter=_limiter())
+    assert len(calls) == 1
+
+
+def test_fake_backend_errors_are_retried():
+    backend = FakeBackend(latency_seconds=0, chunk_delay_seconds=0, error_rate=0.5, seed=3)
+    limiter = _limiter()
+    retries = []
+    text = call_with_retry(lambda timeout: backend.generate("xin chào", timeout=timeout), limiter=limiter,
+                           max_retries=20, on_retry=lambda attempt, error: retries.append(error.code))
+    assert text and retries and set(retries) <= {429, 503}
+    assert backend.requests == len(retries) + 1
+
+
+def test_stream_is_not_retried_after_first_chunk():
+    opened = []
+
+    def open_stream(timeout):
+        opened.append(timeout)
+        yield "a"
+        raise LLMBackendError("503", code=503)
+
+    chunks = []
+    with pytest.raises(LLMBackendError):
+        for chunk in stream_with_retry(open_stream, limiter=_limiter()):
+            chunks.append(chunk)
+    assert chunks == ["a"] and len(opened) == 1
+
+
+def test_stream_is_retried_before_first_chunk_and_throttle_halves_limit():
+    limiter = _limiter()
+    opened = []
+
+    def open_stream(timeout):
+        opened.append(timeout)
+        if len(opened) == 1:
+            raise LLMBackendError("429", code=429)
+        yield from ["a", "b"]
+
+    assert list(stream_with_retry(open_stream, limiter=limiter)) == ["a", "b"]
+    assert len(opened) == 2
+    assert limiter.stats()["concurrency_limit"] == 4
+    assert limiter.stats()["in_flight"] == 0
+
+
+def test_token_bucket_wait_time():
+    bucket = TokenBucket(60)
+    now = time.monotonic()
+    assert bucket.wait_time(60, now) == 0
+    bucket.take(60)
+    assert bucket.wait_time(1, now) == pytest.approx(1.0)
+    assert bucket.wait_time(1, now + 0.5) == pytest.approx(0.5)
+
+
+def test_limiter_waits_for_tpm_and_respects_deadline():
+    limiter = RateLimiter(rpm=60_000, tpm=600)
+    limiter.release(limiter.acquire(600))
+
+    # TPM 600 = 10 token/giây: 1 token phải chờ ~0.1s
+    started = time.monotonic()
+    limiter.release(limiter.acquire(1))
+    assert time.monotonic() - started >= 0.08
+
+    with pytest.raises(DeadlineExceededError):
+        limiter.acquire(300, deadline=time.monotonic() + 0.2)
+    assert limiter.stats()["in_flight"] == 0
+
+
+def test_limiter_waits_for_rpm():
+    limiter = RateLimiter(rpm=600, tpm=10_000_000)
+    for _ in range(600):
+        limiter.release(limiter.acquire(1))
+    with pytest.raises(DeadlineExceededError):
+        limiter.acquire(1, deadline=time.monotonic() + 0.05)
+    started = time.monotonic()
+    limiter.release(limiter.acquire(1))
+    assert time.monotonic() - started >= 0.05
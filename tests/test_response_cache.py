@@ -0,0 +1,60 @@
+import time
+import zlib
+
+import pytest
+
+from response_cache import ResponseCache, make_cache_key
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    return now
+
+
+def _cache(tmp_path, **kwargs):
+    return ResponseCache(str(tmp_path / "responses.sqlite3"), **kwargs)
+
+
+def test_key_depends_on_prompt_model_and_config():
+    key = make_cache_key("prompt", "model", {"temperature": 0})
+    assert key == make_cache_key("prompt", "model", {"temperature": 0})
+    assert key != make_cache_key("prompt", "other", {"temperature": 0})
+    assert key != make_cache_key("prompt", "model", {"temperature": 1})
+    assert make_cache_key("prompt", "model") == make_cache_key("prompt", "model", {})
+
+
+def test_entry_expires_after_ttl(tmp_path, clock):
+    cache = _cache(tmp_path, ttl_seconds=60)
+    cache.set("a", "phản hồi")
+    clock[0] += 59
+    assert cache.get("a") == "phản hồi"
+    clock[0] += 2
+    assert cache.get("a") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entry_is_evicted_by_count(tmp_path, clock):
+    cache = _cache(tmp_path, max_entries=2)
+    cache.set("a", "A")
+    clock[0] += 1
+    cache.set("b", "B")
+    clock[0] += 1
+    # Đọc lại "a": "b" trở thành bản ghi ít dùng nhất
+    assert cache.get("a") == "A"
+    clock[0] += 1
+    cache.set("c", "C")
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == ("A", "C")
+
+
+def test_oldest_entries_are_evicted_by_size(tmp_path, clock):
+    size = len(zlib.compress("A".encode("utf-8")))
+    cache = _cache(tmp_path, max_bytes=3 * size)
+    for key in "abcd":
+        cache.set(key, key.upper())
+        clock[0] += 1
+    assert cache.stats() == {"entries": 3, "bytes": 3 * size}
+    assert cache.get("a") is None
+    assert [cache.get(key) for key in "bcd"] == ["B", "C", "D"]
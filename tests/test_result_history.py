@@ -0,0 +1,11 @@
+from result_history import ResultHistory
+
+
+def test_add_stamps_analyzed_at_once_and_keeps_data():
+    state = {}
+    history = ResultHistory(state)
+    data = {"scores": {"strengths": 7}}
+    entry = history.add("name", "swot", "A", data, "text", shop_name="A")
+    assert entry["analyzed_at"]
+    assert entry["data"] is data and data == {"scores": {"strengths": 7}}
+    assert history.entries("name") == [entry]
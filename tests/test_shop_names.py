@@ -0,0 +1,57 @@
+import pytest
+
+from prompt_layout import Prompt
+from shop_names import ShopNameIndex, fold_name, key_name_scope, key_text, use_shop_name
+import shop_names
+
+
+def test_only_exact_folded_matches_apply_automatically(tmp_path):
+    index = ShopNameIndex(str(tmp_path / "names.sqlite3"))
+    assert index.canonical("Passio") == "Passio"
+    assert index.canonical("PASSIO ") == "Passio"
+    # Gần giống nhưng chưa được xác nhận: không gộp, không ghi nhận
+    assert index.suggestion("Passion") == "Passio"
+    assert index.canonical("Passion") == "Passion"
+    assert index.suggestion("Passion") == "Passio"
+    assert index.canonical("Passion", accept_suggestion=True) == "Passio"
+    assert index.suggestion("passion") is None
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    index = ShopNameIndex(str(tmp_path / "names.sqlite3"))
+    monkeypatch.setattr(shop_names, "_index_instance", index)
+    return index
+
+
+def _key(name, context=""):
+    with key_name_scope():
+        name = use_shop_name(name)
+        return name, key_text(Prompt("Phân tích SWOT", context, f"🏪 QUÁN: {name}"))
+
+
+def test_prompt_keeps_user_text_and_key_uses_canonical(index):
+    name, key = _key("Highlands")
+    assert name == "Highlands"
+    name, other = _key("  HIGHLANDS ")
+    assert name == "HIGHLANDS"
+    assert other == key
+    # Ngoài phạm vi: key là nguyên prompt
+    assert key_text(Prompt(query="Phân tích quán HIGHLANDS")) == "Phân tích quán HIGHLANDS"
+
+
+def test_name_in_csv_context_is_not_rewritten(index):
+    index.canonical("Tea")
+    # Hai file CSV chỉ khác chữ hoa/thường của "tea" trong dữ liệu: key phải khác nhau
+    _, key = _key("tea", context="Món,Loại\nMatcha,tea\n")
+    _, other = _key("tea", context="Món,Loại\nMatcha,Tea\n")
+    assert key != other
+    # Tên trong query chỉ thay nguyên từ
+    with key_name_scope():
+        use_shop_name("tea")
+        assert "🏪 QUÁN: Tea" in key_text(Prompt(query="🏪 QUÁN: tea · steak"))
+        assert "steak" in key_text(Prompt(query="🏪 QUÁN: tea · steak"))
+
+
+def test_fold_name():
+    assert fold_name("Phúc Long  Coffee & Tea") == "phuc long coffee tea"
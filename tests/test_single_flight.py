@@ -0,0 +1,87 @@
+import threading
+
+import pytest
+
+from single_flight import FlightAborted, SingleFlight
+
+
+def _boom():
+    raise RuntimeError("backend down")
+
+
+def test_stream_leader_error_is_released_and_next_call_runs():
+    flights = SingleFlight()
+    chunks, shared = flights.stream("k", _boom)
+    assert not shared
+    with pytest.raises(RuntimeError):
+        list(chunks)
+    assert flights.in_flight() == 0
+
+    chunks, shared = flights.stream("k", lambda: iter(["a", "b"]))
+    assert not shared and "".join(chunks) == "ab"
+
+
+def test_stream_closed_before_first_chunk_releases_follower():
+    flights = SingleFlight()
+    leader, _ = flights.stream("k", lambda: iter(["never"]))
+    follower, shared = flights.stream("k", lambda: iter(["own"]))
+    assert shared
+
+    result = []
+    thread = threading.Thread(target=lambda: result.append("".join(follower)))
+    thread.start()
+    leader.close()
+    thread.join(timeout=5)
+
+    # Leader chưa gọi fn(): follower tự gọi lại
+    assert result == ["own"]
+    assert flights.in_flight() == 0
+
+
+def test_run_error_reaches_followers_and_counts_leave():
+    flights = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+
+    def slow_fail():
+        started.set()
+        release.wait(5)
+        raise RuntimeError("backend down")
+
+    errors = []
+
+    def call(fn):
+        try:
+            flights.run("k", fn)
+        except RuntimeError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call, args=(slow_fail,))
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=call, args=(_boom,))
+    follower.start()
+    while flights._flights["k"].followers == 0:
+        pass
+    flight = flights._flights["k"]
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert len(errors) == 2
+    assert flight.followers == 0
+    assert flights.run("k", lambda: "ok") == ("ok", False)
+
+
+def test_leader_stops_after_follower_left_cancels_call():
+    flights = SingleFlight()
+    leader, _ = flights.stream("k", lambda: iter(["a", "b"]))
+    assert next(leader) == "a"
+    flight = flights._flights["k"]
+    follower, _ = flights.stream("k", lambda: iter(["own"]))
+    assert next(follower) == "a"
+    follower.close()
+    # Follower đã rời: leader dừng thì lời gọi bị hủy, không đọc tiếp ở nền
+    leader.close()
+    assert flights.in_flight() == 0
+    assert flight.followers == 0
+    assert isinstance(flight.error, FlightAborted)
@@ -0,0 +1,24 @@
+import pytest
+
+from swot_schema import parse_json_block, parse_json_response
+
+
+def test_parse_json_block_reads_fenced_json_and_clamps_scores():
+    text = 'Bài phân tích...\n```json\n{"name": "A", "scores": {"strengths": 12, "threats": 0.4}}\n```\n'
+    data = parse_json_block(text)
+    assert data["name"] == "A"
+    assert data["scores"] == {"strengths": 10, "threats": 1}
+
+
+@pytest.mark.parametrize("text", [
+    "Bài phân tích không có block JSON",
+    '```json\n{"name": "A", "scores": \n```',
+    '```json\n["không phải object"]\n```',
+])
+def test_parse_json_block_rejects_missing_or_invalid_json(text):
+    with pytest.raises(ValueError):
+        parse_json_block(text)
+
+
+def test_parse_json_response_accepts_fenced_payload():
+    assert parse_json_response('```json\n{"a": 1}\n```') == {"a": 1}